@@ -1,16 +1,29 @@
-from flask import Flask, render_template, request, jsonify
+import os
+import hmac
+import json
+import math
+from time import perf_counter
+import logging
+from flask import Flask, Response, render_template, request, jsonify, g
 import get_stock_quote
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import quote_client
+import metrics
+import sampling_profiler
+import response_encoding
+import order_book
+import indicators
+from models import (Session, Watchlist, StockQuote, init_db, save_stock_quote, save_stock_quotes_bulk,
+                    bump_watchlist_version, get_indicator_snapshot)
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+import watchlist_cache
 from datetime import datetime, time, date
 
 app = Flask(__name__)
+# JSON 序列化：orjson（已安装时）、UTF-8 直出中文、不排序键
+app.json = response_encoding.FastJSONProvider(app)
 
-# 创建数据库引擎
-engine = create_engine('sqlite:///stock_data.db', echo=False)
-Base = declarative_base()
-Session = sessionmaker(bind=engine)
+logger = logging.getLogger(__name__)
 
 # 检查是否在交易时间内
 def is_trading_time():
@@ -36,65 +49,146 @@ def is_trading_time():
     
     return is_morning_trading or is_afternoon_trading
 
-# 定义关注列表数据模型
-class Watchlist(Base):
-    __tablename__ = 'watchlist'
+# 创建表
+init_db()
+
+# 实时行情的增量盘口分析（每次从上游获取到新行情时更新）
+order_book_tracker = order_book.OrderBookTracker()
+
+# 记录每个请求的处理耗时
+@app.before_request
+def start_request_timer():
+    g.request_start = perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # 使用路由模板而不是实际路径作为标签，避免每个股票代码产生一组新指标
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.API_LATENCY.observe(perf_counter() - start, route=route,
+                                    method=request.method, status=str(response.status_code))
+    return response
+
+# 按客户端支持的编码（br/gzip）压缩响应
+@app.after_request
+def compress_response(response):
+    return response_encoding.compress_response(response, request.headers.get('Accept-Encoding'))
+
+# 请求参数 format=compact 时返回紧凑格式
+def wants_compact():
+    return request.args.get('format') == 'compact'
+
+# 返回单只股票行情（默认格式或紧凑格式）
+def quote_response(stock_info):
+    if wants_compact():
+        return jsonify(response_encoding.compact_quote(stock_info))
+    return jsonify(stock_info)
+
+# 指标接口（Prometheus文本格式）
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus 指标。gunicorn 多个工作进程时各进程的注册表相互独立：
+    设置了 STOCK_METRICS_DIR（serve.py 多进程启动时自动设置）时汇总所有工作进程，
+    其他进程的数据最多滞后 metrics.MULTIPROCESS_DUMP_INTERVAL 秒；否则只反映处理本次请求的进程
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# 管理接口需要携带与环境变量 STOCK_ADMIN_TOKEN 一致的 X-Admin-Token 请求头；
+# 设置 STOCK_ADMIN_ALLOW_LOCAL=1 时本机请求也可以访问（经反向代理转发的请求来源地址都是本机，默认不启用）
+def is_admin_request():
+    token = os.environ.get('STOCK_ADMIN_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return True
+    if os.environ.get('STOCK_ADMIN_ALLOW_LOCAL') == '1':
+        return request.remote_addr in ('127.0.0.1', '::1')
+    return False
+
+# 采样分析接口：POST 开始一次采样（参数 seconds、interval），GET 查看当前或最近一次的汇总结果
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    if not is_admin_request():
+        return jsonify({'error': '无权访问'}), 403
     
-    id = Column(Integer, primary_key=True)
-    stock_code = Column(String(10), unique=True, index=True)
-    stock_name = Column(String(50))
-    market = Column(String(10))
-    added_at = Column(DateTime, default=datetime.now)
-
-# 定义股票行情数据模型
-class StockQuote(Base):
-    __tablename__ = 'stock_quotes'
+    if request.method == 'POST':
+        try:
+            seconds = float(request.args.get('seconds', 30))
+            interval = float(request.args.get('interval', sampling_profiler.DEFAULT_INTERVAL))
+            if not (math.isfinite(seconds) and math.isfinite(interval)) or seconds <= 0 or interval <= 0:
+                raise ValueError
+            # 超出范围的间隔按上下限处理，时长由 start_profiling 限制在 MAX_DURATION 以内
+            interval = sampling_profiler.clamp_interval(interval)
+            profiler = sampling_profiler.start_profiling(seconds, interval, label='web')
+        except ValueError:
+            return jsonify({'error': '参数格式无效'}), 400
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify({
+            'success': True,
+            'message': f'采样分析已开始，结果将写入 {sampling_profiler.PROFILE_DIR} 目录',
+            'started_at': profiler.started_at.isoformat(timespec='seconds')
+        })
     
-    id = Column(Integer, primary_key=True)
-    stock_code = Column(String(10), index=True)
-    stock_name = Column(String(50))
-    market = Column(String(10))
-    current_price = Column(Float)
-    change_price = Column(Float)
-    change_percent = Column(Float)
-    open_price = Column(Float)
-    pre_close = Column(Float)
-    high_price = Column(Float)
-    low_price = Column(Float)
-    volume = Column(String(20))
-    amount = Column(String(20))
-    buy1_price = Column(Float)
-    buy1_amount = Column(Integer)
-    buy2_price = Column(Float)
-    buy2_amount = Column(Integer)
-    buy3_price = Column(Float)
-    buy3_amount = Column(Integer)
-    buy4_price = Column(Float)
-    buy4_amount = Column(Integer)
-    buy5_price = Column(Float)
-    buy5_amount = Column(Integer)
-    sell1_price = Column(Float)
-    sell1_amount = Column(Integer)
-    sell2_price = Column(Float)
-    sell2_amount = Column(Integer)
-    sell3_price = Column(Float)
-    sell3_amount = Column(Integer)
-    sell4_price = Column(Float)
-    sell4_amount = Column(Integer)
-    sell5_price = Column(Float)
-    sell5_amount = Column(Integer)
-    date = Column(String(10), index=True)
-    time = Column(String(8))
-    created_at = Column(DateTime, default=datetime.now)
-
-# 创建表
-Base.metadata.create_all(engine)
+    profiler = sampling_profiler.current_profiler()
+    if profiler is None:
+        return jsonify({'error': '尚未进行采样分析'}), 404
+    try:
+        limit = int(request.args.get('limit', 50))
+        if limit <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'limit 参数必须为正整数'}), 400
+    return jsonify(profiler.summary(limit=limit))
 
 # 主页路由
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# 数据库中的一条行情记录转换为与实时行情相同格式的字典
+def quote_row_to_info(quote):
+    # 涨跌额按品种精度由当前价和昨收价重新计算（早期记录对3位小数的基金按2位小数取整）
+    meta = get_stock_quote.get_symbol_meta(quote.stock_code)
+    change_ticks = get_stock_quote.to_ticks(quote.current_price, meta) - get_stock_quote.to_ticks(quote.pre_close, meta)
+    return {
+        '股票代码': quote.stock_code,
+        '股票名称': quote.stock_name,
+        '市场': quote.market,
+        '当前价格': quote.current_price,
+        '涨跌额': get_stock_quote.from_ticks(change_ticks, meta),
+        '涨跌幅': f"{quote.change_percent}%",
+        '今日开盘价': quote.open_price,
+        '昨日收盘价': quote.pre_close,
+        '今日最高价': quote.high_price,
+        '今日最低价': quote.low_price,
+        '成交量': quote.volume,
+        '成交额': quote.amount,
+        '买一报价': quote.buy1_price,
+        '买一申报': quote.buy1_amount,
+        '买二报价': quote.buy2_price,
+        '买二申报': quote.buy2_amount,
+        '买三报价': quote.buy3_price,
+        '买三申报': quote.buy3_amount,
+        '买四报价': quote.buy4_price,
+        '买四申报': quote.buy4_amount,
+        '买五报价': quote.buy5_price,
+        '买五申报': quote.buy5_amount,
+        '卖一报价': quote.sell1_price,
+        '卖一申报': quote.sell1_amount,
+        '卖二报价': quote.sell2_price,
+        '卖二申报': quote.sell2_amount,
+        '卖三报价': quote.sell3_price,
+        '卖三申报': quote.sell3_amount,
+        '卖四报价': quote.sell4_price,
+        '卖四申报': quote.sell4_amount,
+        '卖五报价': quote.sell5_price,
+        '卖五申报': quote.sell5_amount,
+        '日期': quote.date,
+        '时间': quote.time,
+        '价格小数位数': meta.decimals
+    }
+
 # 获取股票数据的API接口
 @app.route('/api/stock/<stock_code>')
 def get_stock_data(stock_code):
@@ -102,58 +196,31 @@ def get_stock_data(stock_code):
     try:
         # 检查是否在交易时间内
         if is_trading_time():
-            # 在交易时间内，实时获取股票数据
-            stock_info = get_stock_quote.get_stock_quote(stock_code)
-            if stock_info:
+            # 在交易时间内，实时获取股票数据（上游不可用时返回标记为过期的最近一次数据）
+            try:
+                quotes, fetched = quote_client.lookup_quotes([stock_code])
+            except ValueError:
+                session.close()
+                return jsonify({'error': '股票代码格式无效'}), 400
+            except quote_client.QuoteUnavailableError as e:
+                logger.warning("获取股票数据失败: %s", e)
+                quotes, fetched = {}, set()
+            stock_info = quotes.get(stock_code)
+            if not stock_info:
+                session.close()
+                return jsonify({'error': '获取股票数据失败'}), 404
+            # 只写入本次从上游新获取的数据，缓存命中和过期数据不重复写入
+            if stock_code in fetched:
+                order_book_tracker.update(stock_info)
                 # 存储数据到数据库
                 try:
-                    stock_quote = StockQuote(
-                        stock_code=stock_info['股票代码'],
-                        stock_name=stock_info['股票名称'],
-                        market=stock_info['市场'],
-                        current_price=stock_info['当前价格'],
-                        change_price=stock_info['涨跌额'],
-                        change_percent=float(stock_info['涨跌幅'].replace('%', '')),
-                        open_price=stock_info['今日开盘价'],
-                        pre_close=stock_info['昨日收盘价'],
-                        high_price=stock_info['今日最高价'],
-                        low_price=stock_info['今日最低价'],
-                        volume=stock_info['成交量'],
-                        amount=stock_info['成交额'],
-                        buy1_price=stock_info['买一报价'],
-                        buy1_amount=stock_info['买一申报'],
-                        buy2_price=stock_info['买二报价'],
-                        buy2_amount=stock_info['买二申报'],
-                        buy3_price=stock_info['买三报价'],
-                        buy3_amount=stock_info['买三申报'],
-                        buy4_price=stock_info['买四报价'],
-                        buy4_amount=stock_info['买四申报'],
-                        buy5_price=stock_info['买五报价'],
-                        buy5_amount=stock_info['买五申报'],
-                        sell1_price=stock_info['卖一报价'],
-                        sell1_amount=stock_info['卖一申报'],
-                        sell2_price=stock_info['卖二报价'],
-                        sell2_amount=stock_info['卖二申报'],
-                        sell3_price=stock_info['卖三报价'],
-                        sell3_amount=stock_info['卖三申报'],
-                        sell4_price=stock_info['卖四报价'],
-                        sell4_amount=stock_info['卖四申报'],
-                        sell5_price=stock_info['卖五报价'],
-                        sell5_amount=stock_info['卖五申报'],
-                        date=stock_info['日期'],
-                        time=stock_info['时间']
-                    )
-                    session.add(stock_quote)
-                    session.commit()
+                    save_stock_quote(session, stock_info, mode="api")
                 except Exception as db_error:
                     session.rollback()
-                    print(f"数据库存储失败: {db_error}")
-                
-                session.close()
-                return jsonify(stock_info)
-            else:
-                session.close()
-                return jsonify({'error': '获取股票数据失败'}), 404
+                    metrics.DB_WRITE_FAILURES.inc(mode="api")
+                    logger.error("数据库存储失败: %s", db_error)
+            session.close()
+            return quote_response(stock_info)
         else:
             # 不在交易时间内，返回数据库中的最新数据
             latest_quote = session.query(StockQuote)\
@@ -162,44 +229,9 @@ def get_stock_data(stock_code):
                 .first()
             
             if latest_quote:
-                stock_info = {
-                    '股票代码': latest_quote.stock_code,
-                    '股票名称': latest_quote.stock_name,
-                    '市场': latest_quote.market,
-                    '当前价格': latest_quote.current_price,
-                    '涨跌额': latest_quote.change_price,
-                    '涨跌幅': f"{latest_quote.change_percent}%",
-                    '今日开盘价': latest_quote.open_price,
-                    '昨日收盘价': latest_quote.pre_close,
-                    '今日最高价': latest_quote.high_price,
-                    '今日最低价': latest_quote.low_price,
-                    '成交量': latest_quote.volume,
-                    '成交额': latest_quote.amount,
-                    '买一报价': latest_quote.buy1_price,
-                    '买一申报': latest_quote.buy1_amount,
-                    '买二报价': latest_quote.buy2_price,
-                    '买二申报': latest_quote.buy2_amount,
-                    '买三报价': latest_quote.buy3_price,
-                    '买三申报': latest_quote.buy3_amount,
-                    '买四报价': latest_quote.buy4_price,
-                    '买四申报': latest_quote.buy4_amount,
-                    '买五报价': latest_quote.buy5_price,
-                    '买五申报': latest_quote.buy5_amount,
-                    '卖一报价': latest_quote.sell1_price,
-                    '卖一申报': latest_quote.sell1_amount,
-                    '卖二报价': latest_quote.sell2_price,
-                    '卖二申报': latest_quote.sell2_amount,
-                    '卖三报价': latest_quote.sell3_price,
-                    '卖三申报': latest_quote.sell3_amount,
-                    '卖四报价': latest_quote.sell4_price,
-                    '卖四申报': latest_quote.sell4_amount,
-                    '卖五报价': latest_quote.sell5_price,
-                    '卖五申报': latest_quote.sell5_amount,
-                    '日期': latest_quote.date,
-                    '时间': latest_quote.time
-                }
+                stock_info = quote_row_to_info(latest_quote)
                 session.close()
-                return jsonify(stock_info)
+                return quote_response(stock_info)
             else:
                 session.close()
                 return jsonify({'error': '数据库中没有该股票的历史数据'}), 404
@@ -212,22 +244,27 @@ def get_stock_data(stock_code):
 def get_stock_history(stock_code):
     session = Session()
     try:
-        # 查询最近20条历史数据
-        quotes = session.query(StockQuote)\
+        # 查询最近20条历史数据（只取需要的列，不构造完整的ORM对象）
+        quotes = session.query(StockQuote.current_price, StockQuote.created_at)\
             .filter_by(stock_code=stock_code)\
             .order_by(StockQuote.created_at.desc())\
             .limit(20)\
-            .all()\
+            .all()
+        session.close()
+        
+        # 紧凑格式：按列返回，时间为Unix时间戳（秒）
+        if wants_compact():
+            return jsonify(response_encoding.columnar(
+                ((price, int(created_at.timestamp())) for price, created_at in quotes), ('p', 'ts')))
         
         # 转换为JSON格式
         history_data = []
-        for quote in quotes:
+        for current_price, created_at in quotes:
             history_data.append({
-                'current_price': quote.current_price,
-                'created_at': quote.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                'current_price': current_price,
+                'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S')
             })
         
-        session.close()
         return jsonify(history_data)
     except Exception as e:
         session.close()
@@ -241,53 +278,329 @@ def get_stock_day_data(stock_code):
         # 获取当天日期
         today = datetime.now().strftime('%Y-%m-%d')
         
-        # 查询当天的所有股票行情数据
-        quotes = session.query(StockQuote)\
+        # 查询当天的所有股票行情数据（只取需要的列，不构造完整的ORM对象）
+        quotes = session.query(StockQuote.current_price, StockQuote.time, StockQuote.created_at)\
             .filter_by(stock_code=stock_code)\
             .filter(StockQuote.date == today)\
             .order_by(StockQuote.created_at.asc())\
-            .all()\
+            .all()
+        session.close()
+        
+        # 紧凑格式：按列返回，时间为Unix时间戳（秒）
+        if wants_compact():
+            return jsonify(response_encoding.columnar(
+                ((price, time_str, int(created_at.timestamp())) for price, time_str, created_at in quotes),
+                ('p', 't', 'ts')))
         
         # 转换为JSON格式
         day_data = []
-        for quote in quotes:
+        for current_price, time_str, created_at in quotes:
             day_data.append({
-                'current_price': quote.current_price,
-                'time': quote.time,
-                'created_at': quote.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                'current_price': current_price,
+                'time': time_str,
+                'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S')
             })
         
-        session.close()
         return jsonify(day_data)
     except Exception as e:
         session.close()
         return jsonify({'error': str(e)}), 500
 
-# 获取关注列表的API接口
-@app.route('/api/watchlist')
-def get_watchlist():
+# 解析批量接口的 codes 参数（逗号分隔，去重并保持顺序）
+def parse_codes_param():
+    codes = request.args.get('codes', '')
+    return list(dict.fromkeys(code.strip() for code in codes.split(',') if code.strip()))
+
+# 批量接口的参数校验，返回错误响应或 None
+def validate_codes(codes):
+    if not codes:
+        return jsonify({'error': '请通过 codes 参数提供股票代码，多个代码以逗号分隔'}), 400
+    if len(codes) > get_stock_quote.BATCH_SIZE:
+        return jsonify({'error': f'单次最多查询 {get_stock_quote.BATCH_SIZE} 只股票'}), 400
+    return None
+
+# 股票代码格式是否有效（能确定所属市场）
+def is_valid_code(code):
+    try:
+        get_stock_quote.get_full_code(code)
+    except ValueError:
+        return False
+    return True
+
+# 查询每只股票最近的 limit 条行情：一次 IN 查询，用 ROW_NUMBER 窗口函数按股票分组取最新记录
+# 窗口函数只作用于 (stock_code, created_at) 复合索引中的列，再按主键取回需要的列
+def latest_quotes_query(session, columns, codes, limit=1, trade_date=None):
+    row_number = func.row_number().over(
+        partition_by=StockQuote.stock_code,
+        order_by=StockQuote.created_at.desc()
+    ).label('row_number')
+    query = session.query(StockQuote.id.label('id'), row_number).filter(StockQuote.stock_code.in_(codes))
+    if trade_date:
+        query = query.filter(StockQuote.date == trade_date)
+    ranked = query.subquery()
+    return session.query(*columns)\
+        .join(ranked, StockQuote.id == ranked.c.id)\
+        .filter(ranked.c.row_number <= limit)\
+        .order_by(StockQuote.created_at.asc())
+
+# 批量获取多只股票行情的API接口：/api/stocks?codes=600000,000001
+# 交易时间内合并为一次行情缓存查询（未命中的代码合并为一次上游请求），非交易时间用一次SQL查询取各自的最新记录
+@app.route('/api/stocks')
+def get_stocks_data():
+    codes = parse_codes_param()
+    error = validate_codes(codes)
+    if error:
+        return error
+    
+    # 格式无效的代码不向上游请求，放入 missing 并在 invalid 中列出，其余代码正常返回
+    invalid = [code for code in codes if not is_valid_code(code)]
+    valid_codes = [code for code in codes if code not in invalid]
+    
     session = Session()
     try:
-        # 查询所有关注的股票
-        watchlist_items = session.query(Watchlist).all()
+        if is_trading_time():
+            try:
+                quotes, fetched_codes = quote_client.lookup_quotes(valid_codes) if valid_codes else ({}, set())
+            except quote_client.QuoteUnavailableError as e:
+                logger.warning("批量获取股票数据失败: %s", e)
+                quotes, fetched_codes = {}, set()
+            # 只写入本次从上游新获取的数据，缓存命中和过期数据不重复写入
+            fetched = [quotes[code] for code in codes if code in fetched_codes]
+            for stock_info in fetched:
+                order_book_tracker.update(stock_info)
+            if fetched:
+                try:
+                    save_stock_quotes_bulk(session, fetched, mode="api")
+                except Exception as db_error:
+                    session.rollback()
+                    metrics.DB_WRITE_FAILURES.inc(mode="api")
+                    logger.error("数据库存储失败: %s", db_error)
+        else:
+            rows = latest_quotes_query(session, StockQuote.__table__.columns, codes).all()
+            quotes = {row.stock_code: quote_row_to_info(row) for row in rows}
+        session.close()
         
-        # 转换为JSON格式
-        watchlist_data = []
-        for item in watchlist_items:
-            watchlist_data.append({
-                'id': item.id,
-                'stock_code': item.stock_code,
-                'stock_name': item.stock_name,
-                'market': item.market,
-                'added_at': item.added_at.strftime('%Y-%m-%d %H:%M:%S')
-            })
+        encode = response_encoding.compact_quote if wants_compact() else (lambda stock_info: stock_info)
+        return jsonify({
+            'data': {code: encode(quotes[code]) for code in codes if code in quotes},
+            'missing': [code for code in codes if code not in quotes],
+            'invalid': invalid
+        })
+    except Exception as e:
+        session.close()
+        return jsonify({'error': str(e)}), 500
+
+# 批量获取多只股票全天价格数据的API接口：/api/stocks/day?codes=600000,000001
+# 参数 points 可只返回每只股票最近的若干个数据点
+@app.route('/api/stocks/day')
+def get_stocks_day_data():
+    codes = parse_codes_param()
+    error = validate_codes(codes)
+    if error:
+        return error
+    try:
+        points = int(request.args['points']) if 'points' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'points 参数必须为整数'}), 400
+    
+    session = Session()
+    try:
+        today = datetime.now().strftime('%Y-%m-%d')
+        columns = (StockQuote.stock_code, StockQuote.current_price, StockQuote.time, StockQuote.created_at)
+        if points:
+            rows = latest_quotes_query(session, columns, codes, points, today).all()
+        else:
+            rows = session.query(*columns)\
+                .filter(StockQuote.stock_code.in_(codes))\
+                .filter(StockQuote.date == today)\
+                .order_by(StockQuote.created_at.asc())\
+                .all()
+        session.close()
         
+        series = {code: [] for code in codes}
+        for stock_code, current_price, time_str, created_at in rows:
+            series[stock_code].append((current_price, time_str, created_at))
+        
+        if wants_compact():
+            data = {code: response_encoding.columnar(
+                        ((price, time_str, int(created_at.timestamp())) for price, time_str, created_at in ticks),
+                        ('p', 't', 'ts'))
+                    for code, ticks in series.items()}
+        else:
+            data = {code: [{
+                        'current_price': price,
+                        'time': time_str,
+                        'created_at': created_at.strftime('%Y-%m-%d %H:%M:%S')
+                    } for price, time_str, created_at in ticks]
+                    for code, ticks in series.items()}
+        return jsonify({'data': data})
+    except Exception as e:
         session.close()
-        return jsonify(watchlist_data)
+        return jsonify({'error': str(e)}), 500
+
+# 盘口分析接口：/api/stock/<code>/orderbook?window=20&date=YYYY-MM-DD
+# 返回当天（或指定日期）逐笔的价差、中间价、微价格、申报量失衡和压力（按列），以及最新一笔的特征；
+# 交易时间内实时行情增量计算的结果比数据库中的记录更新时，最新特征取增量计算的结果
+@app.route('/api/stock/<stock_code>/orderbook')
+def get_stock_order_book(stock_code):
+    try:
+        window = int(request.args.get('window', order_book.DEFAULT_WINDOW))
+    except ValueError:
+        return jsonify({'error': 'window 参数必须为整数'}), 400
+    trade_date = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    
+    session = Session()
+    try:
+        book = order_book.load_book_arrays(session, [stock_code], trade_date).get(stock_code)
+        session.close()
+        
+        series = {}
+        latest = None
+        if book is not None:
+            features = order_book.analyze(book, window)
+            series['ts'] = features.pop('timestamps').astype(int).tolist()
+            series.update({name: order_book.to_json_list(values) for name, values in features.items()})
+            latest = {name: values[-1] for name, values in series.items()}
+        
+        # 增量计算的结果只来自本进程处理过的实时行情，采集服务写入数据库的记录可能更新，取两者中较新的一笔
+        live = order_book_tracker.latest(stock_code) if is_trading_time() else None
+        if live is not None and trade_date == datetime.now().strftime('%Y-%m-%d') \
+                and (latest is None or live['timestamp'] > latest['ts']):
+            latest = {name: (None if value != value else value) for name, value in live.items()}
+            latest['ts'] = int(latest.pop('timestamp'))
+        
+        if book is None and latest is None:
+            return jsonify({'error': '没有该股票的盘口数据'}), 404
+        return jsonify({'window': window, 'date': trade_date, 'latest': latest, 'series': series})
+    except Exception as e:
+        session.close()
+        return jsonify({'error': str(e)}), 500
+
+# 批量盘口分析接口：/api/stocks/orderbook?codes=600000,000001&window=20
+# 一次查询加载全部股票当天的盘口，向量化计算后返回每只股票最新一笔的特征
+@app.route('/api/stocks/orderbook')
+def get_stocks_order_book():
+    codes = parse_codes_param()
+    error = validate_codes(codes)
+    if error:
+        return error
+    try:
+        window = int(request.args.get('window', order_book.DEFAULT_WINDOW))
+    except ValueError:
+        return jsonify({'error': 'window 参数必须为整数'}), 400
+    trade_date = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    
+    session = Session()
+    try:
+        books = order_book.load_book_arrays(session, codes, trade_date)
+        session.close()
+        
+        data = {}
+        for code, features in order_book.backtest_inputs(books, window).items():
+            latest = {name: order_book.to_json_list(values[-1:])[0] for name, values in features.items()}
+            latest['ts'] = int(latest.pop('timestamps'))
+            data[code] = latest
+        return jsonify({
+            'window': window,
+            'date': trade_date,
+            'data': data,
+            'missing': [code for code in codes if code not in data]
+        })
+    except Exception as e:
+        session.close()
+        return jsonify({'error': str(e)}), 500
+
+# 技术指标接口：/api/stock/<code>/indicators?ind=ema:12,boll:20:2,rsi:14&interval=60&date=YYYY-MM-DD
+# 当天（或指定日期）的tick聚合为K线后计算指标，按列返回K线和各指标（与K线一一对应，数据不足时为 null）；
+# 结果按 (股票, 指标, 参数) 缓存，没有新数据时不重新计算
+@app.route('/api/stock/<stock_code>/indicators')
+def get_stock_indicators(stock_code):
+    specs = [spec for spec in request.args.get('ind', '').split(',') if spec.strip()] or indicators.DEFAULT_SPECS
+    try:
+        interval = int(request.args.get('interval', indicators.DEFAULT_INTERVAL))
+        if interval <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'interval 参数必须为正整数（秒）'}), 400
+    try:
+        for spec in specs:
+            indicators.parse_spec(spec)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    trade_date = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    
+    session = Session()
+    try:
+        bars, results = indicators.history_indicators(session, stock_code, trade_date, specs, interval)
+        session.close()
+        
+        if len(bars.close) == 0:
+            return jsonify({'error': '没有该股票的行情数据'}), 404
+        series = {}
+        for spec, values in results.items():
+            if isinstance(values, dict):
+                series[spec] = {part: order_book.to_json_list(array) for part, array in values.items()}
+            else:
+                series[spec] = order_book.to_json_list(values)
+        return jsonify({
+            'interval': interval,
+            'date': trade_date,
+            'bars': {
+                'ts': bars.start.astype(int).tolist(),
+                'o': bars.open.tolist(),
+                'h': bars.high.tolist(),
+                'l': bars.low.tolist(),
+                'c': bars.close.tolist(),
+                'v': bars.volume.astype(int).tolist(),
+            },
+            'indicators': series
+        })
+    except Exception as e:
+        session.close()
+        return jsonify({'error': str(e)}), 500
+
+# 最新指标接口：/api/stock/<code>/indicators/latest
+# 返回采集服务增量计算、按K线写入的最新一根K线及其指标（无需重新聚合当天tick）
+@app.route('/api/stock/<stock_code>/indicators/latest')
+def get_latest_indicators(stock_code):
+    session = Session()
+    try:
+        snapshot = get_indicator_snapshot(session, stock_code)
+        session.close()
+        
+        if snapshot is None:
+            return jsonify({'error': '采集服务尚未计算该股票的指标'}), 404
+        return jsonify({
+            'interval': snapshot.interval,
+            'bar_ts': snapshot.bar_start,
+            'bar': json.loads(snapshot.bar),
+            'indicators': json.loads(snapshot.values),
+            'updated_at': snapshot.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+        })
     except Exception as e:
         session.close()
         return jsonify({'error': str(e)}), 500
 
+# 关注列表项转换为JSON格式
+def watchlist_item_to_dict(item):
+    return {
+        'id': item.id,
+        'stock_code': item.stock_code,
+        'stock_name': item.stock_name,
+        'market': item.market,
+        'added_at': item.added_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+# 获取关注列表的API接口
+@app.route('/api/watchlist')
+def get_watchlist():
+    try:
+        # 从内存快照读取，关注列表未变化时不访问数据库
+        snapshot = watchlist_cache.get_snapshot()
+        return jsonify([watchlist_item_to_dict(item) for item in snapshot.items])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # 添加股票到关注列表的API接口
 @app.route('/api/watchlist/add', methods=['POST'])
 def add_to_watchlist():
@@ -300,14 +613,13 @@ def add_to_watchlist():
             session.close()
             return jsonify({'error': '股票代码不能为空'}), 400
         
-        # 检查股票是否已在关注列表中
-        existing_item = session.query(Watchlist).filter_by(stock_code=stock_code).first()
-        if existing_item:
+        # 检查股票是否已在关注列表中（数据库唯一约束兜底）
+        if watchlist_cache.get_snapshot().find(stock_code):
             session.close()
             return jsonify({'error': '股票已在关注列表中'}), 400
         
-        # 获取股票信息
-        stock_info = get_stock_quote.get_stock_quote(stock_code)
+        # 获取股票信息（最近获取过的股票直接使用缓存）
+        stock_info = quote_client.get_quote(stock_code)
         if not stock_info:
             session.close()
             return jsonify({'error': '获取股票信息失败'}), 404
@@ -318,17 +630,19 @@ def add_to_watchlist():
             stock_name=stock_info['股票名称'],
             market=stock_info['市场']
         )
-        session.add(watchlist_item)
-        session.commit()
+        try:
+            session.add(watchlist_item)
+            bump_watchlist_version(session)
+            session.commit()
+        except IntegrityError:
+            # 内存快照可能尚未包含刚刚（或同时）添加的股票，由唯一约束判定重复
+            session.rollback()
+            session.close()
+            return jsonify({'error': '股票已在关注列表中'}), 400
+        watchlist_cache.notify_changed()
         
         # 在关闭session之前获取所有需要的属性值
-        watchlist_data = {
-            'id': watchlist_item.id,
-            'stock_code': watchlist_item.stock_code,
-            'stock_name': watchlist_item.stock_name,
-            'market': watchlist_item.market,
-            'added_at': watchlist_item.added_at.strftime('%Y-%m-%d %H:%M:%S')
-        }
+        watchlist_data = watchlist_item_to_dict(watchlist_item)
         
         session.close()
         return jsonify({
@@ -341,6 +655,90 @@ def add_to_watchlist():
         session.close()
         return jsonify({'error': str(e)}), 500
 
+# 批量增删关注股票的API接口
+# 请求体: {"add": ["600000", "000001"], "remove": ["300750"]}
+# 待添加的股票通过一次批量行情请求校验并获取名称，全部修改在一个事务中提交
+@app.route('/api/watchlist/bulk', methods=['POST'])
+def bulk_update_watchlist():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体必须为JSON对象'}), 400
+    for key in ('add', 'remove'):
+        if data.get(key) is not None and not isinstance(data[key], list):
+            return jsonify({'error': f'{key} 必须为股票代码列表'}), 400
+    add_codes = list(dict.fromkeys(str(code).strip() for code in data.get('add') or [] if str(code).strip()))
+    remove_codes = set(str(code).strip() for code in data.get('remove') or [] if str(code).strip())
+    
+    if not add_codes and not remove_codes:
+        return jsonify({'error': '请提供 add 或 remove 股票代码列表'}), 400
+    conflicts = [code for code in add_codes if code in remove_codes]
+    if conflicts:
+        return jsonify({'error': f'股票代码不能同时出现在 add 和 remove 中: {", ".join(conflicts)}'}), 400
+    if len(add_codes) > get_stock_quote.BATCH_SIZE:
+        return jsonify({'error': f'单次最多添加 {get_stock_quote.BATCH_SIZE} 只股票'}), 400
+    
+    snapshot = watchlist_cache.get_snapshot()
+    skipped = {}
+    candidates = []
+    for code in add_codes:
+        try:
+            get_stock_quote.get_full_code(code)
+        except ValueError:
+            skipped[code] = '股票代码格式无效'
+            continue
+        if snapshot.find(code):
+            skipped[code] = '股票已在关注列表中'
+        else:
+            candidates.append(code)
+    
+    # 一次批量请求校验全部待添加的股票
+    quotes = {}
+    if candidates:
+        try:
+            quotes = quote_client.get_quotes(candidates, allow_stale=False)
+        except quote_client.QuoteUnavailableError as e:
+            return jsonify({'error': f'行情接口暂不可用，无法校验股票代码: {e}'}), 503
+    for code in candidates:
+        if code not in quotes:
+            skipped[code] = '股票不存在'
+    
+    session = Session()
+    try:
+        new_items = [Watchlist(stock_code=code, stock_name=quotes[code]['股票名称'], market=quotes[code]['市场'])
+                     for code in candidates if code in quotes]
+        removed = []
+        try:
+            session.add_all(new_items)
+            if remove_codes:
+                for item in session.query(Watchlist).filter(Watchlist.stock_code.in_(remove_codes)).all():
+                    removed.append(item.stock_code)
+                    session.delete(item)
+            if new_items or removed:
+                bump_watchlist_version(session)
+            session.commit()
+        except IntegrityError:
+            # 内存快照可能尚未包含刚刚（或同时）添加的股票，由唯一约束判定重复，本次修改全部不生效
+            session.rollback()
+            session.close()
+            return jsonify({'error': '部分股票已在关注列表中，请刷新关注列表后重试'}), 400
+        for code in remove_codes.difference(removed):
+            skipped[code] = '股票不在关注列表中'
+        watchlist_cache.notify_changed()
+        
+        added = [watchlist_item_to_dict(item) for item in new_items]
+        session.close()
+        return jsonify({
+            'success': True,
+            'message': f'添加 {len(added)} 只、删除 {len(removed)} 只股票',
+            'added': added,
+            'removed': removed,
+            'skipped': skipped
+        })
+    except Exception as e:
+        session.rollback()
+        session.close()
+        return jsonify({'error': str(e)}), 500
+
 # 从关注列表中删除股票的API接口
 @app.route('/api/watchlist/remove/<int:item_id>', methods=['DELETE'])
 def remove_from_watchlist(item_id):
@@ -354,7 +752,9 @@ def remove_from_watchlist(item_id):
         
         # 删除关注列表项
         session.delete(watchlist_item)
+        bump_watchlist_version(session)
         session.commit()
+        watchlist_cache.notify_changed()
         
         session.close()
         return jsonify({
@@ -367,4 +767,7 @@ def remove_from_watchlist(item_id):
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    metrics.configure_logging()
+    sampling_profiler.start_from_env('web')
+    # 开发服务器，调试模式需通过 STOCK_DEBUG=1 显式开启；生产环境请使用 serve.py
+    app.run(debug=os.environ.get('STOCK_DEBUG') == '1', threaded=True, host='0.0.0.0', port=5000)
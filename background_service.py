@@ -1,20 +1,24 @@
 import time
 import threading
 import os
-from datetime import datetime, date
-import get_stock_quote
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+import sys
+import zlib
+import signal
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime
+import quote_client
+import indicators
+from ingest_journal import IngestJournal, replay_inactive
+import sampling_profiler
+from metrics import (DB_WRITE_FAILURES, SWEEP_DURATION, SWEEP_FAILURES,
+                     configure_logging, start_metrics_server)
+from models import Session, make_engine, init_db, save_stock_quote
+from watchlist_cache import WatchlistCache, default_cache
 from sqlalchemy.orm import sessionmaker
 
-# 创建数据库引擎
-engine = create_engine('sqlite:///stock_data.db', echo=False)
-Base = declarative_base()
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# 导入数据模型
-from app import Watchlist, StockQuote
+logger = logging.getLogger(__name__)
 
 # 后台服务运行状态
 running = False
@@ -22,33 +26,123 @@ running = False
 # 数据获取间隔（秒）
 FETCH_INTERVAL = 10  # 10秒
 
+# 每只股票之间的暂停时间（秒），避免单个进程请求过于频繁
+REQUEST_PAUSE = 1
+
 # 锁文件路径
 LOCK_FILE = 'background_service.lock'
 
+# 分片模式下每个分片的锁文件路径模板
+SHARD_LOCK_FILE = 'background_service.shard{index}of{count}.lock'
+
+# 分片租约超时时间（秒）：工作进程超过该时间未续约，监督进程认为其已卡死
+LEASE_TIMEOUT = FETCH_INTERVAL * 6
+
+# 监督进程检查工作进程状态的间隔（秒）
+SUPERVISOR_INTERVAL = 2
+
+# 单个分片在统计窗口内允许的最大重启次数，超过后缩减分片数并重新平衡
+MAX_RESTARTS = 5
+RESTART_WINDOW = 300  # 秒
+
+# 持有中的锁文件句柄，进程存活期间保持打开，进程退出时由操作系统自动释放锁
+_lock_handles = {}
+
+def acquire_lock(lock_path):
+    """
+    以非阻塞方式获取锁文件上的操作系统级排他锁，并写入当前进程ID
+
+    Linux/macOS 使用 fcntl.flock，Windows 使用 msvcrt.locking。锁随进程退出自动释放，
+    因此不会因为进程崩溃而留下失效的锁文件。
+
+    参数:
+    lock_path: 锁文件路径
+
+    返回:
+    是否成功获取锁
+    """
+    if lock_path in _lock_handles:
+        return True
+
+    handle = open(lock_path, 'a+')
+    try:
+        if os.name == 'nt':  # Windows系统
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+
+    # 写入当前进程ID，便于排查
+    handle.seek(0)
+    handle.truncate()
+    handle.write(str(os.getpid()))
+    handle.flush()
+    _lock_handles[lock_path] = handle
+    return True
+
+def renew_lease(lock_path):
+    """
+    续约：更新锁文件的修改时间，监督进程据此判断工作进程是否仍在正常采集
+    """
+    try:
+        os.utime(lock_path, None)
+    except OSError:
+        pass
+
+def release_lock(lock_path):
+    """
+    释放锁文件上的排他锁
+    """
+    handle = _lock_handles.pop(lock_path, None)
+    if handle is None:
+        return
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    except OSError:
+        pass
+    finally:
+        handle.close()
+
 # 检查并创建锁文件，确保只有一个实例在运行
 def check_lock_file():
-    # 检查锁文件是否存在
-    if os.path.exists(LOCK_FILE):
-        # 尝试读取锁文件中的进程ID
+    if not acquire_lock(LOCK_FILE):
         try:
             with open(LOCK_FILE, 'r') as f:
                 pid = f.read().strip()
-            # 检查进程是否存在
-            if os.name == 'nt':  # Windows系统
-                import ctypes
-                kernel32 = ctypes.windll.kernel32
-                handle = kernel32.OpenProcess(1, 0, int(pid))
-                if handle != 0:
-                    kernel32.CloseHandle(handle)
-                    print(f"后台服务已经在运行（进程ID: {pid}），退出当前实例")
-                    return False
-        except:
-            pass
-    # 创建或更新锁文件，写入当前进程ID
-    with open(LOCK_FILE, 'w') as f:
-        f.write(str(os.getpid()))
+        except OSError:
+            pid = '未知'
+        logger.warning("后台服务已经在运行（进程ID: %s），退出当前实例", pid)
+        return False
     return True
 
+def shard_of(stock_code, shard_count):
+    """
+    计算股票代码所属的分片编号
+
+    使用 CRC32 而不是内置 hash()，保证不同进程、不同启动之间的分区结果一致
+
+    参数:
+    stock_code: 股票代码
+    shard_count: 分片总数
+
+    返回:
+    分片编号（0 到 shard_count-1）
+    """
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(stock_code.encode('utf-8')) % shard_count
+
 # 检查是否在交易时间内
 def is_trading_time():
     # 获取当前时间
@@ -73,122 +167,324 @@ def is_trading_time():
     
     return is_morning_trading or is_afternoon_trading
 
-# 后台服务主函数
-def background_service():
-    global running
-    
-    # 检查是否已有实例在运行
-    if not check_lock_file():
-        return
-    
-    running = True
-    
-    print("后台自动数据获取服务已启动")
-    print(f"数据获取间隔: {FETCH_INTERVAL}秒")
-    print("按 Ctrl+C 停止服务\n")
+# 采集服务按股票增量计算的技术指标（每个采集进程只跟踪自己分片内的股票）
+indicator_tracker = indicators.IndicatorTracker()
+
+def track_indicators(db_session, stock_info):
+    """用新行情更新该股票的增量指标；首次出现的股票先用数据库中当天已有的tick初始化"""
+    try:
+        if stock_info['股票代码'] not in indicator_tracker.streams:
+            indicator_tracker.warm_up(db_session, stock_info['股票代码'], stock_info['日期'])
+        indicator_tracker.update(stock_info)
+    except Exception as e:
+        logger.error("股票 %s 指标计算失败: %s", stock_info.get('股票代码'), e)
+
+def flush_indicators(db_session):
+    try:
+        indicator_tracker.flush(db_session)
+    except Exception as e:
+        db_session.rollback()
+        DB_WRITE_FAILURES.inc(mode="indicators")
+        logger.error("指标快照写入失败: %s", e)
+
+# 获取并存储一批关注股票的数据
+# 提供采集日志时，行情先追加到日志，再按条数或时间批量写入数据库；否则逐条写入
+def collect_watchlist(db_session, watchlist_items, lock_path=None, journal=None):
+    for item in watchlist_items:
+        if not running:
+            break
+        try:
+            logger.debug("获取股票: %s (%s) 数据...", item.stock_code, item.stock_name)
+            
+            # 获取股票数据（经过熔断和退避重试；过期数据不写入数据库）
+            stock_info = quote_client.get_quote(item.stock_code, allow_stale=False)
+            
+            if stock_info:
+                # 先更新指标再存储，初始化时读取的当天tick中不会包含本条行情
+                track_indicators(db_session, stock_info)
+                journaled = False
+                if journal is not None:
+                    # 写入日志失败（编码失败、磁盘已满等）时改为直接写入数据库，不丢弃本条行情
+                    try:
+                        journal.append(stock_info)
+                        journaled = True
+                    except Exception as journal_error:
+                        DB_WRITE_FAILURES.inc(mode="journal")
+                        logger.error("股票 %s 写入采集日志失败，改为直接写入数据库: %s", item.stock_code, journal_error)
+                    if journal.should_flush():
+                        journal.flush(db_session)
+                if not journaled:
+                    # 存储数据到数据库
+                    try:
+                        save_stock_quote(db_session, stock_info)
+                        logger.debug("股票 %s 数据存储成功", item.stock_code)
+                    except Exception as db_error:
+                        db_session.rollback()
+                        DB_WRITE_FAILURES.inc(mode="single")
+                        logger.error("股票 %s 数据存储失败: %s", item.stock_code, db_error)
+            else:
+                SWEEP_FAILURES.inc(mode="watchlist")
+                logger.warning("获取股票 %s 数据失败", item.stock_code)
+        except Exception as e:
+            SWEEP_FAILURES.inc(mode="watchlist")
+            logger.exception("处理股票 %s 时出错: %s", item.stock_code, e)
+        
+        # 单只股票处理完成后续约，避免大分片被误判为卡死
+        if lock_path:
+            renew_lease(lock_path)
+        
+        # 每只股票之间暂停，避免请求过于频繁
+        time.sleep(REQUEST_PAUSE)
+
+# 等待下一次获取，期间每秒续约一次
+def wait_next_round(lock_path=None):
+    for _ in range(FETCH_INTERVAL):
+        if not running:
+            break
+        if lock_path:
+            renew_lease(lock_path)
+        time.sleep(1)
+
+# 采集主循环
+def collect_loop(db_session, shard_index=0, shard_count=1, lock_path=None, watchlist=default_cache, journal=None):
+    if shard_count > 1:
+        label = f"[分片 {shard_index + 1}/{shard_count}] "
+    else:
+        label = ""
     
     try:
         while running:
-            # 获取当前时间
-            now = datetime.now()
-            
             # 检查是否在交易时间内
             if not is_trading_time():
-                print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] 当前不在交易时间内，跳过本次数据获取")
+                logger.info("%s当前不在交易时间内，跳过本次数据获取", label)
                 # 等待下一次检查
-                for _ in range(FETCH_INTERVAL):
-                    if not running:
-                        break
-                    time.sleep(1)
+                wait_next_round(lock_path)
                 continue
             
-            print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] 开始获取关注列表股票数据...")
+            logger.info("%s开始获取关注列表股票数据...", label)
+            sweep_start = time.perf_counter()
             
-            # 获取关注列表中的所有股票
-            watchlist_items = session.query(Watchlist).all()
+            # 从内存快照获取关注列表（仅在版本号变化时重新查询），并筛选出属于本分片的部分
+            watchlist_items = watchlist.get().items
+            if shard_count > 1:
+                watchlist_items = [item for item in watchlist_items
+                                   if shard_of(item.stock_code, shard_count) == shard_index]
             
             if not watchlist_items:
-                print("关注列表为空，跳过本次数据获取")
+                logger.info("%s关注列表为空，跳过本次数据获取", label)
             else:
-                print(f"关注列表中有 {len(watchlist_items)} 只股票")
-                
-                # 遍历关注列表，获取每只股票的数据
-                for item in watchlist_items:
-                    try:
-                        print(f"获取股票: {item.stock_code} ({item.stock_name}) 数据...")
-                        
-                        # 获取股票数据
-                        stock_info = get_stock_quote.get_stock_quote(item.stock_code)
-                        
-                        if stock_info:
-                            # 存储数据到数据库
-                            try:
-                                stock_quote = StockQuote(
-                                    stock_code=stock_info['股票代码'],
-                                    stock_name=stock_info['股票名称'],
-                                    market=stock_info['市场'],
-                                    current_price=stock_info['当前价格'],
-                                    change_price=stock_info['涨跌额'],
-                                    change_percent=float(stock_info['涨跌幅'].replace('%', '')),
-                                    open_price=stock_info['今日开盘价'],
-                                    pre_close=stock_info['昨日收盘价'],
-                                    high_price=stock_info['今日最高价'],
-                                    low_price=stock_info['今日最低价'],
-                                    volume=stock_info['成交量'],
-                                    amount=stock_info['成交额'],
-                                    buy1_price=stock_info['买一报价'],
-                                    buy1_amount=stock_info['买一申报'],
-                                    buy2_price=stock_info['买二报价'],
-                                    buy2_amount=stock_info['买二申报'],
-                                    buy3_price=stock_info['买三报价'],
-                                    buy3_amount=stock_info['买三申报'],
-                                    buy4_price=stock_info['买四报价'],
-                                    buy4_amount=stock_info['买四申报'],
-                                    buy5_price=stock_info['买五报价'],
-                                    buy5_amount=stock_info['买五申报'],
-                                    sell1_price=stock_info['卖一报价'],
-                                    sell1_amount=stock_info['卖一申报'],
-                                    sell2_price=stock_info['卖二报价'],
-                                    sell2_amount=stock_info['卖二申报'],
-                                    sell3_price=stock_info['卖三报价'],
-                                    sell3_amount=stock_info['卖三申报'],
-                                    sell4_price=stock_info['卖四报价'],
-                                    sell4_amount=stock_info['卖四申报'],
-                                    sell5_price=stock_info['卖五报价'],
-                                    sell5_amount=stock_info['卖五申报'],
-                                    date=stock_info['日期'],
-                                    time=stock_info['时间']
-                                )
-                                session.add(stock_quote)
-                                session.commit()
-                                print(f"股票 {item.stock_code} 数据存储成功")
-                            except Exception as db_error:
-                                session.rollback()
-                                print(f"股票 {item.stock_code} 数据存储失败: {db_error}")
-                        else:
-                            print(f"获取股票 {item.stock_code} 数据失败")
-                    except Exception as e:
-                        print(f"处理股票 {item.stock_code} 时出错: {e}")
-                    
-                    # 每只股票之间暂停1秒，避免请求过于频繁
-                    time.sleep(1)
+                logger.info("%s关注列表中有 %d 只股票", label, len(watchlist_items))
+                collect_watchlist(db_session, watchlist_items, lock_path, journal)
+                # 一轮结束时写入剩余的缓冲
+                if journal is not None:
+                    journal.flush(db_session)
+                flush_indicators(db_session)
             
-            # 打印本次获取完成的信息
-            print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] 关注列表股票数据获取完成")
-            print(f"下次获取时间: {datetime.now().timestamp() + FETCH_INTERVAL}")
-            print("-" * 60)
+            # 记录本次获取完成的信息
+            sweep_seconds = time.perf_counter() - sweep_start
+            SWEEP_DURATION.observe(sweep_seconds, mode="watchlist")
+            logger.info("%s关注列表股票数据获取完成，耗时 %.2f 秒，%d 秒后进行下一次获取",
+                        label, sweep_seconds, FETCH_INTERVAL)
             
             # 等待下一次获取
-            for _ in range(FETCH_INTERVAL):
-                if not running:
+            wait_next_round(lock_path)
+    
+    except KeyboardInterrupt:
+        logger.info("%s后台自动数据获取服务正在停止...", label)
+
+# 后台服务主函数
+def background_service(metrics_port=None):
+    global running
+    
+    # 检查是否已有实例在运行
+    if not check_lock_file():
+        return
+    
+    init_db()
+    running = True
+    sampling_profiler.start_from_env('collector')
+    if metrics_port:
+        start_metrics_server(metrics_port)
+        logger.info("指标服务已启动: http://0.0.0.0:%d/metrics", metrics_port)
+    
+    logger.info("后台自动数据获取服务已启动，数据获取间隔: %d秒，按 Ctrl+C 停止服务", FETCH_INTERVAL)
+    
+    db_session = Session()
+    # 先把上次意外退出时未写入数据库的行情补写入（包括以前分片模式留下的日志）
+    journal = IngestJournal('collector')
+    journal.replay(db_session)
+    replay_inactive(db_session, [journal.name])
+    try:
+        collect_loop(db_session, journal=journal)
+    finally:
+        running = False
+        journal.close(db_session)
+        db_session.close()
+        release_lock(LOCK_FILE)
+        logger.info("后台自动数据获取服务已停止")
+
+# 分片工作进程入口
+def run_shard_worker(shard_index, shard_count, metrics_port=None):
+    global running
+    
+    # Windows 下子进程以 spawn 方式启动，需要重新配置日志
+    configure_logging()
+    
+    lock_path = SHARD_LOCK_FILE.format(index=shard_index, count=shard_count)
+    if not acquire_lock(lock_path):
+        logger.warning("分片 %d/%d 已由其他进程持有，退出当前工作进程", shard_index + 1, shard_count)
+        return
+    
+    # 子进程使用独立的数据库连接，不复用父进程的连接池
+    worker_engine = make_engine()
+    worker_session = sessionmaker(bind=worker_engine)()
+    
+    running = True
+    logger.info("分片工作进程已启动（分片 %d/%d，进程ID: %d）", shard_index + 1, shard_count, os.getpid())
+    sampling_profiler.start_from_env(f'collector-shard{shard_index}')
+    if metrics_port:
+        # 每个分片使用独立端口暴露本进程的指标
+        start_metrics_server(metrics_port + shard_index)
+        logger.info("分片 %d/%d 指标服务已启动: http://0.0.0.0:%d/metrics",
+                    shard_index + 1, shard_count, metrics_port + shard_index)
+    
+    # 每个分片使用独立的采集日志，由持有该分片锁的进程回放
+    journal = IngestJournal(f'collector-shard{shard_index}of{shard_count}')
+    journal.replay(worker_session)
+    try:
+        collect_loop(worker_session, shard_index, shard_count, lock_path,
+                     WatchlistCache(sessionmaker(bind=worker_engine)), journal)
+    finally:
+        running = False
+        journal.close(worker_session)
+        worker_session.close()
+        worker_engine.dispose()
+        release_lock(lock_path)
+        logger.info("分片工作进程已停止（分片 %d/%d）", shard_index + 1, shard_count)
+
+# 补写入当前分片数下不会被任何工作进程回放的采集日志
+def _replay_inactive_journals(shard_count):
+    db_session = Session()
+    try:
+        replay_inactive(db_session, [f'collector-shard{index}of{shard_count}' for index in range(shard_count)])
+    except Exception as e:
+        db_session.rollback()
+        logger.error("补写入旧采集日志失败: %s", e)
+    finally:
+        db_session.close()
+
+# 启动一个分片工作进程
+def _spawn_worker(shard_index, shard_count, metrics_port=None):
+    process = multiprocessing.Process(
+        target=run_shard_worker,
+        args=(shard_index, shard_count, metrics_port),
+        name=f"collector-shard-{shard_index}",
+        daemon=True
+    )
+    process.start()
+    process.started_at = time.time()
+    return process
+
+# 等待工作进程退出；超时仍未退出（例如忽略了 SIGTERM）时强制结束
+# 之后才能补写入它的采集日志，否则它仍可能在追加或写入数据库，造成重复写入
+def _join_or_kill(process, timeout=10):
+    process.join(timeout=timeout)
+    if process.is_alive():
+        logger.warning("工作进程 %d 在 %d 秒内未退出，强制结束", process.pid, timeout)
+        process.kill()
+        process.join()
+
+# 停止所有分片工作进程
+def _stop_workers(workers):
+    for process in workers.values():
+        if process.is_alive():
+            process.terminate()
+    for process in workers.values():
+        _join_or_kill(process)
+
+# 判断工作进程的租约是否已过期（长时间未续约）
+def _lease_expired(process, shard_index, shard_count):
+    # 刚启动的工作进程还未来得及获取锁，给予一个租约周期的宽限
+    if time.time() - process.started_at < LEASE_TIMEOUT:
+        return False
+    lock_path = SHARD_LOCK_FILE.format(index=shard_index, count=shard_count)
+    try:
+        return time.time() - os.path.getmtime(lock_path) > LEASE_TIMEOUT
+    except OSError:
+        return False
+
+# 分片采集监督进程：启动N个工作进程，重启失效的工作进程，必要时重新平衡分片
+def run_supervisor(worker_count, metrics_port=None):
+    global running
+    
+    # 监督进程本身也需要单实例运行
+    if not check_lock_file():
+        return
+    
+    # 建表只在监督进程中执行一次，避免多个工作进程同时建表
+    init_db()
+    running = True
+    shard_count = max(1, worker_count)
+    workers = {}
+    restart_history = {}
+    
+    # 分片数变化或切换运行模式后，旧日志没有对应的工作进程，由监督进程补写入
+    _replay_inactive_journals(shard_count)
+    
+    logger.info("分片采集服务已启动，工作进程数: %d，数据获取间隔: %d秒，按 Ctrl+C 停止服务",
+                shard_count, FETCH_INTERVAL)
+    
+    try:
+        for shard_index in range(shard_count):
+            workers[shard_index] = _spawn_worker(shard_index, shard_count, metrics_port)
+        
+        while running:
+            time.sleep(SUPERVISOR_INTERVAL)
+            rebalance = False
+            
+            for shard_index, process in list(workers.items()):
+                if process.is_alive() and not _lease_expired(process, shard_index, shard_count):
+                    continue
+                
+                if process.is_alive():
+                    logger.warning("分片 %d/%d 租约超时，终止工作进程 %d", shard_index + 1, shard_count, process.pid)
+                    process.terminate()
+                    _join_or_kill(process)
+                else:
+                    logger.warning("分片 %d/%d 工作进程已退出（退出码: %s）", shard_index + 1, shard_count, process.exitcode)
+                
+                # 统计时间窗口内的重启次数
+                now = time.time()
+                history = [t for t in restart_history.get(shard_index, []) if now - t < RESTART_WINDOW]
+                history.append(now)
+                restart_history[shard_index] = history
+                
+                if len(history) > MAX_RESTARTS and shard_count > 1:
+                    logger.error("分片 %d/%d 在 %d 秒内重启超过 %d 次，重新平衡分片",
+                                 shard_index + 1, shard_count, RESTART_WINDOW, MAX_RESTARTS)
+                    rebalance = True
                     break
-                time.sleep(1)
+                
+                logger.info("重启分片 %d/%d 工作进程", shard_index + 1, shard_count)
+                workers[shard_index] = _spawn_worker(shard_index, shard_count, metrics_port)
+            
+            if rebalance:
+                # 缩减分片数，由剩余工作进程重新按哈希分区接管全部股票
+                _stop_workers(workers)
+                shard_count -= 1
+                restart_history = {}
+                _replay_inactive_journals(shard_count)
+                workers = {shard_index: _spawn_worker(shard_index, shard_count, metrics_port)
+                           for shard_index in range(shard_count)}
+                logger.info("分片已重新平衡，当前工作进程数: %d", shard_count)
     
     except KeyboardInterrupt:
-        print("\n后台自动数据获取服务正在停止...")
+        logger.info("分片采集服务正在停止...")
     finally:
         running = False
-        print("后台自动数据获取服务已停止")
+        _stop_workers(workers)
+        release_lock(LOCK_FILE)
+        logger.info("分片采集服务已停止")
 
 # 启动后台服务
 def start_service():
@@ -202,4 +498,17 @@ def stop_service():
     running = False
 
 if __name__ == '__main__':
-    background_service()
+    parser = argparse.ArgumentParser(description='后台自动数据获取服务')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='分片采集工作进程数，大于1时启用多进程分片模式')
+    parser.add_argument('--metrics-port', type=int,
+                        help='在该端口提供 /metrics 指标（分片模式下第 i 个分片使用端口 metrics-port+i）')
+    args = parser.parse_args()
+    
+    configure_logging()
+    # 由 serve.py 等进程管理器发送 SIGTERM 停止时，按正常退出处理以释放锁文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.workers > 1:
+        run_supervisor(args.workers, args.metrics_port)
+    else:
+        background_service(args.metrics_port)
@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# 各项基准测试的默认规模
+DEFAULT_SYMBOLS = 50  # 合成数据库中的股票数量
+DEFAULT_TICKS = 4800  # 每只股票的行情条数（3秒一条，约4小时交易时间）
+DEFAULT_PARSE_LINES = 50000
+DEFAULT_SWEEP_SIZES = [10, 100, 1000, 5000]
+DEFAULT_INSERT_ROWS = 5000
+DEFAULT_CLIENTS = 8
+DEFAULT_REQUESTS = 400  # 每个接口的请求总数
+
+def percentile(samples, pct):
+    """计算百分位数（最近秩法）"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def latency_summary(samples):
+    """将延迟样本（秒）汇总为毫秒统计"""
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p90_ms': round(percentile(samples, 90) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+    }
+
+def synthetic_series(codes, ticks, trade_date, seed=42):
+    """
+    生成合成行情序列：每只股票从 09:30 开始每3秒一条，价格为随机游走
+
+    返回:
+    以股票代码为键、[(时间戳, 新浪格式字段列表), ...] 为值的字典
+    """
+    rng = random.Random(seed)
+    start = datetime.combine(trade_date, datetime.strptime('09:30:00', '%H:%M:%S').time())
+    series = {}
+    for code in codes:
+        pre_close = round(rng.uniform(3, 80), 2)
+        price = pre_close
+        high = low = price
+        volume = 0
+        amount = 0.0
+        ticks_for_code = []
+        for i in range(ticks):
+            price = max(0.01, round(price + rng.choice((-0.01, 0.0, 0.0, 0.01)), 2))
+            high = max(high, price)
+            low = min(low, price)
+            traded = rng.randint(1, 50) * 100
+            volume += traded
+            amount += traded * price
+            recorded_at = start + timedelta(seconds=3 * i)
+            fields = [f"合成{code}", f"{pre_close:.2f}", f"{pre_close:.2f}", f"{price:.2f}", f"{high:.2f}",
+                      f"{low:.2f}", f"{price - 0.01:.2f}", f"{price:.2f}", str(volume), f"{amount:.2f}"]
+            for level in range(5):
+                fields += [str(rng.randint(1, 500) * 100), f"{price - 0.01 * (level + 1):.2f}"]
+            for level in range(5):
+                fields += [str(rng.randint(1, 500) * 100), f"{price + 0.01 * level:.2f}"]
+            fields += [recorded_at.strftime('%Y-%m-%d'), recorded_at.strftime('%H:%M:%S'), "00"]
+            ticks_for_code.append((recorded_at.timestamp(), fields))
+        series[code] = ticks_for_code
+    return series
+
+def build_database(series, chunk_size=20000):
+    """
+    将合成行情写入 STOCK_DB_URL 指向的数据库，并把全部股票加入关注列表
+    """
+    import get_stock_quote
+    from quote_sources import format_sina_line
+    from models import Session, StockQuote, Watchlist, init_db, build_quote_record
+
+    init_db()
+    db_session = Session()
+    try:
+        rows = []
+        for code, ticks in series.items():
+            db_session.add(Watchlist(stock_code=code, stock_name=f"合成{code}", market="上海"))
+            for recorded_at, fields in ticks:
+                stock_info = get_stock_quote.parse_stock_data(format_sina_line(f"sh{code}", fields))
+                record = build_quote_record(stock_info)
+                record['created_at'] = datetime.fromtimestamp(recorded_at)
+                rows.append(record)
+                if len(rows) >= chunk_size:
+                    db_session.bulk_insert_mappings(StockQuote, rows)
+                    rows = []
+        if rows:
+            db_session.bulk_insert_mappings(StockQuote, rows)
+        db_session.commit()
+    finally:
+        db_session.close()
+
+def bench_parse(series, lines):
+    """parse_stock_data 吞吐量"""
+    import get_stock_quote
+    from quote_sources import format_sina_line
+
+    samples = []
+    for code, ticks in series.items():
+        for _, fields in ticks:
+            samples.append(format_sina_line(f"sh{code}", fields))
+            if len(samples) >= lines:
+                break
+        if len(samples) >= lines:
+            break
+    while len(samples) < lines:
+        samples.extend(samples[:lines - len(samples)])
+
+    start = time.perf_counter()
+    for line in samples:
+        get_stock_quote.parse_stock_data(line)
+    elapsed = time.perf_counter() - start
+
+    # 批量解析（一次响应多行）
+    payload = "\n".join(samples)
+    batch_start = time.perf_counter()
+    get_stock_quote.parse_stock_data_batch(payload)
+    batch_elapsed = time.perf_counter() - batch_start
+
+    return {
+        'lines': lines,
+        'seconds': round(elapsed, 6),
+        'lines_per_second': round(lines / elapsed, 1),
+        'us_per_line': round(elapsed / lines * 1e6, 3),
+        'batch_seconds': round(batch_elapsed, 6),
+        'batch_lines_per_second': round(lines / batch_elapsed, 1),
+    }
+
+def bench_sweep(codes_by_size, batch_size, threads, rounds=3):
+    """不同关注列表规模下一次批量抓取的耗时（经过本地替身上游的HTTP请求）"""
+    import market_universe
+
+    results = []
+    for size, codes in codes_by_size:
+        timings = []
+        received = 0
+        errors = 0
+        for _ in range(rounds):
+            _, stats = market_universe.sweep_universe(codes, batch_size, threads)
+            timings.append(stats['fetch_seconds'])
+            received = stats['symbols_received']
+            errors += stats['request_errors']
+        best = min(timings)
+        results.append({
+            'watchlist_size': size,
+            'batch_size': batch_size,
+            'threads': threads,
+            'rounds': rounds,
+            'best_seconds': round(best, 6),
+            'median_seconds': round(percentile(timings, 50), 6),
+            'symbols_received': received,
+            'request_errors': errors,
+            'symbols_per_second': round(size / best, 1) if best > 0 else None,
+        })
+    return results
+
+def bench_insert(series, rows):
+    """stock_quotes 插入吞吐量：逐条提交（后台服务原有方式）与批量提交"""
+    import get_stock_quote
+    from quote_sources import format_sina_line
+    from models import Session, save_stock_quote, save_stock_quotes_bulk
+
+    stock_infos = []
+    for code, ticks in series.items():
+        for _, fields in ticks[:rows]:
+            stock_infos.append(get_stock_quote.parse_stock_data(format_sina_line(f"sh{code}", fields)))
+            if len(stock_infos) >= rows:
+                break
+        if len(stock_infos) >= rows:
+            break
+
+    db_session = Session()
+    try:
+        # 逐条提交的代价很高，只取一小部分样本
+        single_rows = max(1, min(len(stock_infos), 500))
+        start = time.perf_counter()
+        for stock_info in stock_infos[:single_rows]:
+            save_stock_quote(db_session, stock_info)
+        single_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        save_stock_quotes_bulk(db_session, stock_infos)
+        bulk_elapsed = time.perf_counter() - start
+    finally:
+        db_session.close()
+
+    return {
+        'row_per_commit': {
+            'rows': single_rows,
+            'seconds': round(single_elapsed, 6),
+            'rows_per_second': round(single_rows / single_elapsed, 1),
+        },
+        'bulk': {
+            'rows': len(stock_infos),
+            'seconds': round(bulk_elapsed, 6),
+            'rows_per_second': round(len(stock_infos) / bulk_elapsed, 1),
+        },
+    }
+
+def bench_api(base_url, codes, clients, total_requests, set_trading_time):
+    """
+    各API接口在并发客户端下的延迟分布
+
+    /api/stock/<code> 在交易时间内走上游行情、交易时间外读数据库，两条路径分别强制执行并各自报告，
+    结果不随运行基准时的时钟变化
+
+    参数:
+    set_trading_time: 接收 True/False，强制 Web 应用按交易时间内/外处理请求
+    """
+    import requests
+
+    def run(paths):
+        local = threading.local()
+
+        def one(path):
+            http_session = getattr(local, 'http_session', None)
+            if http_session is None:
+                http_session = local.http_session = requests.Session()
+            start = time.perf_counter()
+            response = http_session.get(base_url + path, timeout=30)
+            elapsed = time.perf_counter() - start
+            return elapsed, response.status_code, len(response.content)
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            outcomes = list(executor.map(one, paths))
+        wall = time.perf_counter() - wall_start
+
+        latencies = [outcome[0] for outcome in outcomes]
+        summary = latency_summary(latencies)
+        summary['errors'] = sum(1 for outcome in outcomes if outcome[1] >= 400)
+        summary['mean_response_bytes'] = round(sum(outcome[2] for outcome in outcomes) / len(outcomes), 1)
+        summary['requests_per_second'] = round(len(outcomes) / wall, 1)
+        return summary
+
+    def spread(template):
+        return [template.format(code=codes[i % len(codes)]) for i in range(total_requests)]
+
+    set_trading_time(True)
+    upstream_path = run(spread('/api/stock/{code}'))
+    set_trading_time(False)
+    database_path = run(spread('/api/stock/{code}'))
+    return {
+        '/api/stock/<code>': {'trading_time': upstream_path, 'after_hours': database_path},
+        '/api/stock/<code>/history': run(spread('/api/stock/{code}/history')),
+        '/api/stock/<code>/day': run(spread('/api/stock/{code}/day')),
+        '/api/watchlist': run(['/api/watchlist'] * total_requests),
+    }
+
+def run_benchmarks(args):
+    """
+    在临时目录中生成数据库并运行全部基准；结束后删除临时目录（数据库可达数百MB），--keep 时保留
+    """
+    workdir = tempfile.mkdtemp(prefix='stock_bench_')
+    original_cwd = os.getcwd()
+    try:
+        return _run_benchmarks(args, workdir)
+    finally:
+        os.chdir(original_cwd)
+        if args.keep:
+            print(f"临时目录已保留: {workdir}", file=sys.stderr)
+        else:
+            import models
+            # 释放数据库连接后再删除（Windows 下被打开的文件无法删除）
+            models.engine.dispose()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def _run_benchmarks(args, workdir):
+    db_path = os.path.join(workdir, 'stock_data.db')
+    # 必须在导入 app/background_service 之前设置，使其使用临时数据库
+    os.environ['STOCK_DB_URL'] = f"sqlite:///{db_path}"
+    os.chdir(workdir)
+
+    import get_stock_quote
+    import replay_server
+    from quote_sources import ReplayQuoteSource, SinaQuoteSource
+
+    results = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': {
+            'symbols': args.symbols,
+            'ticks_per_symbol': args.ticks,
+            'clients': args.clients,
+            'requests_per_endpoint': args.requests,
+            'sweep_sizes': args.sweep_sizes,
+            'batch_size': args.batch_size,
+            'threads': args.threads,
+        },
+    }
+
+    codes = [f"{600000 + i:06d}" for i in range(args.symbols)]
+    today = datetime.now().date()
+
+    print(f"生成合成数据: {args.symbols} 只股票 x {args.ticks} 条...", file=sys.stderr)
+    series = synthetic_series(codes, args.ticks, today)
+    build_start = time.perf_counter()
+    build_database(series)
+    results['database'] = {
+        'rows': args.symbols * args.ticks,
+        'build_seconds': round(time.perf_counter() - build_start, 3),
+        'size_bytes': os.path.getsize(db_path),
+    }
+
+    print("parse_stock_data 吞吐量...", file=sys.stderr)
+    results['parse'] = bench_parse(series, args.parse_lines)
+
+    # 本地替身上游：回放合成行情，股票数量扩展到最大的关注列表规模
+    max_size = max(args.sweep_sizes)
+    replay_series = {code: ticks[:200] for code, ticks in series.items()}
+    source = ReplayQuoteSource(replay_series, speed=10, symbol_count=max(max_size, args.symbols))
+    upstream = replay_server.make_server(source, port=0)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    get_stock_quote.set_quote_source(SinaQuoteSource(replay_server.url_template_for(upstream),
+                                                     get_stock_quote.REQUEST_HEADERS))
+
+    print("批量抓取耗时...", file=sys.stderr)
+    universe = source.codes()
+    results['fetch_sweep'] = bench_sweep([(size, universe[:size]) for size in args.sweep_sizes],
+                                         args.batch_size, args.threads)
+
+    print("数据库插入吞吐量...", file=sys.stderr)
+    results['insert'] = bench_insert(series, args.insert_rows)
+
+    print("API延迟...", file=sys.stderr)
+    from werkzeug.serving import make_server
+    import app as web_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    web_server = make_server('127.0.0.1', 0, web_app.app, threaded=True)
+    threading.Thread(target=web_server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{web_server.server_port}"
+    original_is_trading_time = web_app.is_trading_time
+
+    def set_trading_time(trading):
+        web_app.is_trading_time = lambda: trading
+
+    try:
+        results['api'] = bench_api(base_url, codes, args.clients, args.requests, set_trading_time)
+    finally:
+        web_app.is_trading_time = original_is_trading_time
+        web_server.shutdown()
+        upstream.shutdown()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='采集、解析、存储和接口服务的端到端基准测试（输出JSON）')
+    parser.add_argument('--symbols', type=int, default=DEFAULT_SYMBOLS, help='合成数据库中的股票数量')
+    parser.add_argument('--ticks', type=int, default=DEFAULT_TICKS, help='每只股票的行情条数')
+    parser.add_argument('--parse-lines', type=int, default=DEFAULT_PARSE_LINES, help='解析基准的行数')
+    parser.add_argument('--sweep-sizes', type=int, nargs='+', default=DEFAULT_SWEEP_SIZES,
+                        help='批量抓取基准的关注列表规模')
+    parser.add_argument('--batch-size', type=int, default=500, help='单次请求包含的股票数量')
+    parser.add_argument('--threads', type=int, default=8, help='批量抓取并发线程数')
+    parser.add_argument('--insert-rows', type=int, default=DEFAULT_INSERT_ROWS, help='插入基准的行数')
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS, help='API基准的并发客户端数')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='每个接口的请求总数')
+    parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录（合成数据库）以便检查')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    report = run_benchmarks(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"基准测试结果已写入 {output}", file=sys.stderr)
+    else:
+        print(text)
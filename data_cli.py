@@ -0,0 +1,423 @@
+import io
+import os
+import csv
+import sys
+import glob
+import gzip
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+import get_stock_quote
+from models import Session, StockQuote, init_db, save_stock_quotes_bulk
+
+logger = logging.getLogger(__name__)
+
+# pyarrow 为可选依赖，安装后支持 parquet 格式导出
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# orjson 为可选依赖，未安装时使用标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 每次从数据库读取、写入文件或数据库的行数；内存占用只与该值有关，与导出总量无关
+CHUNK_SIZE = 5000
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+_LEVELS = ('一', '二', '三', '四', '五')
+
+# 导出的列，与 stock_quotes 表字段一致（不含自增 id）；volume 单位为手、amount 单位为万元，导出为整数
+EXPORT_COLUMNS = ('stock_code', 'stock_name', 'market', 'date', 'time', 'created_at',
+                  'current_price', 'change_price', 'change_percent', 'open_price', 'pre_close',
+                  'high_price', 'low_price', 'volume', 'amount') \
+    + tuple(f'{side}{i}_{field}' for side in ('buy', 'sell') for i in range(1, 6) for field in ('price', 'amount'))
+
+_INTEGER_COLUMNS = {'volume', 'amount'} | {f'{side}{i}_amount' for side in ('buy', 'sell') for i in range(1, 6)}
+_TEXT_COLUMNS = {'stock_code', 'stock_name', 'market', 'date', 'time', 'created_at'}
+
+def _strip_unit(value, unit):
+    """将 "123手"、"45万元" 转换为整数，无法解析时返回 None"""
+    if value is None or isinstance(value, int):
+        return value
+    value = str(value)
+    try:
+        return int(float(value[:-len(unit)] if value.endswith(unit) else value))
+    except ValueError:
+        return None
+
+def _open_output(path, binary=False):
+    """打开输出文件；"-" 为标准输出，.gz 结尾时 gzip 压缩"""
+    if path == '-':
+        return sys.stdout.buffer if binary else io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wb' if binary else 'wt', encoding=None if binary else 'utf-8',
+                         newline=None if binary else '')
+    return open(path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8',
+                newline=None if binary else '')
+
+def _open_input(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+# ---------------------------------------------------------------------------
+# 导出
+# ---------------------------------------------------------------------------
+
+def export_query(stock_codes=None, start_date=None, end_date=None):
+    """
+    按股票和日期范围（含两端，"YYYY-MM-DD"）生成导出查询，按股票代码和记录时间排序
+    """
+    from sqlalchemy import select
+
+    query = select(*[getattr(StockQuote, column) for column in EXPORT_COLUMNS])
+    if stock_codes:
+        query = query.where(StockQuote.stock_code.in_(list(stock_codes)))
+    if start_date:
+        query = query.where(StockQuote.date >= start_date)
+    if end_date:
+        query = query.where(StockQuote.date <= end_date)
+    # 排序与 (stock_code, created_at) 复合索引一致，数据库按索引顺序逐行返回，不需要先排序全部结果
+    return query.order_by(StockQuote.stock_code, StockQuote.created_at)
+
+def iter_export_chunks(db_session, stock_codes=None, start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """
+    以流式游标分块读取行情，每块为行元组列表（成交量、成交额已转换为整数）
+
+    返回:
+    生成行列表的迭代器
+    """
+    connection = db_session.connection().execution_options(stream_results=True, yield_per=chunk_size)
+    result = connection.execute(export_query(stock_codes, start_date, end_date))
+    volume_index = EXPORT_COLUMNS.index('volume')
+    amount_index = EXPORT_COLUMNS.index('amount')
+    created_index = EXPORT_COLUMNS.index('created_at')
+    for partition in result.partitions(chunk_size):
+        rows = []
+        for row in partition:
+            row = list(row)
+            row[volume_index] = _strip_unit(row[volume_index], '手')
+            row[amount_index] = _strip_unit(row[amount_index], '万元')
+            created_at = row[created_index]
+            row[created_index] = created_at.isoformat(sep=' ') if created_at else None
+            rows.append(row)
+        yield rows
+
+class _CsvWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = _open_output(path)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.flush()
+        if self.path == '-':
+            # 只解除包装，不关闭标准输出
+            self.file.detach()
+        else:
+            self.file.close()
+
+class _JsonLinesWriter:
+    def __init__(self, path):
+        self.file = _open_output(path, binary=True)
+
+    def write(self, rows):
+        if orjson is not None:
+            lines = [orjson.dumps(dict(zip(EXPORT_COLUMNS, row))) for row in rows]
+        else:
+            lines = [json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False).encode('utf-8') for row in rows]
+        self.file.write(b'\n'.join(lines) + b'\n')
+
+    def close(self):
+        self.file.flush()
+        if self.file is not sys.stdout.buffer:
+            self.file.close()
+
+class _ParquetWriter:
+    """每块写入一个 row group，内存中只保留当前块"""
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise RuntimeError("导出 parquet 格式需要安装 pyarrow：pip install pyarrow")
+        if path == '-':
+            raise RuntimeError("parquet 格式需要指定输出文件")
+        fields = []
+        for column in EXPORT_COLUMNS:
+            if column in _TEXT_COLUMNS:
+                fields.append(pyarrow.field(column, pyarrow.string()))
+            elif column in _INTEGER_COLUMNS:
+                fields.append(pyarrow.field(column, pyarrow.int64()))
+            else:
+                fields.append(pyarrow.field(column, pyarrow.float64()))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+_WRITERS = {'csv': _CsvWriter, 'jsonl': _JsonLinesWriter, 'parquet': _ParquetWriter}
+
+def export_quotes(db_session, path, fmt='csv', stock_codes=None, start_date=None, end_date=None,
+                  chunk_size=CHUNK_SIZE):
+    """
+    流式导出行情到文件
+
+    参数:
+    path: 输出文件路径，"-" 为标准输出（parquet 除外），.gz 结尾时 gzip 压缩（csv、jsonl）
+    fmt: csv、jsonl 或 parquet
+
+    返回:
+    导出的行数
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    writer = _WRITERS[fmt](path)
+    rows_written = 0
+    try:
+        for rows in iter_export_chunks(db_session, stock_codes, start_date, end_date, chunk_size):
+            writer.write(rows)
+            rows_written += len(rows)
+    finally:
+        writer.close()
+    return rows_written
+
+# ---------------------------------------------------------------------------
+# 导入
+# ---------------------------------------------------------------------------
+
+def _market_name(stock_code):
+    return get_stock_quote.market_map.get(get_stock_quote.get_market_prefix(stock_code), "未知")
+
+def parse_tick_line(line):
+    """
+    解析 record_data_to_file 生成的一行记录（数值带 "手"、"万元"、"%" 单位）
+
+    返回:
+    (记录时间, 行情字典)；表头或无法解析的行返回 None
+    """
+    parts = line.rstrip('\r\n').split(',')
+    if len(parts) < 35 or parts[0] == '时间戳':
+        return None
+    try:
+        recorded_at = datetime.strptime(parts[0], '%Y-%m-%d %H:%M:%S')
+        stock_info = {
+            '股票代码': parts[1],
+            '股票名称': parts[2],
+            '市场': _market_name(parts[1]),
+            '今日开盘价': float(parts[3]),
+            '昨日收盘价': float(parts[4]),
+            '当前价格': float(parts[5]),
+            '今日最高价': float(parts[6]),
+            '今日最低价': float(parts[7]),
+            '成交量': parts[10],
+            '成交额': parts[11],
+            '涨跌额': float(parts[32]),
+            '涨跌幅': parts[33] if parts[33].endswith('%') else f"{parts[33]}%",
+            # 记录文件没有行情时间，以记录时间代替
+            '日期': recorded_at.strftime('%Y-%m-%d'),
+            '时间': recorded_at.strftime('%H:%M:%S'),
+        }
+        for i, side in enumerate(('买', '卖')):
+            for level, name in enumerate(_LEVELS):
+                column = 12 + (i * 5 + level) * 2
+                stock_info[f'{side}{name}申报'] = int(parts[column])
+                stock_info[f'{side}{name}报价'] = float(parts[column + 1])
+        float(stock_info['涨跌幅'][:-1])
+    except (ValueError, IndexError):
+        return None
+    return recorded_at, stock_info
+
+def _export_row_to_info(row):
+    """导出文件中的一行（列名到值的字典）转换为 (记录时间, 行情字典)"""
+    def number(column, cast=float):
+        value = row.get(column)
+        return cast(value) if value not in (None, '') else None
+
+    created_at = row.get('created_at')
+    if not row.get('stock_code') or not created_at:
+        return None
+    try:
+        stock_info = {
+            '股票代码': row['stock_code'],
+            '股票名称': row.get('stock_name') or '',
+            '市场': row.get('market') or _market_name(row['stock_code']),
+            '当前价格': number('current_price'),
+            '涨跌额': number('change_price'),
+            '涨跌幅': f"{number('change_percent') or 0.0}%",
+            '今日开盘价': number('open_price'),
+            '昨日收盘价': number('pre_close'),
+            '今日最高价': number('high_price'),
+            '今日最低价': number('low_price'),
+            '成交量': f"{number('volume', int) or 0}手",
+            '成交额': f"{number('amount', int) or 0}万元",
+            '日期': row.get('date'),
+            '时间': row.get('time'),
+        }
+        for side, side_name in (('buy', '买'), ('sell', '卖')):
+            for level, name in enumerate(_LEVELS, 1):
+                stock_info[f'{side_name}{name}报价'] = number(f'{side}{level}_price')
+                stock_info[f'{side_name}{name}申报'] = number(f'{side}{level}_amount', int)
+        return datetime.fromisoformat(created_at), stock_info
+    except (ValueError, TypeError):
+        return None
+
+def iter_file_records(path):
+    """
+    逐行读取一个待导入文件：stock_data_*.txt 记录文件，或本工具导出的 .csv / .jsonl（可为 .gz）
+
+    返回:
+    生成 (记录时间, 行情字典) 的迭代器
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    with _open_input(path) as f:
+        if name.endswith('.csv'):
+            records = (_export_row_to_info(row) for row in csv.DictReader(f))
+        elif name.endswith('.jsonl'):
+            records = (_export_row_to_info(json.loads(line)) for line in f if line.strip())
+        else:
+            records = (parse_tick_line(line) for line in f)
+        for record in records:
+            if record is not None:
+                yield record
+
+def _existing_keys(db_session, records):
+    """
+    查询一批记录中已在数据库中的 (股票代码, 记录时间精确到秒)，用于去重
+    """
+    from sqlalchemy import select
+
+    ranges = {}
+    for recorded_at, stock_info in records:
+        code = stock_info['股票代码']
+        low, high = ranges.get(code, (recorded_at, recorded_at))
+        ranges[code] = (min(low, recorded_at), max(high, recorded_at))
+
+    existing = set()
+    for code, (low, high) in ranges.items():
+        low = low.replace(microsecond=0)
+        high = high.replace(microsecond=0) + timedelta(seconds=1)
+        query = select(StockQuote.created_at).where(StockQuote.stock_code == code,
+                                                    StockQuote.created_at >= low, StockQuote.created_at < high)
+        for (created_at,) in db_session.execute(query):
+            existing.add((code, created_at.replace(microsecond=0)))
+    return existing
+
+def import_files(db_session, patterns, chunk_size=CHUNK_SIZE):
+    """
+    导入记录文件或导出文件：每块记录查询一次已有数据去重，然后一次批量插入并提交
+
+    按 (股票代码, 记录时间精确到秒) 去重：同一文件重复导入、或与采集服务已写入的记录重叠时不会产生重复行
+
+    返回:
+    (读取的记录数, 插入的行数, 跳过的重复记录数)
+    """
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if not paths:
+        logger.warning("没有匹配的文件: %s", ' '.join(patterns))
+    total = inserted = 0
+
+    def flush(chunk):
+        existing = _existing_keys(db_session, chunk)
+        infos, recorded_at = [], []
+        for timestamp, stock_info in chunk:
+            key = (stock_info['股票代码'], timestamp.replace(microsecond=0))
+            if key in existing:
+                continue
+            existing.add(key)
+            infos.append(stock_info)
+            recorded_at.append(timestamp)
+        return save_stock_quotes_bulk(db_session, infos, "import", recorded_at)
+
+    for path in paths:
+        file_total = file_inserted = 0
+        chunk = []
+        for record in iter_file_records(path):
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                file_inserted += flush(chunk)
+                file_total += len(chunk)
+                chunk = []
+        if chunk:
+            file_inserted += flush(chunk)
+            file_total += len(chunk)
+        logger.info("%s: 读取 %d 条，插入 %d 条，跳过重复 %d 条", path, file_total, file_inserted,
+                    file_total - file_inserted)
+        total += file_total
+        inserted += file_inserted
+    return total, inserted, total - inserted
+
+if __name__ == '__main__':
+    from metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description='行情数据批量导出/导入')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出 stock_quotes 表中的行情')
+    export_parser.add_argument('--codes', help='股票代码，逗号分隔；默认全部股票')
+    export_parser.add_argument('--watchlist', action='store_true', help='只导出关注列表中的股票')
+    export_parser.add_argument('--start', help='开始日期（含），YYYY-MM-DD')
+    export_parser.add_argument('--end', help='结束日期（含），YYYY-MM-DD')
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS,
+                               help='导出格式，默认按输出文件扩展名判断，否则为 csv')
+    export_parser.add_argument('--output', '-o', default='-', help='输出文件，默认标准输出；.gz 结尾时压缩')
+    export_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    import_parser = subparsers.add_parser('import', help='导入 stock_data_*.txt 记录文件或导出的 csv/jsonl 文件')
+    import_parser.add_argument('files', nargs='+', help='文件路径（支持通配符）')
+    import_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    # 导出到标准输出时日志输出到标准错误
+    configure_logging()
+    if args.command == 'export' and args.output == '-':
+        logging.getLogger().handlers[0].setStream(sys.stderr)
+
+    init_db()
+    db_session = Session()
+    start = time.perf_counter()
+    try:
+        if args.command == 'export':
+            fmt = args.format
+            if fmt is None:
+                base = args.output[:-3] if args.output.endswith('.gz') else args.output
+                fmt = next((name for name in EXPORT_FORMATS if base.endswith('.' + name)), 'csv')
+            codes = [code.strip() for code in args.codes.split(',') if code.strip()] if args.codes else []
+            if args.watchlist:
+                import watchlist_cache
+                codes += watchlist_cache.get_snapshot().codes
+            rows = export_quotes(db_session, args.output, fmt, codes or None, args.start, args.end, args.chunk_size)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(args.output) if args.output != '-' else None
+            logger.info("导出 %d 行（%s），耗时 %.2f 秒，%.0f 行/秒%s", rows, fmt, elapsed,
+                        rows / elapsed if elapsed > 0 else 0,
+                        f"，文件 {size / 1e6:.1f} MB" if size is not None else "")
+        else:
+            total, inserted, skipped = import_files(db_session, args.files, args.chunk_size)
+            elapsed = time.perf_counter() - start
+            logger.info("导入完成：读取 %d 条，插入 %d 条，跳过重复 %d 条，耗时 %.2f 秒", total, inserted, skipped, elapsed)
+    except RuntimeError as e:
+        logger.error("%s", e)
+        sys.exit(1)
+    except BrokenPipeError:
+        # 输出通过管道交给 head 等命令提前关闭时静默退出
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        db_session.close()
@@ -1,12 +1,16 @@
-import requests
+import os
 import time
 import math
+import logging
+from collections import namedtuple
 from datetime import datetime
-import statistics
-import asciichartpy
+from metrics import UPSTREAM_LATENCY, UPSTREAM_FAILURES, PARSE_LATENCY
+from text_chart import downsample
 
-# 新浪财经API URL
-sina_stock_url = "http://hq.sinajs.cn/rn=%d&list=%s"
+logger = logging.getLogger(__name__)
+
+# 新浪财经API URL（可通过环境变量 STOCK_QUOTE_URL 指向 replay_server.py 启动的本地回放服务）
+sina_stock_url = os.environ.get("STOCK_QUOTE_URL", "http://hq.sinajs.cn/rn=%d&list=%s")
 
 # 股票代码映射
 market_map = {
@@ -15,13 +19,56 @@ market_map = {
     "bj": "北京"
 }
 
+# 股票代码前缀与市场的对应规则（按顺序匹配，越具体的前缀越靠前）
+# 6开头（主板、科创板）、5开头（ETF等基金）和11开头（可转债）的是上海市场
+# 0开头（主板）、3开头（创业板）、12开头（可转债）和15、16开头（ETF、LOF等基金）的是深圳市场
+# 8开头、4开头和92开头的是北京市场
+# 其余1开头的代码沪深两市都有使用，无法只凭代码确定市场，不予识别
+MARKET_PREFIX_RULES = [
+    ("92", "bj"),
+    ("6", "sh"),
+    ("5", "sh"),
+    ("11", "sh"),
+    ("0", "sz"),
+    ("3", "sz"),
+    ("12", "sz"),
+    ("15", "sz"),
+    ("16", "sz"),
+    ("8", "bj"),
+    ("4", "bj"),
+]
+
+# 品种的报价精度：tick_size 最小报价单位（元），decimals 价格小数位数，scale 每元包含的最小报价单位数
+# 程序内部比较价格时换算为整数个最小报价单位（tick），避免浮点误差
+SymbolMeta = namedtuple('SymbolMeta', ['tick_size', 'decimals', 'scale'])
+
+# 股票的最小报价单位为0.01元
+STOCK_META = SymbolMeta(0.01, 2, 100)
+# ETF、LOF等基金和可转债的最小报价单位为0.001元
+FUND_META = SymbolMeta(0.001, 3, 1000)
+
+# 沪市5开头、11开头和深市1开头的代码为基金和债券，按0.001元报价
+FINE_TICK_PREFIXES = ("5", "1")
+
+# 请求超时时间（秒）
+REQUEST_TIMEOUT = 10
+
+# 批量请求时单次请求包含的最大股票数量（受URL长度限制）
+BATCH_SIZE = 500
+
+# 请求头
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+    "Referer": "https://finance.sina.com.cn/"
+}
+
 # 策略参数配置（可调整）
 UPDATE_INTERVAL = 5  # 更新间隔，单位：秒
 DATA_WINDOW = 5  # 计算趋势的窗口大小（最近5个数据点，减少平滑效果）
 SLOPE_THRESHOLD = 0.001  # 斜率阈值，降低阈值使趋势更容易被检测到
 
 # 基于最小报价单位的新参数配置
-MINIMUM_PRICE_UNIT = 0.01  # 最小报价单位（黄金ETF通常为0.01元）
+MINIMUM_PRICE_UNIT = STOCK_META.tick_size  # 股票的最小报价单位，基金为0.001元（见 get_symbol_meta）
 RETURN_THRESHOLD_STEPS = 2  # 回撤阈值的步长数，减少回撤要求
 
 # 历史价格数据，用于计算趋势
@@ -46,9 +93,6 @@ monitoring_end_time = None
 # 监控轮次计数器
 monitoring_round = 1
 
-# 价格小数位数配置
-price_decimal_places = 2  # 默认2位小数，将根据新浪接口数据动态调整
-
 # 模拟交易参数
 INITIAL_FUNDS = 10000.0  # 初始资金，单位：元
 current_funds = INITIAL_FUNDS  # 当前资金
@@ -57,6 +101,125 @@ initial_price = None  # 第一秒的基准价格
 portfolio_value = INITIAL_FUNDS  # 总资产价值（资金+持仓市值）
 trade_count = 0  # 交易次数
 
+def get_market_prefix(stock_code):
+    """
+    根据股票代码前缀确定所属市场
+
+    参数:
+    stock_code: 股票代码，例如 "601919"
+
+    返回:
+    市场前缀（"sh"、"sz"、"bj"），无法识别时返回 None
+    """
+    for prefix, market in MARKET_PREFIX_RULES:
+        if stock_code.startswith(prefix):
+            return market
+    return None
+
+def get_symbol_meta(stock_code):
+    """
+    根据股票代码确定报价精度
+
+    参数:
+    stock_code: 股票代码，例如 "518880"
+
+    返回:
+    SymbolMeta 实例
+    """
+    if stock_code and stock_code.startswith(FINE_TICK_PREFIXES):
+        return FUND_META
+    return STOCK_META
+
+def to_ticks(price, meta=STOCK_META):
+    """价格（元）换算为整数个最小报价单位"""
+    return int(round(price * meta.scale))
+
+def from_ticks(ticks, meta=STOCK_META):
+    """整数个最小报价单位换算为价格（元），结果与按小数位数书写的价格完全一致"""
+    return ticks / meta.scale
+
+def snap_price(price, meta=STOCK_META):
+    """价格（元，可为字符串）对齐到最小报价单位，消除上游数据和浮点运算带来的尾差"""
+    return from_ticks(to_ticks(float(price), meta), meta)
+
+def get_full_code(stock_code):
+    """
+    获取带市场前缀的完整股票代码，例如 "601919" -> "sh601919"
+    """
+    market = get_market_prefix(stock_code)
+    if market is None:
+        raise ValueError("无效的股票代码，请检查代码格式")
+    return f"{market}{stock_code}"
+
+# 当前使用的行情数据源，默认为新浪财经HTTP接口
+_quote_source = None
+
+def get_quote_source():
+    """
+    获取当前使用的行情数据源（quote_sources.QuoteSource 实例）
+    """
+    global _quote_source
+    if _quote_source is None:
+        from quote_sources import SinaQuoteSource
+        _quote_source = SinaQuoteSource(sina_stock_url, REQUEST_HEADERS, REQUEST_TIMEOUT)
+    return _quote_source
+
+def set_quote_source(source):
+    """
+    替换行情数据源，例如使用 quote_sources.ReplayQuoteSource 离线回放已记录的行情
+    """
+    global _quote_source
+    _quote_source = source
+
+def fetch_stock_quotes(stock_codes, timeout=None):
+    """
+    在一次请求中批量获取多只股票的实时行情数据
+
+    与 get_stock_quote 不同，请求失败时直接抛出异常，由调用方决定如何处理；
+    新浪接口对不存在的代码返回空数据，这些代码不会出现在结果中。
+
+    参数:
+    stock_codes: 股票代码列表，数量不应超过 BATCH_SIZE
+    timeout: 请求超时时间（秒），默认使用 REQUEST_TIMEOUT
+
+    返回:
+    以股票代码为键、股票信息字典为值的字典
+    """
+    full_codes = [get_full_code(code) for code in stock_codes]
+    if not full_codes:
+        return {}
+    
+    source = get_quote_source()
+    try:
+        with UPSTREAM_LATENCY.time(endpoint=source.endpoint):
+            data = source.fetch_raw(full_codes, timeout or REQUEST_TIMEOUT)
+    except Exception:
+        UPSTREAM_FAILURES.inc(endpoint=source.endpoint)
+        raise
+    
+    with PARSE_LATENCY.time(mode="batch"):
+        return parse_stock_data_batch(data)
+
+def parse_stock_data_batch(data):
+    """
+    解析新浪财经批量请求返回的多行数据
+
+    参数:
+    data: 新浪财经返回的原始数据字符串，每行一只股票
+
+    返回:
+    以股票代码为键、股票信息字典为值的字典
+    """
+    quotes = {}
+    for line in data.splitlines():
+        # 跳过空行和不存在的代码（形如 var hq_str_sh600999="";）
+        if '=' not in line or line.rstrip().endswith('="";'):
+            continue
+        stock_info = parse_stock_data(line)
+        if stock_info:
+            quotes[stock_info['股票代码']] = stock_info
+    return quotes
+
 def get_stock_quote(stock_code):
     """
     获取指定股票代码的实时行情数据
@@ -68,48 +231,28 @@ def get_stock_quote(stock_code):
     stock_info: 包含股票行情信息的字典
     """
     # 确定股票的市场前缀
-    # 6开头和5开头的股票/ETF是上海市场，0开头的是深圳市场，8开头的是北京市场
-    if stock_code.startswith("6") or stock_code.startswith("5"):
-        full_code = f"sh{stock_code}"
-    elif stock_code.startswith("0"):
-        full_code = f"sz{stock_code}"
-    elif stock_code.startswith("8"):
-        full_code = f"bj{stock_code}"
-    else:
-        raise ValueError("无效的股票代码，请检查代码格式")
-    
-    # 生成请求URL
-    rn = int(time.time())  # 时间戳，用于防止缓存
-    url = sina_stock_url % (rn, full_code)
-    
-    # 设置请求头
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "Referer": "https://finance.sina.com.cn/"
-    }
+    full_code = get_full_code(stock_code)
     
     # 发送请求
+    source = get_quote_source()
     try:
-        response = requests.get(url, headers=headers)
-        response.encoding = "gb18030"  # 新浪财经使用GB18030编码
-        
-        if response.status_code != 200:
-            raise Exception(f"请求失败，状态码: {response.status_code}")
-        
-        # 解析响应内容
-        data = response.text
-        print(f"原始响应数据: {data}")
+        with UPSTREAM_LATENCY.time(endpoint=source.endpoint):
+            data = source.fetch_raw([full_code], REQUEST_TIMEOUT)
+        # 原始响应只在调试级别输出，避免每次请求都格式化整段数据
+        logger.debug("原始响应数据: %s", data)
         
         # 解析数据
-        stock_info = parse_stock_data(data, stock_code)
+        with PARSE_LATENCY.time(mode="single"):
+            stock_info = parse_stock_data(data, stock_code)
         # 如果解析失败，使用原始股票代码
         if stock_info and stock_info['股票代码'] != stock_code:
-            print(f"解析出的股票代码与原始代码不一致，使用原始代码: {stock_code}")
+            logger.warning("解析出的股票代码与原始代码不一致，使用原始代码: %s", stock_code)
             stock_info['股票代码'] = stock_code
         return stock_info
         
     except Exception as e:
-        print(f"获取股票数据失败: {e}")
+        UPSTREAM_FAILURES.inc(endpoint=source.endpoint)
+        logger.warning("获取股票数据失败: %s", e)
         return None
 
 def parse_stock_data(data, original_stock_code=None):
@@ -149,26 +292,16 @@ def parse_stock_data(data, original_stock_code=None):
         if len(stock_data) < 32:
             raise Exception("数据不完整")
         
-        # 获取原始价格字符串，分析小数位数
-        current_price_str = stock_data[3]
-        pre_close_str = stock_data[2]
-        
-        # 动态确定价格小数位数
-        global price_decimal_places
-        if '.' in current_price_str:
-            price_decimal_places = len(current_price_str.split('.')[1])
-        elif '.' in pre_close_str:
-            price_decimal_places = len(pre_close_str.split('.')[1])
-        else:
-            price_decimal_places = 2  # 默认2位小数
-        
-        # 转换为浮点数
-        current_price = float(current_price_str)
-        pre_close = float(pre_close_str)
+        # 报价精度由品种决定（股票2位小数，基金3位小数），全部价格字段换算为整数个最小报价单位后再换算回价格
+        meta = get_symbol_meta(stock_code)
+        current_ticks = to_ticks(float(stock_data[3]), meta)
+        pre_close_ticks = to_ticks(float(stock_data[2]), meta)
+        current_price = from_ticks(current_ticks, meta)
+        pre_close = from_ticks(pre_close_ticks, meta)
         
-        # 计算涨跌幅和涨跌额（保持与原数据一致的小数位数）
-        change_price = current_price - pre_close
-        change_percent = (change_price / pre_close) * 100
+        # 涨跌额按整数计算，不需要再四舍五入
+        change_ticks = current_ticks - pre_close_ticks
+        change_percent = change_ticks * 100 / pre_close_ticks
         
         # 转换成交量和成交额为更易读的格式
         volume = int(stock_data[8]) // 100  # 转换为手
@@ -178,57 +311,53 @@ def parse_stock_data(data, original_stock_code=None):
         market_name = market_map.get(market, "未知")
         if market_name == "未知" and stock_code:
             # 根据股票代码前缀推断市场
-            if stock_code.startswith("6") or stock_code.startswith("5"):
-                market_name = "上海"
-            elif stock_code.startswith("0"):
-                market_name = "深圳"
-            elif stock_code.startswith("8"):
-                market_name = "北京"
+            market_name = market_map.get(get_market_prefix(stock_code), "未知")
         
         # 构建股票信息字典
         stock_info = {
             "股票代码": stock_code,
             "股票名称": stock_data[0],
-            "今日开盘价": float(stock_data[1]),
+            "今日开盘价": snap_price(stock_data[1], meta),
             "昨日收盘价": pre_close,
             "当前价格": current_price,
-            "今日最高价": float(stock_data[4]),
-            "今日最低价": float(stock_data[5]),
-            "竞买价": float(stock_data[6]),
-            "竞卖价": float(stock_data[7]),
+            "今日最高价": snap_price(stock_data[4], meta),
+            "今日最低价": snap_price(stock_data[5], meta),
+            "竞买价": snap_price(stock_data[6], meta),
+            "竞卖价": snap_price(stock_data[7], meta),
             "成交量": f"{volume}手",
             "成交额": f"{amount}万元",
             "买一申报": int(stock_data[10]) // 100,  # 转换为手
-            "买一报价": float(stock_data[11]),
+            "买一报价": snap_price(stock_data[11], meta),
             "买二申报": int(stock_data[12]) // 100,  # 转换为手
-            "买二报价": float(stock_data[13]),
+            "买二报价": snap_price(stock_data[13], meta),
             "买三申报": int(stock_data[14]) // 100,  # 转换为手
-            "买三报价": float(stock_data[15]),
+            "买三报价": snap_price(stock_data[15], meta),
             "买四申报": int(stock_data[16]) // 100,  # 转换为手
-            "买四报价": float(stock_data[17]),
+            "买四报价": snap_price(stock_data[17], meta),
             "买五申报": int(stock_data[18]) // 100,  # 转换为手
-            "买五报价": float(stock_data[19]),
+            "买五报价": snap_price(stock_data[19], meta),
             "卖一申报": int(stock_data[20]) // 100,  # 转换为手
-            "卖一报价": float(stock_data[21]),
+            "卖一报价": snap_price(stock_data[21], meta),
             "卖二申报": int(stock_data[22]) // 100,  # 转换为手
-            "卖二报价": float(stock_data[23]),
+            "卖二报价": snap_price(stock_data[23], meta),
             "卖三申报": int(stock_data[24]) // 100,  # 转换为手
-            "卖三报价": float(stock_data[25]),
+            "卖三报价": snap_price(stock_data[25], meta),
             "卖四申报": int(stock_data[26]) // 100,  # 转换为手
-            "卖四报价": float(stock_data[27]),
+            "卖四报价": snap_price(stock_data[27], meta),
             "卖五申报": int(stock_data[28]) // 100,  # 转换为手
-            "卖五报价": float(stock_data[29]),
+            "卖五报价": snap_price(stock_data[29], meta),
             "日期": stock_data[30],
             "时间": stock_data[31],
             "市场": market_name,
-            "涨跌额": round(change_price, 2),
-            "涨跌幅": f"{round(change_percent, 2)}%"
+            "涨跌额": from_ticks(change_ticks, meta),
+            "涨跌幅": f"{round(change_percent, 2)}%",
+            "价格小数位数": meta.decimals
         }
         
         return stock_info
         
     except Exception as e:
-        print(f"解析股票数据失败: {e}")
+        logger.warning("解析股票数据失败: %s", e)
         return None
 
 def print_stock_info(stock_info):
@@ -318,7 +447,7 @@ def determine_trend(slope):
     else:
         return "down"
 
-def detect_signal(current_price, previous_price, current_trend, previous_trend):
+def detect_signal(current_price, previous_price, current_trend, previous_trend, meta=STOCK_META):
     """
     检测买卖信号，基于最小报价单位的涨跌阈值和回撤阈值
     
@@ -327,6 +456,7 @@ def detect_signal(current_price, previous_price, current_trend, previous_trend):
     previous_price: 前一个价格
     current_trend: 当前趋势
     previous_trend: 前一个趋势
+    meta: 品种的报价精度（get_symbol_meta 的返回值），价格按整数个最小报价单位比较
     
     返回:
     signal: 买卖信号 ("BUY"买入, "SELL"卖出, "HOLD"持有)
@@ -343,22 +473,19 @@ def detect_signal(current_price, previous_price, current_trend, previous_trend):
     # 买入信号：增加多种买入条件，提高交易机会
     # 1. 趋势从下降转为上升
     # 2. 价格明显上涨且当前趋势为上升
-    price_change = current_price - previous_price
+    current_ticks = to_ticks(current_price, meta)
+    tick_change = current_ticks - to_ticks(previous_price, meta)
     if (previous_trend == "down" and current_trend == "up") or \
-       (current_trend == "up" and price_change > MINIMUM_PRICE_UNIT * 2):
+       (current_trend == "up" and tick_change > 2):
         return "BUY"
     
     # 卖出信号：回撤达到设定的步长数或价格明显下跌
     if current_trend == "down":
-        # 计算当前价格与最高价的差值
-        price_diff = highest_price - current_price
-        # 计算需要的回撤步长数
-        required_diff = RETURN_THRESHOLD_STEPS * MINIMUM_PRICE_UNIT
-        
-        if price_diff >= required_diff:
+        # 当前价格比最高价低了多少个最小报价单位
+        if to_ticks(highest_price, meta) - current_ticks >= RETURN_THRESHOLD_STEPS:
             return "SELL"
     # 增加卖出条件：价格明显下跌
-    elif current_price < previous_price - MINIMUM_PRICE_UNIT * 2:
+    elif tick_change < -2:
         return "SELL"
     
     return "HOLD"
@@ -460,7 +587,7 @@ def print_strategy_explanation():
     print("="*60)
     print()
 
-def draw_price_chart(prices, chart_width=50, chart_height=10):
+def draw_price_chart(prices, chart_width=50, chart_height=10, decimals=STOCK_META.decimals):
     """
     使用ASCII字符绘制价格变化趋势图
     
@@ -468,25 +595,29 @@ def draw_price_chart(prices, chart_width=50, chart_height=10):
     prices: 价格列表
     chart_width: 图表宽度（字符数）
     chart_height: 图表高度（字符数）
+    decimals: 价格小数位数（get_symbol_meta(代码).decimals）
     """
     if not prices:
         return
     
-    # 设置图表配置（动态小数位数）
+    # 只有命令行监控需要绘图，延迟导入以免拖慢采集服务和Web应用的启动
+    import asciichartpy
+    
+    # 设置图表配置（按品种的小数位数）
     config = {
         'width': chart_width,
         'height': chart_height,
-        'format': f'{{0:.{price_decimal_places}f}}',  # 与新浪接口返回的小数位数一致
+        'format': f'{{0:.{decimals}f}}',
         'offset': 3  # 标题空间
     }
     
     # 绘制图表
     print("\n价格走势图：")
     print("-" * (chart_width + 10))
-    print(asciichartpy.plot(prices, config))
+    # asciichartpy 每个数据点占一列，超过图表宽度的序列先抽样
+    print(asciichartpy.plot(downsample(prices, chart_width), config))
     print("-" * (chart_width + 10))
-    # 动态小数位数格式化
-    fmt_str = f'.{price_decimal_places}f'
+    fmt_str = f'.{decimals}f'
     
     print(f"数据点数量: {len(prices)} 个 (每个点间隔 {UPDATE_INTERVAL} 秒)")
     print(f"价格范围: {min(prices):{fmt_str}} - {max(prices):{fmt_str}} 元")
@@ -496,13 +627,16 @@ def draw_price_chart(prices, chart_width=50, chart_height=10):
     print()
 
 if __name__ == "__main__":
+    from metrics import configure_logging
+    configure_logging()
     # 简单测试功能
     print("测试股票行情获取功能...")
-    stock_code = "518880"  # 华安黄金ETF
+    import sys
+    stock_code = sys.argv[1] if len(sys.argv) > 1 else "518880"  # 默认华安黄金ETF
     stock_info = get_stock_quote(stock_code)
     if stock_info:
         print_stock_info(stock_info)
     else:
         print("获取股票数据失败")
     print("测试完成。")
-    print("\n提示：在Web模式下，请运行 app.py 启动Web服务器。")
+    print("\n提示：在Web模式下，请运行 app.py 启动Web服务器；多只股票的终端监控请运行 terminal_monitor.py。")
@@ -0,0 +1,656 @@
+import json
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认K线周期（秒）
+DEFAULT_INTERVAL = 60
+
+# 未指定时计算的指标
+DEFAULT_SPECS = ('ema:12', 'ema:26', 'sma:20', 'boll:20:2', 'rsi:14', 'atr:14', 'vwap')
+
+# 指标结果缓存的最大条目数
+CACHE_SIZE = 512
+
+# 一根K线：start 周期起始的Unix时间戳（秒），volume 周期内成交量（手）
+Bar = namedtuple('Bar', ['start', 'open', 'high', 'low', 'close', 'volume'])
+
+# 一段K线，按列存储（各字段为等长的 numpy 数组）
+Bars = namedtuple('Bars', ['start', 'open', 'high', 'low', 'close', 'volume'])
+
+def _parse_volume(value):
+    """将 "123手" 形式的累计成交量转换为数值"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value[:-1] if value.endswith('手') else value)
+    except (AttributeError, ValueError):
+        return 0.0
+
+def _quote_timestamp(stock_info):
+    try:
+        return datetime.strptime(f"{stock_info['日期']} {stock_info['时间']}", '%Y-%m-%d %H:%M:%S').timestamp()
+    except (KeyError, ValueError):
+        return time.time()
+
+# ---------------------------------------------------------------------------
+# K线
+# ---------------------------------------------------------------------------
+
+def bars_from_ticks(timestamps, prices, volumes, interval=DEFAULT_INTERVAL):
+    """
+    将按时间排序的tick序列聚合为K线（向量化）
+
+    参数:
+    timestamps: Unix时间戳（秒）
+    prices: 成交价
+    volumes: 当日累计成交量（手）
+    interval: K线周期（秒），按 Unix 时间整除对齐
+
+    没有tick的周期（如午间休市）不生成K线；价格为0的tick（开盘前、停牌）被忽略。
+    每根K线的成交量为本周期最后一个tick与上一根K线最后一个tick的累计成交量之差，
+    第一根K线从其第一个tick开始计算。
+
+    返回:
+    Bars
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    traded = prices > 0
+    timestamps, prices, volumes = timestamps[traded], prices[traded], volumes[traded]
+    if len(prices) == 0:
+        empty = np.empty(0)
+        return Bars(empty, empty, empty, empty, empty, empty)
+
+    buckets = np.floor(timestamps / interval).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.concatenate((starts[1:], [len(prices)])) - 1
+    closing_volume = volumes[ends]
+    previous_volume = np.concatenate((volumes[:1], closing_volume[:-1]))
+    return Bars(
+        start=(buckets[starts] * interval).astype(np.float64),
+        open=prices[starts],
+        high=np.maximum.reduceat(prices, starts),
+        low=np.minimum.reduceat(prices, starts),
+        close=prices[ends],
+        volume=np.maximum(closing_volume - previous_volume, 0.0),
+    )
+
+class BarBuilder:
+    """
+    逐个tick增量生成K线，与 bars_from_ticks 的结果一致
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.bucket = None
+        self.open = self.high = self.low = self.close = None
+        self.base_volume = None
+        self.last_volume = None
+
+    def update(self, timestamp, price, volume):
+        """
+        加入一个tick
+
+        返回:
+        新tick进入下一个周期时返回刚结束的 Bar，否则返回 None
+        """
+        if price <= 0:
+            return None
+        bucket = math.floor(timestamp / self.interval)
+        finished = None
+        if self.bucket is None:
+            self.base_volume = volume
+        elif bucket != self.bucket:
+            finished = self.current()
+            self.base_volume = self.last_volume
+        if finished is not None or self.bucket is None:
+            self.bucket = bucket
+            self.open = self.high = self.low = price
+        else:
+            self.high = max(self.high, price)
+            self.low = min(self.low, price)
+        self.close = price
+        self.last_volume = volume
+        return finished
+
+    def current(self):
+        """当前未结束的K线（没有tick时为 None）"""
+        if self.bucket is None:
+            return None
+        return Bar(float(self.bucket * self.interval), self.open, self.high, self.low, self.close,
+                   max(self.last_volume - self.base_volume, 0.0))
+
+# ---------------------------------------------------------------------------
+# 批量计算（numpy，用于历史数据）
+# ---------------------------------------------------------------------------
+
+# 递推计算时每块的长度：块内用矩阵乘法一次算出，块与块之间传递上一块的最后一个值
+_BLOCK = 128
+
+@lru_cache(maxsize=32)
+def _ewm_weights(alpha):
+    decay = 1.0 - alpha
+    lag = np.subtract.outer(np.arange(_BLOCK), np.arange(_BLOCK))
+    weights = np.where(lag >= 0, alpha * decay ** np.maximum(lag, 0), 0.0)
+    carry = decay ** np.arange(1, _BLOCK + 1)
+    return weights, carry
+
+def _ewm(values, alpha, initial):
+    """
+    y[t] = y[t-1] + alpha * (x[t] - y[t-1])，y[-1] = initial
+
+    展开为 y[t] = (1-alpha)^(t+1) * initial + Σ alpha * (1-alpha)^(t-k) * x[k]，
+    按块计算避免逐元素的Python循环，且各项系数都不大于1，不会溢出
+    """
+    weights, carry = _ewm_weights(alpha)
+    result = np.empty(len(values))
+    previous = initial
+    for start in range(0, len(values), _BLOCK):
+        block = values[start:start + _BLOCK]
+        size = len(block)
+        result[start:start + size] = weights[:size, :size] @ block + carry[:size] * previous
+        previous = result[start + size - 1]
+    return result
+
+def _recursive_mean(values, period, alpha):
+    """
+    以前 period 个值的简单平均为初值、此后按 alpha 递推的平均（EMA、Wilder 平滑共用），
+    初值之前为 NaN
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) < period:
+        return result
+    result[period - 1] = values[:period].mean()
+    result[period:] = _ewm(values[period:], alpha, result[period - 1])
+    return result
+
+def sma(bars, period):
+    """收盘价简单移动平均"""
+    close = bars.close
+    result = np.full(len(close), np.nan)
+    if len(close) >= period:
+        sums = np.concatenate(([0.0], np.cumsum(close)))
+        result[period - 1:] = (sums[period:] - sums[:-period]) / period
+    return result
+
+def ema(bars, period):
+    """收盘价指数移动平均，alpha = 2 / (period + 1)，以前 period 根K线的简单平均为初值"""
+    return _recursive_mean(bars.close, period, 2.0 / (period + 1))
+
+def bollinger(bars, period, width=2.0):
+    """
+    布林带：中轨为 period 根K线收盘价的简单平均，上下轨为中轨 ± width 倍标准差（总体标准差）
+
+    返回:
+    {'mid': 数组, 'upper': 数组, 'lower': 数组}
+    """
+    close = bars.close
+    mid = np.full(len(close), np.nan)
+    std = np.full(len(close), np.nan)
+    if len(close) >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(close, period)
+        mid[period - 1:] = windows.mean(axis=1)
+        std[period - 1:] = windows.std(axis=1)
+    return {'mid': mid, 'upper': mid + width * std, 'lower': mid - width * std}
+
+def _rsi_value(avg_gain, avg_loss):
+    """平均跌幅为0时：有涨幅为100，没有涨跌为50"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(avg_loss > 0, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss),
+                        np.where(avg_gain > 0, 100.0, 50.0))
+
+def rsi(bars, period):
+    """相对强弱指标（Wilder 平滑），第 period+1 根K线起有值"""
+    close = bars.close
+    result = np.full(len(close), np.nan)
+    if len(close) > period:
+        change = np.diff(close)
+        avg_gain = _recursive_mean(np.maximum(change, 0.0), period, 1.0 / period)
+        avg_loss = _recursive_mean(np.maximum(-change, 0.0), period, 1.0 / period)
+        result[period:] = _rsi_value(avg_gain[period - 1:], avg_loss[period - 1:])
+    return result
+
+def atr(bars, period):
+    """平均真实波幅（Wilder 平滑）；第一根K线的真实波幅为最高价 - 最低价"""
+    if len(bars.close) == 0:
+        return np.empty(0)
+    previous_close = np.concatenate((bars.close[:1], bars.close[:-1]))
+    true_range = np.maximum.reduce([bars.high - bars.low,
+                                    np.abs(bars.high - previous_close),
+                                    np.abs(bars.low - previous_close)])
+    true_range[0] = bars.high[0] - bars.low[0]
+    return _recursive_mean(true_range, period, 1.0 / period)
+
+def vwap(bars):
+    """成交量加权平均价：从第一根K线起累计，典型价格为 (最高 + 最低 + 收盘) / 3；尚无成交量时为 NaN"""
+    typical = (bars.high + bars.low + bars.close) / 3.0
+    volume = np.cumsum(bars.volume)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(volume > 0, np.cumsum(typical * bars.volume) / volume, np.nan)
+
+# ---------------------------------------------------------------------------
+# 增量计算（每根K线 O(1)，用于实时采集）
+# ---------------------------------------------------------------------------
+
+class _RecursiveMean:
+    """与 _recursive_mean 对应的增量形式"""
+
+    def __init__(self, period, alpha):
+        self.period = period
+        self.alpha = alpha
+        self.count = 0
+        self.total = 0.0
+        self.value = float('nan')
+
+    def update(self, x):
+        self.count += 1
+        if self.count < self.period:
+            self.total += x
+        elif self.count == self.period:
+            self.value = (self.total + x) / self.period
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+class SMAStream:
+    def __init__(self, period):
+        self.period = period
+        self.values = deque()
+        self.total = 0.0
+
+    def update(self, bar):
+        self.values.append(bar.close)
+        self.total += bar.close
+        if len(self.values) > self.period:
+            self.total -= self.values.popleft()
+        return self.total / self.period if len(self.values) == self.period else float('nan')
+
+class EMAStream:
+    def __init__(self, period):
+        self.average = _RecursiveMean(period, 2.0 / (period + 1))
+
+    def update(self, bar):
+        return self.average.update(bar.close)
+
+class BollingerStream:
+    def __init__(self, period, width=2.0):
+        self.period = period
+        self.width = width
+        self.values = deque()
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def update(self, bar):
+        close = bar.close
+        self.values.append(close)
+        self.total += close
+        self.total_squares += close * close
+        if len(self.values) > self.period:
+            expired = self.values.popleft()
+            self.total -= expired
+            self.total_squares -= expired * expired
+        if len(self.values) < self.period:
+            nan = float('nan')
+            return {'mid': nan, 'upper': nan, 'lower': nan}
+        mid = self.total / self.period
+        # 累加平方和存在舍入误差，方差可能略小于0
+        std = math.sqrt(max(self.total_squares / self.period - mid * mid, 0.0))
+        return {'mid': mid, 'upper': mid + self.width * std, 'lower': mid - self.width * std}
+
+class RSIStream:
+    def __init__(self, period):
+        self.previous_close = None
+        self.gain = _RecursiveMean(period, 1.0 / period)
+        self.loss = _RecursiveMean(period, 1.0 / period)
+
+    def update(self, bar):
+        previous, self.previous_close = self.previous_close, bar.close
+        if previous is None:
+            return float('nan')
+        change = bar.close - previous
+        avg_gain = self.gain.update(max(change, 0.0))
+        avg_loss = self.loss.update(max(-change, 0.0))
+        if math.isnan(avg_gain):
+            return float('nan')
+        if avg_loss > 0:
+            return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+        return 100.0 if avg_gain > 0 else 50.0
+
+class ATRStream:
+    def __init__(self, period):
+        self.previous_close = None
+        self.average = _RecursiveMean(period, 1.0 / period)
+
+    def update(self, bar):
+        true_range = bar.high - bar.low
+        if self.previous_close is not None:
+            true_range = max(true_range, abs(bar.high - self.previous_close), abs(bar.low - self.previous_close))
+        self.previous_close = bar.close
+        return self.average.update(true_range)
+
+class VWAPStream:
+    def __init__(self):
+        self.amount = 0.0
+        self.volume = 0.0
+
+    def update(self, bar):
+        self.amount += (bar.high + bar.low + bar.close) / 3.0 * bar.volume
+        self.volume += bar.volume
+        return self.amount / self.volume if self.volume > 0 else float('nan')
+
+# 指标名称 -> (批量计算函数, 增量计算类, 默认参数)
+INDICATORS = {
+    'sma': (sma, SMAStream, (20,)),
+    'ema': (ema, EMAStream, (20,)),
+    'boll': (bollinger, BollingerStream, (20, 2.0)),
+    'rsi': (rsi, RSIStream, (14,)),
+    'atr': (atr, ATRStream, (14,)),
+    'vwap': (vwap, VWAPStream, ()),
+}
+
+def parse_spec(spec):
+    """
+    解析指标描述，例如 "ema:20"、"boll:20:2"、"vwap"；省略的参数使用默认值
+
+    返回:
+    (规范化的描述, 指标名称, 参数元组)
+
+    异常:
+    ValueError: 未知指标或参数无效
+    """
+    name, *raw_params = spec.strip().lower().split(':')
+    if name not in INDICATORS:
+        raise ValueError(f"未知指标: {name}")
+    defaults = INDICATORS[name][2]
+    if len(raw_params) > len(defaults):
+        raise ValueError(f"指标 {name} 最多 {len(defaults)} 个参数")
+    params = list(defaults)
+    try:
+        for i, raw in enumerate(raw_params):
+            params[i] = type(defaults[i])(float(raw)) if i else int(raw)
+    except ValueError:
+        raise ValueError(f"指标参数无效: {spec}")
+    if params and not 1 <= params[0] <= 1000:
+        raise ValueError(f"指标周期应在 1 到 1000 之间: {spec}")
+    # 周期之外的参数（布林带宽度倍数）必须为有限正数，否则上下轨无意义
+    if any(not (math.isfinite(param) and param > 0) for param in params[1:]):
+        raise ValueError(f"指标参数应为有限正数: {spec}")
+    normalized = ':'.join([name] + [f"{param:g}" for param in params])
+    return normalized, name, tuple(params)
+
+def compute_batch(bars, specs=DEFAULT_SPECS):
+    """
+    对一段K线批量计算多个指标
+
+    返回:
+    以规范化指标描述为键的字典，值为数组（布林带为 mid/upper/lower 三个数组的字典）
+    """
+    results = {}
+    for spec in specs:
+        normalized, name, params = parse_spec(spec)
+        results[normalized] = INDICATORS[name][0](bars, *params)
+    return results
+
+class IndicatorStream:
+    """
+    单只股票的增量指标计算：tick 聚合为K线，每根K线结束时更新各指标，
+    结果与对同一序列调用 compute_batch() 一致
+    """
+
+    def __init__(self, specs=DEFAULT_SPECS, interval=DEFAULT_INTERVAL):
+        self.builder = BarBuilder(interval)
+        self.streams = {}
+        for spec in specs:
+            normalized, name, params = parse_spec(spec)
+            self.streams[normalized] = INDICATORS[name][1](*params)
+        self.bar = None
+        self.latest = None
+
+    def update_tick(self, timestamp, price, volume):
+        """
+        加入一个tick
+
+        返回:
+        有K线结束时返回该K线各指标的值，否则返回 None
+        """
+        bar = self.builder.update(timestamp, price, volume)
+        if bar is None:
+            return None
+        self.bar = bar
+        self.latest = {spec: stream.update(bar) for spec, stream in self.streams.items()}
+        return self.latest
+
+    def update(self, stock_info):
+        return self.update_tick(_quote_timestamp(stock_info), stock_info['当前价格'],
+                                _parse_volume(stock_info['成交量']))
+
+class IndicatorTracker:
+    """
+    多只股票的增量指标计算，按股票代码维护各自的 IndicatorStream；
+    有K线结束的股票记录下来，由 flush() 批量写入 indicator_snapshots 表供其他进程读取
+    """
+
+    def __init__(self, specs=DEFAULT_SPECS, interval=DEFAULT_INTERVAL):
+        self.specs = specs
+        self.interval = interval
+        self.streams = {}
+        self.updated = set()
+
+    def warm_up(self, db_session, stock_code, trade_date):
+        """
+        用数据库中当天已有的tick初始化一只股票的增量计算（进程重启后不必等待指标重新积累）
+        """
+        stream = self.streams[stock_code] = IndicatorStream(self.specs, self.interval)
+        timestamps, prices, volumes, _ = load_ticks(db_session, stock_code, trade_date)
+        for timestamp, price, volume in zip(timestamps.tolist(), prices.tolist(), volumes.tolist()):
+            stream.update_tick(timestamp, price, volume)
+        if stream.latest is not None:
+            self.updated.add(stock_code)
+        return stream
+
+    def update(self, stock_info):
+        code = stock_info['股票代码']
+        stream = self.streams.get(code)
+        if stream is None:
+            stream = self.streams[code] = IndicatorStream(self.specs, self.interval)
+        latest = stream.update(stock_info)
+        if latest is not None:
+            self.updated.add(code)
+        return latest
+
+    def latest(self, stock_code):
+        stream = self.streams.get(stock_code)
+        return stream.latest if stream else None
+
+    def flush(self, db_session):
+        """
+        将上次写入后有新K线的股票的最新指标写入数据库（每只股票一行，覆盖旧值）
+
+        返回:
+        写入的股票数
+        """
+        from models import save_indicator_snapshots
+
+        if not self.updated:
+            return 0
+        snapshots = {}
+        for code in self.updated:
+            stream = self.streams[code]
+            snapshots[code] = (self.interval, int(stream.bar.start),
+                               json.dumps(_json_values(stream.bar._asdict()), ensure_ascii=False),
+                               json.dumps(_json_values(stream.latest), ensure_ascii=False))
+        save_indicator_snapshots(db_session, snapshots)
+        self.updated.clear()
+        return len(snapshots)
+
+def _json_values(values):
+    """指标值中的 NaN（数据不足）转换为 None，便于JSON序列化"""
+    if isinstance(values, dict):
+        return {key: _json_values(value) for key, value in values.items()}
+    value = float(values)
+    return None if math.isnan(value) else value
+
+# ---------------------------------------------------------------------------
+# 历史数据与结果缓存
+# ---------------------------------------------------------------------------
+
+def load_ticks(db_session, stock_code, trade_date):
+    """
+    加载一只股票某一交易日的tick（按行情时间计时，与增量计算一致）
+
+    返回:
+    (时间戳数组, 价格数组, 累计成交量数组, 最新记录的 id)
+    """
+    from sqlalchemy import select
+    from models import StockQuote
+
+    query = select(StockQuote.id, StockQuote.time, StockQuote.current_price, StockQuote.volume)\
+        .where(StockQuote.stock_code == stock_code, StockQuote.date == trade_date)\
+        .order_by(StockQuote.created_at)
+    rows = db_session.connection().execute(query).all()
+    if not rows:
+        return np.empty(0), np.empty(0), np.empty(0), None
+
+    times = np.array([f"{trade_date}T{row[1]}" for row in rows], dtype='datetime64[s]')
+    # numpy 按UTC解析，换算为本地时区的Unix时间戳
+    offset = datetime.strptime(trade_date, '%Y-%m-%d').timestamp() \
+        - np.datetime64(trade_date, 's').astype(np.int64)
+    timestamps = times.astype(np.int64) + offset
+    prices = np.array([row[2] or 0.0 for row in rows], dtype=np.float64)
+    volumes = np.array([_parse_volume(row[3]) for row in rows], dtype=np.float64)
+    return timestamps.astype(np.float64), prices, volumes, max(row[0] for row in rows)
+
+def latest_quote_id(db_session, stock_code, trade_date):
+    """
+    一只股票某一交易日最新一条记录的 id，用于判断该日的缓存是否仍然有效
+    （其他日期的新记录不会使该日的缓存失效）
+    """
+    from sqlalchemy import select, func
+    from models import StockQuote
+
+    return db_session.execute(select(func.max(StockQuote.id))
+                              .where(StockQuote.stock_code == stock_code, StockQuote.date == trade_date)).scalar()
+
+class IndicatorCache:
+    """
+    按 (股票代码, 日期, K线周期, 指标描述) 缓存批量计算结果（LRU）
+
+    每个条目记录计算时该股票该日最新记录的 id，id 不变说明没有新数据，直接返回缓存结果
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, marker):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != marker:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, marker, value):
+        with self._lock:
+            self._entries[key] = (marker, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# 进程内共享的默认缓存
+default_cache = IndicatorCache()
+
+def history_indicators(db_session, stock_code, trade_date, specs=DEFAULT_SPECS,
+                       interval=DEFAULT_INTERVAL, cache=default_cache):
+    """
+    计算一只股票某一交易日的K线和指标，结果按指标分别缓存
+
+    返回:
+    (Bars, {规范化指标描述: 结果})
+    """
+    normalized_specs = [parse_spec(spec)[0] for spec in specs]
+    marker = latest_quote_id(db_session, stock_code, trade_date)
+    bars_key = (stock_code, trade_date, interval, 'bars')
+    bars = cache.get(bars_key, marker)
+    if bars is None:
+        timestamps, prices, volumes, _ = load_ticks(db_session, stock_code, trade_date)
+        bars = bars_from_ticks(timestamps, prices, volumes, interval)
+        cache.put(bars_key, marker, bars)
+
+    results = {}
+    for spec in normalized_specs:
+        key = (stock_code, trade_date, interval, spec)
+        values = cache.get(key, marker)
+        if values is None:
+            values = compute_batch(bars, [spec])[spec]
+            cache.put(key, marker, values)
+        results[spec] = values
+    return bars, results
+
+def self_check(ticks=20000, interval=DEFAULT_INTERVAL, specs=DEFAULT_SPECS, seed=42):
+    """
+    用随机游走的tick序列对比批量计算和增量计算的结果
+
+    返回:
+    (是否一致, 批量计算耗时, 增量计算耗时, K线数)
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = datetime(2024, 1, 2, 9, 30).timestamp() + np.arange(ticks) * 3.0
+    prices = np.round(10.0 + np.cumsum(rng.choice([-0.01, 0.0, 0.0, 0.01], size=ticks)), 2)
+    volumes = np.cumsum(rng.integers(1, 50, size=ticks)).astype(np.float64)
+
+    start = time.perf_counter()
+    bars = bars_from_ticks(timestamps, prices, volumes, interval)
+    batch = compute_batch(bars, specs)
+    batch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stream = IndicatorStream(specs, interval)
+    streamed = {spec: [] for spec in stream.streams}
+    for timestamp, price, volume in zip(timestamps.tolist(), prices.tolist(), volumes.tolist()):
+        values = stream.update_tick(timestamp, price, volume)
+        if values is not None:
+            for spec, value in values.items():
+                streamed[spec].append(value)
+    # 最后一根K线没有后续tick，增量计算时尚未结束，手动结束它
+    last = stream.builder.current()
+    for spec, indicator in stream.streams.items():
+        streamed[spec].append(indicator.update(last))
+    stream_seconds = time.perf_counter() - start
+
+    consistent = True
+    for spec, expected in batch.items():
+        if isinstance(expected, dict):
+            for part, array in expected.items():
+                actual = np.array([value[part] for value in streamed[spec]])
+                consistent &= np.allclose(actual, array, rtol=1e-9, atol=1e-9, equal_nan=True)
+        else:
+            consistent &= np.allclose(np.array(streamed[spec]), expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+    return bool(consistent), batch_seconds, stream_seconds, len(bars.close)
+
+if __name__ == '__main__':
+    import argparse
+    from metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description='技术指标自检：对比批量计算与增量计算的结果并输出耗时')
+    parser.add_argument('--ticks', type=int, default=20000)
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL)
+    args = parser.parse_args()
+    configure_logging()
+
+    consistent, batch_seconds, stream_seconds, bar_count = self_check(args.ticks, args.interval)
+    logger.info("tick数: %d，K线数: %d，批量计算 %.4f 秒，增量计算 %.4f 秒，结果%s",
+                args.ticks, bar_count, batch_seconds, stream_seconds, "一致" if consistent else "不一致")
+    if not consistent:
+        raise SystemExit(1)
@@ -0,0 +1,499 @@
+import os
+import re
+import time
+import zlib
+import struct
+import logging
+from datetime import datetime, timedelta
+import get_stock_quote
+from metrics import DB_WRITE_FAILURES, JOURNAL_RECORDS, JOURNAL_SYNC_LATENCY, JOURNAL_REPLAYED, JOURNAL_CORRUPT
+from models import get_ingest_checkpoint, save_stock_quotes_bulk
+
+logger = logging.getLogger(__name__)
+
+# 采集日志目录（可通过环境变量 STOCK_JOURNAL_DIR 指定），每个日志一个子目录
+JOURNAL_DIR = os.environ.get('STOCK_JOURNAL_DIR', 'journal')
+
+# fsync 策略（环境变量 STOCK_JOURNAL_FSYNC）：
+# always 每条记录写入后 fsync；interval 距上次 fsync 超过 SYNC_INTERVAL 秒时 fsync；
+# never 只写入操作系统缓存（进程崩溃不丢数据，断电可能丢失最近的记录）
+FSYNC_POLICIES = ('always', 'interval', 'never')
+FSYNC_POLICY = os.environ.get('STOCK_JOURNAL_FSYNC', 'interval')
+SYNC_INTERVAL = 1.0
+
+# 每个段文件的记录数上限，写满后切换到新段
+SEGMENT_RECORDS = 65536
+
+# 缓冲的记录达到该条数，或最早一条缓冲超过 FLUSH_INTERVAL 秒时，批量写入数据库
+FLUSH_RECORDS = 500
+FLUSH_INTERVAL = 5.0
+
+# 启动回放时每次提交的记录数
+REPLAY_BATCH = 5000
+
+# 段文件头：魔数、格式版本、记录长度
+SEGMENT_MAGIC = b'SQJ1'
+HEADER = struct.Struct('<4sHH')
+FORMAT_VERSION = 1
+
+# 定长记录：记录时间（Unix时间戳）、代码、名称（UTF-8）、市场、17个价格（单位0.001元）、
+# 成交量（手）、成交额（万元）、10个申报量（手）、日期（YYYYMMDD）、时间（HHMMSS），末尾为CRC32
+RECORD = struct.Struct('<d10s40sB17iqq10iII')
+CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CRC.size
+
+# 价格以0.001元为单位存储，股票（0.01元）和基金（0.001元）的报价都能精确表示
+PRICE_SCALE = 1000
+
+_LEVELS = ('一', '二', '三', '四', '五')
+PRICE_FIELDS = (('今日开盘价', '昨日收盘价', '当前价格', '今日最高价', '今日最低价', '竞买价', '竞卖价')
+                + tuple(f'买{name}报价' for name in _LEVELS) + tuple(f'卖{name}报价' for name in _LEVELS))
+SIZE_FIELDS = tuple(f'买{name}申报' for name in _LEVELS) + tuple(f'卖{name}申报' for name in _LEVELS)
+MARKETS = ('未知', '上海', '深圳', '北京')
+
+# 交易时段，用于缺口报告
+TRADING_SESSIONS = (('09:30:00', '11:30:00'), ('13:00:00', '15:00:00'))
+
+_SEGMENT_PATTERN = re.compile(r'^(\d{10})\.seg$')
+
+def _number(value, unit):
+    """将 "123手"、"45万元" 转换为整数"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(float(value[:-len(unit)] if value.endswith(unit) else value))
+    except (AttributeError, ValueError):
+        return 0
+
+def encode_record(stock_info, recorded_at):
+    """
+    将行情字典编码为一条定长记录
+
+    参数:
+    stock_info: 行情字典
+    recorded_at: 记录时间（Unix时间戳）
+    """
+    name = stock_info['股票名称'].encode('utf-8')[:40].decode('utf-8', 'ignore').encode('utf-8')
+    market = MARKETS.index(stock_info['市场']) if stock_info['市场'] in MARKETS else 0
+    payload = RECORD.pack(
+        recorded_at,
+        stock_info['股票代码'].encode('ascii'),
+        name,
+        market,
+        *[int(round((stock_info[field] or 0.0) * PRICE_SCALE)) for field in PRICE_FIELDS],
+        _number(stock_info['成交量'], '手'),
+        _number(stock_info['成交额'], '万元'),
+        *[int(stock_info[field] or 0) for field in SIZE_FIELDS],
+        int(stock_info['日期'].replace('-', '')),
+        int(stock_info['时间'].replace(':', '')),
+    )
+    return payload + CRC.pack(zlib.crc32(payload))
+
+def decode_record(data):
+    """
+    解码一条定长记录
+
+    返回:
+    (记录时间 datetime, 行情字典)；CRC 校验失败时返回 None
+    """
+    payload = data[:RECORD.size]
+    if CRC.unpack_from(data, RECORD.size)[0] != zlib.crc32(payload):
+        return None
+    values = RECORD.unpack(payload)
+    recorded_at, code, name, market = values[:4]
+    prices = values[4:21]
+    volume, amount = values[21:23]
+    sizes = values[23:33]
+    trade_date, trade_time = values[33:35]
+
+    code = code.rstrip(b'\0').decode('ascii')
+    meta = get_stock_quote.get_symbol_meta(code)
+    stock_info = {'股票代码': code, '股票名称': name.rstrip(b'\0').decode('utf-8', 'ignore'),
+                  '市场': MARKETS[market] if market < len(MARKETS) else MARKETS[0]}
+    for field, price in zip(PRICE_FIELDS, prices):
+        stock_info[field] = price / PRICE_SCALE
+    for field, size in zip(SIZE_FIELDS, sizes):
+        stock_info[field] = size
+    stock_info['成交量'] = f"{volume}手"
+    stock_info['成交额'] = f"{amount}万元"
+    stock_info['日期'] = f"{trade_date // 10000:04d}-{trade_date // 100 % 100:02d}-{trade_date % 100:02d}"
+    stock_info['时间'] = f"{trade_time // 10000:02d}:{trade_time // 100 % 100:02d}:{trade_time % 100:02d}"
+
+    # 涨跌额、涨跌幅按品种精度由当前价和昨收价计算，与 parse_stock_data 一致
+    current_ticks = get_stock_quote.to_ticks(stock_info['当前价格'], meta)
+    pre_close_ticks = get_stock_quote.to_ticks(stock_info['昨日收盘价'], meta)
+    change_ticks = current_ticks - pre_close_ticks
+    change_percent = change_ticks * 100 / pre_close_ticks if pre_close_ticks else 0.0
+    stock_info['涨跌额'] = get_stock_quote.from_ticks(change_ticks, meta)
+    stock_info['涨跌幅'] = f"{round(change_percent, 2)}%"
+    stock_info['价格小数位数'] = meta.decimals
+    return datetime.fromtimestamp(recorded_at), stock_info
+
+def read_segment(path, stats=None):
+    """
+    逐条读取段文件中的记录。记录为定长，校验失败的记录（磁盘损坏等）跳过后继续读取其后的记录；
+    末尾不完整的记录（写入中途崩溃）忽略
+
+    参数:
+    stats: 可选的字典，读取结束后 stats['corrupt'] 为跳过的记录数
+
+    返回:
+    生成 (记录序号, 记录时间, 行情字典) 的迭代器，序号从 1 开始，为记录在段内的位置（跳过的记录也占用序号）
+
+    异常:
+    ValueError: 段文件头无法识别
+    """
+    if stats is not None:
+        stats['corrupt'] = 0
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        magic, version, record_size = HEADER.unpack(header)
+        if magic != SEGMENT_MAGIC or version != FORMAT_VERSION or record_size != RECORD_SIZE:
+            raise ValueError(f"无法识别的采集日志段文件: {path}")
+        index = 0
+        while True:
+            data = f.read(RECORD_SIZE)
+            if len(data) < RECORD_SIZE:
+                if data:
+                    logger.warning("段文件 %s 第 %d 条记录不完整，忽略", path, index + 1)
+                return
+            index += 1
+            try:
+                record = decode_record(data)
+            except (struct.error, ValueError, IndexError):
+                record = None
+            if record is None:
+                logger.error("段文件 %s 第 %d 条记录校验失败，跳过", path, index)
+                if stats is not None:
+                    stats['corrupt'] += 1
+                continue
+            yield (index,) + record
+
+def _sync_directory(path):
+    """新建文件后同步目录项（Windows 不支持，跳过）"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class IngestJournal:
+    """
+    采集日志：行情在写入数据库之前先追加到本地的定长记录段文件，数据库批量提交时
+    在同一事务中记录已写入的位置（ingest_checkpoint 表）。进程意外退出后重启时，
+    replay() 把该位置之后的记录补写入数据库，不会丢失也不会重复写入。
+
+    每次启动都从新的段文件开始写入，不会在可能被截断的旧段之后追加；
+    全部记录已写入数据库的段文件会被删除。
+    """
+
+    def __init__(self, name, directory=JOURNAL_DIR, fsync=FSYNC_POLICY, sync_interval=SYNC_INTERVAL,
+                 segment_records=SEGMENT_RECORDS, flush_records=FLUSH_RECORDS, flush_interval=FLUSH_INTERVAL):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync 策略应为 {', '.join(FSYNC_POLICIES)} 之一: {fsync}")
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.fsync = fsync
+        self.sync_interval = sync_interval
+        self.segment_records = segment_records
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.segment = None
+        self.records = 0
+        self.file = None
+        self.pending = []
+        self.pending_since = None
+        self.last_sync = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}.seg")
+
+    def segments(self):
+        """目录中现有的段号（升序）"""
+        numbers = []
+        for filename in os.listdir(self.directory):
+            match = _SEGMENT_PATTERN.match(filename)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def replay(self, db_session, resume=True):
+        """
+        将上次运行中未写入数据库的记录补写入数据库，然后开始新的段文件（resume 为 False 时不再写入）；
+        必须在 append() 之前调用
+
+        返回:
+        补写入的记录数
+        """
+        checkpoint_segment, checkpoint_records = get_ingest_checkpoint(db_session, self.name)
+        replayed = 0
+        for segment in self.segments():
+            path = self._path(segment)
+            if segment < checkpoint_segment:
+                os.remove(path)
+                continue
+            start = checkpoint_records if segment == checkpoint_segment else 0
+            infos, recorded_at = [], []
+            stats = {}
+            count = 0
+            try:
+                for count, timestamp, stock_info in read_segment(path, stats):
+                    if count <= start:
+                        continue
+                    infos.append(stock_info)
+                    recorded_at.append(timestamp)
+                    if len(infos) >= REPLAY_BATCH:
+                        save_stock_quotes_bulk(db_session, infos, "replay", recorded_at, (self.name, segment, count))
+                        replayed += len(infos)
+                        infos, recorded_at = [], []
+            except ValueError as e:
+                logger.error("%s", e)
+                stats['corrupt'] = stats.get('corrupt', 0) + 1
+            if infos:
+                save_stock_quotes_bulk(db_session, infos, "replay", recorded_at, (self.name, segment, count))
+                replayed += len(infos)
+            checkpoint_segment = segment
+            if stats.get('corrupt'):
+                # 有损坏记录的段文件改名保留，便于排查，不直接删除
+                JOURNAL_CORRUPT.inc(stats['corrupt'], journal=self.name)
+                os.replace(path, path + '.corrupt')
+                logger.error("采集日志 %s：段 %d 有 %d 条记录损坏已跳过，段文件已保留为 %s",
+                             self.name, segment, stats['corrupt'], path + '.corrupt')
+            else:
+                os.remove(path)
+
+        if replayed:
+            JOURNAL_REPLAYED.inc(replayed, journal=self.name)
+            logger.warning("采集日志 %s：已补写入上次未提交的 %d 条行情", self.name, replayed)
+        if resume:
+            self._open_segment(max(checkpoint_segment, *self.segments(), 0) + 1)
+        return replayed
+
+    def _open_segment(self, segment):
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+        self.segment = segment
+        self.records = 0
+        # 不使用缓冲：每条记录写入后都会立即交给操作系统，写入失败时文件中不会残留缓冲的半条记录
+        self.file = open(self._path(segment), 'xb', buffering=0)
+        self.file.write(HEADER.pack(SEGMENT_MAGIC, FORMAT_VERSION, RECORD_SIZE))
+        self.file.flush()
+        if self.fsync != 'never':
+            os.fsync(self.file.fileno())
+            _sync_directory(self.directory)
+
+    def _sync(self):
+        with JOURNAL_SYNC_LATENCY.time(journal=self.name):
+            os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def append(self, stock_info, recorded_at=None):
+        """
+        追加一条行情；写入操作系统后返回（按 fsync 策略同步到磁盘），并缓冲等待批量写入数据库
+        """
+        if self.file is None:
+            raise RuntimeError("采集日志尚未打开，请先调用 replay()")
+        if self.records >= self.segment_records:
+            self._open_segment(self.segment + 1)
+        recorded_at = recorded_at or datetime.now()
+        data = memoryview(encode_record(stock_info, recorded_at.timestamp()))
+        try:
+            while data:
+                data = data[self.file.write(data):]
+        except OSError:
+            # 写入失败（例如磁盘已满）时截掉写了一半的记录，之后追加的记录仍按定长对齐
+            self.file.truncate(HEADER.size + self.records * RECORD_SIZE)
+            self.file.seek(0, os.SEEK_END)
+            raise
+        self.records += 1
+        if self.fsync == 'always' or (self.fsync == 'interval'
+                                      and time.monotonic() - self.last_sync >= self.sync_interval):
+            self._sync()
+        JOURNAL_RECORDS.inc(journal=self.name)
+
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.append((stock_info, recorded_at))
+
+    def should_flush(self):
+        return bool(self.pending) and (len(self.pending) >= self.flush_records
+                                       or time.monotonic() - self.pending_since >= self.flush_interval)
+
+    def flush(self, db_session):
+        """
+        将缓冲的行情批量写入数据库，并在同一事务中更新写入位置；
+        写入失败时保留缓冲，下次再试（记录已在日志中，进程退出也不会丢失）
+
+        返回:
+        写入的条数
+        """
+        if not self.pending:
+            return 0
+        infos = [stock_info for stock_info, _ in self.pending]
+        recorded_at = [timestamp for _, timestamp in self.pending]
+        try:
+            save_stock_quotes_bulk(db_session, infos, "journal", recorded_at, (self.name, self.segment, self.records))
+        except Exception as e:
+            db_session.rollback()
+            DB_WRITE_FAILURES.inc(mode="journal")
+            logger.error("采集日志 %s：%d 条行情写入数据库失败，稍后重试: %s", self.name, len(infos), e)
+            return 0
+        self.pending = []
+        # 当前段之前的段已全部写入数据库
+        for segment in self.segments():
+            if segment < self.segment:
+                os.remove(self._path(segment))
+        return len(infos)
+
+    def close(self, db_session=None):
+        """关闭日志；提供数据库会话时先写入缓冲的行情"""
+        if db_session is not None:
+            self.flush(db_session)
+        if self.file is not None:
+            if self.fsync != 'never':
+                self._sync()
+            self.file.close()
+            self.file = None
+
+def replay_inactive(db_session, active_names, directory=JOURNAL_DIR):
+    """
+    补写入当前不使用的日志中的记录，例如分片数变化后旧分片的日志、切换单进程/分片模式前的日志
+
+    参数:
+    active_names: 正在使用的日志名称（由各自的进程回放，这里跳过）
+
+    返回:
+    补写入的记录数
+    """
+    if not os.path.isdir(directory):
+        return 0
+    replayed = 0
+    for name in sorted(os.listdir(directory)):
+        if name in active_names or not os.path.isdir(os.path.join(directory, name)):
+            continue
+        journal = IngestJournal(name, directory)
+        if journal.segments():
+            replayed += journal.replay(db_session, resume=False)
+    return replayed
+
+def find_gaps(timestamps, trade_date, max_gap, sessions=TRADING_SESSIONS, until=None):
+    """
+    找出交易时段内相邻两条记录间隔超过 max_gap 秒的区间（含时段开始、结束处的缺口）
+
+    参数:
+    timestamps: 按时间排序的记录时间（datetime）
+    trade_date: 交易日期 "YYYY-MM-DD"
+    max_gap: 允许的最大间隔（秒）
+    until: 只检查到该时间为止（当天尚未结束时传入当前时间）
+
+    返回:
+    [(缺口开始, 缺口结束), ...]
+    """
+    limit = timedelta(seconds=max_gap)
+    gaps = []
+    index = 0
+    for session_start, session_end in sessions:
+        start = datetime.strptime(f"{trade_date} {session_start}", '%Y-%m-%d %H:%M:%S')
+        end = datetime.strptime(f"{trade_date} {session_end}", '%Y-%m-%d %H:%M:%S')
+        if until is not None:
+            if until <= start:
+                break
+            end = min(end, until)
+        while index < len(timestamps) and timestamps[index] < start:
+            index += 1
+        previous = start
+        while index < len(timestamps) and timestamps[index] <= end:
+            if timestamps[index] - previous > limit:
+                gaps.append((previous, timestamps[index]))
+            previous = timestamps[index]
+            index += 1
+        if end - previous > limit:
+            gaps.append((previous, end))
+    return gaps
+
+def gap_report(db_session, trade_date, stock_codes, max_gap):
+    """
+    按股票统计某一交易日交易时段内的数据缺口（以写入数据库的记录时间为准）
+
+    返回:
+    以股票代码为键的字典：{'records': 记录数, 'gaps': [(开始, 结束), ...], 'missing_seconds': 缺口总秒数}
+    """
+    from sqlalchemy import select
+    from models import StockQuote
+
+    query = select(StockQuote.stock_code, StockQuote.created_at)\
+        .where(StockQuote.stock_code.in_(list(stock_codes)), StockQuote.date == trade_date)\
+        .order_by(StockQuote.stock_code, StockQuote.created_at)
+    timestamps = {code: [] for code in stock_codes}
+    for code, created_at in db_session.connection().execute(query):
+        timestamps[code].append(created_at)
+
+    now = datetime.now()
+    until = now if trade_date == now.strftime('%Y-%m-%d') else None
+    report = {}
+    for code, times in timestamps.items():
+        gaps = find_gaps(times, trade_date, max_gap, until=until)
+        report[code] = {
+            'records': len(times),
+            'gaps': gaps,
+            'missing_seconds': sum((end - start).total_seconds() for start, end in gaps),
+        }
+    return report
+
+if __name__ == '__main__':
+    import argparse
+    from metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description='采集日志：查看状态、补写入未提交的记录、统计数据缺口')
+    parser.add_argument('--journal', default='collector', help='日志名称（分片模式为 collector-shard<i>of<n>）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='显示段文件和数据库中的写入位置')
+    subparsers.add_parser('replay', help='将未写入数据库的记录补写入数据库')
+    gaps_parser = subparsers.add_parser('gaps', help='按股票统计交易时段内的数据缺口')
+    gaps_parser.add_argument('--date', default=datetime.now().strftime('%Y-%m-%d'), help='交易日期')
+    gaps_parser.add_argument('--max-gap', type=float,
+                             help='允许的最大间隔（秒），默认为按关注股票数估算的采集周期的2倍')
+    gaps_parser.add_argument('codes', nargs='*', help='股票代码，默认为关注列表')
+    args = parser.parse_args()
+    configure_logging()
+
+    from models import Session, init_db
+    init_db()
+    db_session = Session()
+    try:
+        if args.command == 'status':
+            journal = IngestJournal(args.journal)
+            segment, records = get_ingest_checkpoint(db_session, args.journal)
+            logger.info("日志目录: %s，数据库写入位置: 段 %d 第 %d 条", journal.directory, segment, records)
+            for number in journal.segments():
+                stats = {}
+                try:
+                    count = sum(1 for _ in read_segment(journal._path(number), stats))
+                except ValueError as e:
+                    logger.error("%s", e)
+                    continue
+                logger.info("段 %d: %d 条记录（损坏 %d 条）", number, count, stats['corrupt'])
+        elif args.command == 'replay':
+            journal = IngestJournal(args.journal)
+            journal.replay(db_session)
+            journal.close()
+        else:
+            import watchlist_cache
+            from background_service import FETCH_INTERVAL, REQUEST_PAUSE
+            codes = args.codes or watchlist_cache.get_snapshot().codes
+            max_gap = args.max_gap or 2 * (len(codes) * REQUEST_PAUSE + FETCH_INTERVAL)
+            report = gap_report(db_session, args.date, codes, max_gap)
+            logger.info("%s 交易时段数据缺口（间隔超过 %.0f 秒）", args.date, max_gap)
+            for code, item in report.items():
+                logger.info("%s: 记录 %d 条，缺口 %d 处，共 %.0f 秒", code, item['records'],
+                            len(item['gaps']), item['missing_seconds'])
+                for start, end in item['gaps']:
+                    logger.info("    %s - %s", start.strftime('%H:%M:%S'), end.strftime('%H:%M:%S'))
+    finally:
+        db_session.close()
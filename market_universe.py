@@ -0,0 +1,281 @@
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import get_stock_quote
+import quote_client
+import sampling_profiler
+from background_service import acquire_lock, release_lock, is_trading_time
+from models import Session, init_db, save_stock_quotes_bulk
+from metrics import DB_WRITE_FAILURES, SWEEP_DURATION, SWEEP_FAILURES, configure_logging, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# 全市场代码列表缓存文件，每行一个股票代码
+UNIVERSE_FILE = 'universe_codes.txt'
+
+# 全市场模式锁文件，确保只有一个实例在运行
+UNIVERSE_LOCK_FILE = 'market_universe.lock'
+
+# 全市场快照间隔（秒）
+SNAPSHOT_INTERVAL = 5
+
+# 并发请求线程数
+FETCH_THREADS = 16
+
+# 扫描全市场代码时失败批次的最大重试轮数
+DISCOVER_RETRY_ROUNDS = 3
+
+# 各市场候选代码区间（左闭右开），按 get_stock_quote.MARKET_PREFIX_RULES 的前缀规则归属市场
+UNIVERSE_RANGES = {
+    'sh': [
+        (600000, 606000),  # 沪市主板
+        (688000, 690000),  # 科创板
+        (510000, 520000),  # 沪市ETF
+        (560000, 564000),  # 沪市ETF
+        (588000, 590000),  # 科创板ETF
+    ],
+    'sz': [
+        (1, 4000),         # 深市主板
+        (300000, 302000),  # 创业板
+        (159000, 160000),  # 深市ETF
+    ],
+    'bj': [
+        (430000, 431000),  # 北交所（原新三板基础层转板）
+        (830000, 840000),  # 北交所
+        (870000, 874000),  # 北交所
+        (920000, 921000),  # 北交所新代码段
+    ],
+}
+
+def generate_candidate_codes(markets=None):
+    """
+    按代码区间生成各市场的候选股票代码
+
+    候选代码中包含大量未上市的空号，需要经过 discover_universe 过滤
+
+    参数:
+    markets: 市场前缀列表，例如 ["sh", "sz"]，默认全部市场
+
+    返回:
+    股票代码列表
+    """
+    codes = []
+    for market in (markets or UNIVERSE_RANGES.keys()):
+        for start, end in UNIVERSE_RANGES[market]:
+            for number in range(start, end):
+                code = f"{number:06d}"
+                # 只保留前缀规则归属到该市场的代码
+                if get_stock_quote.get_market_prefix(code) == market:
+                    codes.append(code)
+    return codes
+
+def _batches(codes, batch_size):
+    for i in range(0, len(codes), batch_size):
+        yield codes[i:i + batch_size]
+
+def sweep_universe(codes, batch_size=get_stock_quote.BATCH_SIZE, threads=FETCH_THREADS):
+    """
+    以批量并发请求的方式获取一组股票的行情快照
+
+    参数:
+    codes: 股票代码列表
+    batch_size: 单次请求包含的股票数量
+    threads: 并发请求线程数
+
+    返回:
+    (quotes, stats) 元组，quotes 为以股票代码为键的行情字典，stats 为本次抓取的统计信息，
+    其中 failed_batches 为请求失败的批次（代码列表）
+    """
+    quotes = {}
+    requests_total = 0
+    failed_batches = []
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = {executor.submit(quote_client.default_client.fetch, batch): batch
+                   for batch in _batches(codes, batch_size)}
+        for future in as_completed(futures):
+            requests_total += 1
+            try:
+                quotes.update(future.result())
+            except Exception as e:
+                failed_batches.append(futures[future])
+                logger.warning("批量获取股票数据失败: %s", e)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'symbols_requested': len(codes),
+        'symbols_received': len(quotes),
+        'requests': requests_total,
+        'request_errors': len(failed_batches),
+        'failed_batches': failed_batches,
+        'fetch_seconds': elapsed,
+        'symbols_per_second': len(quotes) / elapsed if elapsed > 0 else 0.0,
+    }
+    return quotes, stats
+
+def discover_universe(markets=None, batch_size=get_stock_quote.BATCH_SIZE, threads=FETCH_THREADS,
+                      retry_rounds=DISCOVER_RETRY_ROUNDS):
+    """
+    扫描候选代码区间，返回新浪接口有数据的全部股票代码（按代码排序）
+
+    请求失败的批次最多重试 retry_rounds 轮；熔断器打开时先等待其冷却结束再重试。
+    重试逐批顺序请求：熔断器半开时只放行一个试探请求，并发重试的其余请求会被直接拒绝
+
+    返回:
+    (codes, stats) 元组，stats['request_errors'] 为重试后仍然失败的批次数，不为 0 时代码列表不完整
+    """
+    candidates = generate_candidate_codes(markets)
+    logger.info("扫描候选代码 %d 个...", len(candidates))
+    quotes, stats = sweep_universe(candidates, batch_size, threads)
+    failed_batches = stats['failed_batches']
+
+    for retry in range(retry_rounds):
+        if not failed_batches:
+            break
+        breaker = quote_client.default_client.breaker()
+        if breaker.state == "closed":
+            wait = quote_client.backoff_delay(retry)
+        else:
+            wait = max(0.0, breaker.opened_at + breaker.reset_timeout - time.monotonic())
+        logger.warning("%d 个批次请求失败，%.1f 秒后第 %d 次重试", len(failed_batches), wait, retry + 1)
+        time.sleep(wait)
+        retry_codes = [code for batch in failed_batches for code in batch]
+        retry_quotes, retry_stats = sweep_universe(retry_codes, batch_size, threads=1)
+        quotes.update(retry_quotes)
+        stats['requests'] += retry_stats['requests']
+        stats['fetch_seconds'] += retry_stats['fetch_seconds']
+        failed_batches = retry_stats['failed_batches']
+
+    stats['request_errors'] = len(failed_batches)
+    stats['failed_batches'] = failed_batches
+    stats['symbols_received'] = len(quotes)
+    logger.info("发现有效代码 %d 个，请求 %d 次（最终失败 %d 次），耗时 %.2f 秒",
+                stats['symbols_received'], stats['requests'], stats['request_errors'], stats['fetch_seconds'])
+    return sorted(quotes.keys()), stats
+
+def save_universe(codes, path=UNIVERSE_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(codes))
+        f.write('\n')
+
+def load_universe(path=UNIVERSE_FILE, refresh=False, markets=None):
+    """
+    加载全市场代码列表；缓存文件不存在或要求刷新时，重新扫描生成并写入缓存文件
+
+    参数:
+    path: 代码列表缓存文件路径
+    refresh: 是否忽略缓存重新扫描
+    markets: 市场前缀列表，默认全部市场
+
+    返回:
+    股票代码列表
+    """
+    if not refresh and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            codes = [line.strip() for line in f if line.strip()]
+        if markets:
+            codes = [code for code in codes if get_stock_quote.get_market_prefix(code) in markets]
+        return codes
+
+    codes, stats = discover_universe(markets)
+    # 有请求失败时代码列表不完整，不写入缓存文件，避免之后的运行把不完整的列表当作全市场
+    if stats['request_errors']:
+        logger.warning("扫描有 %d 个批次请求失败，全市场代码列表不完整，不写入缓存文件 %s",
+                       stats['request_errors'], path)
+    elif codes:
+        save_universe(codes, path)
+    return codes
+
+def snapshot_once(db_session, codes, batch_size=get_stock_quote.BATCH_SIZE, threads=FETCH_THREADS):
+    """
+    执行一次全市场快照：批量抓取并批量写入 stock_quotes 表
+
+    返回:
+    本次快照的统计信息
+    """
+    quotes, stats = sweep_universe(codes, batch_size, threads)
+    SWEEP_FAILURES.inc(stats['symbols_requested'] - stats['symbols_received'], mode="universe")
+
+    write_start = time.perf_counter()
+    try:
+        stats['rows_written'] = save_stock_quotes_bulk(db_session, quotes.values())
+    except Exception as db_error:
+        db_session.rollback()
+        stats['rows_written'] = 0
+        DB_WRITE_FAILURES.inc(mode="bulk")
+        logger.error("全市场快照数据存储失败: %s", db_error)
+    stats['write_seconds'] = time.perf_counter() - write_start
+    stats['total_seconds'] = stats['fetch_seconds'] + stats['write_seconds']
+    SWEEP_DURATION.observe(stats['total_seconds'], mode="universe")
+    return stats
+
+def log_snapshot_stats(stats):
+    missing = stats['symbols_requested'] - stats['symbols_received']
+    logger.info("全市场快照完成: %d/%d 只（缺失 %d 只），请求 %d 次（失败 %d 次），"
+                "抓取耗时 %.2f 秒，写入 %d 行耗时 %.2f 秒，吞吐 %.0f 只/秒",
+                stats['symbols_received'], stats['symbols_requested'], missing,
+                stats['requests'], stats['request_errors'], stats['fetch_seconds'],
+                stats['rows_written'], stats['write_seconds'], stats['symbols_per_second'])
+
+def run_universe_mode(codes, interval=SNAPSHOT_INTERVAL, batch_size=get_stock_quote.BATCH_SIZE,
+                      threads=FETCH_THREADS, once=False):
+    """
+    全市场快照主循环，交易时间内按固定节奏抓取全部代码
+    """
+    if not acquire_lock(UNIVERSE_LOCK_FILE):
+        logger.warning("全市场快照服务已经在运行，退出当前实例")
+        return
+
+    init_db()
+    db_session = Session()
+    logger.info("全市场快照服务已启动，代码数: %d，间隔: %s秒，每批: %d只，并发: %d",
+                len(codes), interval, batch_size, threads)
+
+    try:
+        while True:
+            round_start = time.time()
+
+            if once or is_trading_time():
+                stats = snapshot_once(db_session, codes, batch_size, threads)
+                log_snapshot_stats(stats)
+                if once:
+                    break
+            else:
+                logger.info("当前不在交易时间内，跳过本次全市场快照")
+
+            # 按固定节奏运行，扣除本轮已耗费的时间
+            time.sleep(max(0.0, interval - (time.time() - round_start)))
+    except KeyboardInterrupt:
+        logger.info("全市场快照服务正在停止...")
+    finally:
+        db_session.close()
+        release_lock(UNIVERSE_LOCK_FILE)
+        logger.info("全市场快照服务已停止")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='全市场（沪/深/北）行情快照服务')
+    parser.add_argument('--markets', nargs='+', choices=sorted(UNIVERSE_RANGES.keys()),
+                        help='只采集指定市场，默认全部')
+    parser.add_argument('--interval', type=float, default=SNAPSHOT_INTERVAL, help='快照间隔（秒）')
+    parser.add_argument('--batch-size', type=int, default=get_stock_quote.BATCH_SIZE,
+                        help='单次请求包含的股票数量')
+    parser.add_argument('--threads', type=int, default=FETCH_THREADS, help='并发请求线程数')
+    parser.add_argument('--universe-file', default=UNIVERSE_FILE, help='全市场代码列表缓存文件')
+    parser.add_argument('--refresh', action='store_true', help='重新扫描生成全市场代码列表')
+    parser.add_argument('--once', action='store_true', help='只执行一次快照（不受交易时间限制）')
+    parser.add_argument('--metrics-port', type=int, help='在该端口提供 /metrics 指标')
+    args = parser.parse_args()
+
+    configure_logging()
+    sampling_profiler.start_from_env('universe')
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    universe = load_universe(args.universe_file, refresh=args.refresh, markets=args.markets)
+    if not universe:
+        logger.error("全市场代码列表为空，退出")
+    else:
+        run_universe_mode(universe, args.interval, args.batch_size, args.threads, args.once)
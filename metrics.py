@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"标签不匹配: 需要 {labelnames}，实际 {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """只增不减的计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name + _format_labels(self.labelnames, key), value
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, values):
+        """累加另一个进程导出的值（多进程汇总用）"""
+        with self._lock:
+            for key, value in values:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+class Gauge(Counter):
+    """可增可减、可直接设置的数值"""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """累积分桶直方图，记录观测值的分布、总和与次数"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文管理器：with histogram.time(route='/'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(_label_key(self.labelnames, labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield (self.name + '_bucket' + _format_labels(self.labelnames, key, ('le', _format_value(bound))),
+                       cumulative)
+            yield self.name + '_sum' + _format_labels(self.labelnames, key), total
+            yield self.name + '_count' + _format_labels(self.labelnames, key), count
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), [*state[0]], state[1], state[2]] for key, state in self._values.items()]
+
+    def merge(self, values):
+        """累加另一个进程导出的分桶计数、总和与次数（分桶须一致）"""
+        with self._lock:
+            for key, counts, total, count in values:
+                state = self._values.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+class Registry:
+    """进程内指标注册表，同名指标只注册一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为其他类型")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """按 Prometheus 文本格式导出全部指标"""
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for sample_name, value in metric.samples():
+                lines.append(f"{sample_name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self):
+        """导出全部指标的当前值（可JSON序列化），供 merge() 在其他进程中汇总"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        state = {}
+        for metric in metrics:
+            entry = {'type': metric.type_name, 'help': metric.documentation,
+                     'labels': list(metric.labelnames), 'values': metric.dump()}
+            if isinstance(metric, Histogram):
+                entry['buckets'] = list(metric.buckets)
+            state[metric.name] = entry
+        return state
+
+    def merge(self, state):
+        """把 dump() 导出的值累加到本注册表（计数器、直方图按进程相加，仪表值同样相加）"""
+        for name, entry in state.items():
+            if entry['type'] == 'histogram':
+                metric = self.histogram(name, entry['help'], entry['labels'], buckets=entry['buckets'])
+            elif entry['type'] == 'gauge':
+                metric = self.gauge(name, entry['help'], entry['labels'])
+            else:
+                metric = self.counter(name, entry['help'], entry['labels'])
+            metric.merge(entry['values'])
+
+# 多个Web工作进程（gunicorn --workers N）各有独立的注册表；设置该环境变量后，
+# 各进程定期把指标写入该目录下以进程号命名的文件，/metrics 汇总目录中全部文件后输出
+MULTIPROCESS_DIR_ENV = 'STOCK_METRICS_DIR'
+
+# 工作进程写入指标文件的间隔（秒），/metrics 中其他进程的数据最多滞后这么久
+MULTIPROCESS_DUMP_INTERVAL = 5
+
+_dump_file = (None, None)
+
+def _process_dump_path(directory):
+    # 文件名包含进程启动时刻，进程号被新进程复用时不会覆盖已退出进程的累计值
+    global _dump_file
+    pid, filename = _dump_file
+    if pid != os.getpid():
+        filename = f'{os.getpid()}-{time.time_ns()}.json'
+        _dump_file = (os.getpid(), filename)
+    return os.path.join(directory, filename)
+
+def dump_to_dir(directory, metrics_registry=None):
+    """把本进程的指标写入共享目录（先写临时文件再替换，读取方不会读到写了一半的文件）"""
+    metrics_registry = metrics_registry or registry
+    path = _process_dump_path(directory)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(metrics_registry.dump(), f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def start_multiprocess_dump(directory, interval=MULTIPROCESS_DUMP_INTERVAL, metrics_registry=None):
+    """在后台线程中定期执行 dump_to_dir()；线程不会被 fork 继承，需在每个工作进程中启动"""
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                dump_to_dir(directory, metrics_registry)
+            except OSError as e:
+                logger.warning("写入多进程指标文件失败: %s", e)
+
+    thread = threading.Thread(target=run, name='metrics-dump', daemon=True)
+    thread.start()
+    return thread
+
+def render_multiprocess(directory, metrics_registry=None):
+    """先写入本进程的最新值，再汇总共享目录中所有进程（包括已退出的进程）的指标"""
+    dump_to_dir(directory, metrics_registry)
+    merged = Registry()
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                merged.merge(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning("读取多进程指标文件 %s 失败: %s", filename, e)
+    return merged.render()
+
+def render(metrics_registry=None):
+    """导出指标：设置了 STOCK_METRICS_DIR 时汇总所有工作进程，否则只导出本进程"""
+    directory = os.environ.get(MULTIPROCESS_DIR_ENV)
+    if directory:
+        return render_multiprocess(directory, metrics_registry)
+    return (metrics_registry or registry).render()
+
+# 进程内默认注册表
+registry = Registry()
+
+# 行情采集链路的指标
+UPSTREAM_LATENCY = registry.histogram(
+    'stock_upstream_request_seconds', '上游行情接口请求耗时', ['endpoint'])
+UPSTREAM_FAILURES = registry.counter(
+    'stock_upstream_failures_total', '上游行情接口请求失败次数', ['endpoint'])
+UPSTREAM_RETRIES = registry.counter(
+    'stock_upstream_retries_total', '上游行情接口重试次数', ['endpoint'])
+UPSTREAM_HEDGES = registry.counter(
+    'stock_upstream_hedged_requests_total', '因首个请求过慢而发出的对冲请求次数', ['endpoint'])
+CIRCUIT_REJECTIONS = registry.counter(
+    'stock_circuit_open_rejections_total', '熔断器打开期间被拒绝的请求次数', ['endpoint'])
+PARSE_LATENCY = registry.histogram(
+    'stock_parse_seconds', '解析一次上游响应的耗时', ['mode'])
+QUOTE_CACHE = registry.counter(
+    'stock_quote_cache_total', '行情缓存查询结果（fresh 新鲜命中、stale 过期回退、miss 未命中）', ['result'])
+DB_WRITE_LATENCY = registry.histogram(
+    'stock_db_write_seconds', '行情写入数据库的耗时', ['mode'])
+DB_WRITE_FAILURES = registry.counter(
+    'stock_db_write_failures_total', '行情写入数据库失败次数', ['mode'])
+QUOTES_STORED = registry.counter(
+    'stock_quotes_stored_total', '写入数据库的行情条数', ['mode'])
+SWEEP_DURATION = registry.histogram(
+    'stock_sweep_seconds', '一轮采集的耗时', ['mode'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+SWEEP_FAILURES = registry.counter(
+    'stock_sweep_symbol_failures_total', '采集中获取失败的股票数', ['mode'])
+JOURNAL_RECORDS = registry.counter(
+    'stock_journal_records_total', '写入采集日志的行情条数', ['journal'])
+JOURNAL_SYNC_LATENCY = registry.histogram(
+    'stock_journal_fsync_seconds', '采集日志 fsync 的耗时', ['journal'])
+JOURNAL_REPLAYED = registry.counter(
+    'stock_journal_replayed_total', '启动时从采集日志补写入数据库的行情条数', ['journal'])
+JOURNAL_CORRUPT = registry.counter(
+    'stock_journal_corrupt_records_total', '回放采集日志时校验失败而跳过的记录数', ['journal'])
+API_LATENCY = registry.histogram(
+    'stock_api_request_seconds', 'Web接口处理耗时', ['route', 'method', 'status'])
+
+def start_metrics_server(port, host='0.0.0.0', metrics_registry=None):
+    """
+    在后台线程中启动仅提供 /metrics 的HTTP服务，供没有Web框架的进程（后台服务等）暴露指标
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    metrics_registry = metrics_registry or registry
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics_registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，便于日志系统检索"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def configure_logging(level=None):
+    """
+    配置日志输出；级别取自参数或环境变量 STOCK_LOG_LEVEL（默认 INFO），
+    环境变量 STOCK_LOG_FORMAT=json 时输出JSON格式
+    """
+    level = level or os.environ.get('STOCK_LOG_LEVEL', 'INFO')
+    handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get('STOCK_LOG_FORMAT', '').lower() == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s',
+                                               '%Y-%m-%d %H:%M:%S'))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
@@ -0,0 +1,239 @@
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Index, select, update
+from sqlalchemy.orm import declarative_base, sessionmaker
+from metrics import DB_WRITE_LATENCY, QUOTES_STORED
+
+# 数据库地址（可通过环境变量 STOCK_DB_URL 指定，例如基准测试使用的临时数据库）
+DATABASE_URL = os.environ.get('STOCK_DB_URL', 'sqlite:///stock_data.db')
+
+def make_engine(url=DATABASE_URL):
+    """
+    创建数据库引擎；SQLite 下多个进程同时写入时，等待写锁而不是立即报错
+    """
+    connect_args = {'timeout': 30} if url.startswith('sqlite') else {}
+    return create_engine(url, echo=False, connect_args=connect_args)
+
+# 进程内共用的数据库引擎和会话工厂（创建时不会连接数据库）
+engine = make_engine()
+Base = declarative_base()
+Session = sessionmaker(bind=engine)
+
+# 定义关注列表数据模型
+class Watchlist(Base):
+    __tablename__ = 'watchlist'
+
+    id = Column(Integer, primary_key=True)
+    stock_code = Column(String(10), unique=True, index=True)
+    stock_name = Column(String(50))
+    market = Column(String(10))
+    added_at = Column(DateTime, default=datetime.now)
+
+# 关注列表版本号（单行表）：每次增删关注股票时递增，各进程据此判断内存中的关注列表是否需要重新加载
+class WatchlistVersion(Base):
+    __tablename__ = 'watchlist_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+def get_watchlist_version(db_session):
+    return db_session.execute(select(WatchlistVersion.version).where(WatchlistVersion.id == 1)).scalar() or 0
+
+def bump_watchlist_version(db_session):
+    """
+    递增关注列表版本号，与关注列表的修改在同一事务中提交
+    """
+    result = db_session.execute(update(WatchlistVersion).where(WatchlistVersion.id == 1)
+                                .values(version=WatchlistVersion.version + 1))
+    if result.rowcount == 0:
+        db_session.add(WatchlistVersion(id=1, version=1))
+
+# 采集日志的写入进度：每个日志已写入数据库的位置（段号、段内记录数），与行情在同一事务中更新
+class IngestCheckpoint(Base):
+    __tablename__ = 'ingest_checkpoint'
+
+    journal = Column(String(50), primary_key=True)
+    segment = Column(Integer, nullable=False, default=0)
+    records = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+def get_ingest_checkpoint(db_session, journal):
+    """
+    返回:
+    (段号, 该段已写入的记录数)，没有记录时为 (0, 0)
+    """
+    checkpoint = db_session.get(IngestCheckpoint, journal)
+    return (checkpoint.segment, checkpoint.records) if checkpoint else (0, 0)
+
+def _set_ingest_checkpoint(db_session, journal, segment, records):
+    checkpoint = db_session.get(IngestCheckpoint, journal)
+    if checkpoint is None:
+        db_session.add(IngestCheckpoint(journal=journal, segment=segment, records=records))
+    else:
+        checkpoint.segment = segment
+        checkpoint.records = records
+
+# 采集服务增量计算的技术指标，每只股票保留最近一根已结束K线的结果，供Web应用读取
+class IndicatorSnapshot(Base):
+    __tablename__ = 'indicator_snapshots'
+
+    stock_code = Column(String(10), primary_key=True)
+    interval = Column(Integer, nullable=False)
+    bar_start = Column(Integer, nullable=False)  # K线开始时间（Unix时间戳，秒）
+    bar = Column(Text, nullable=False)  # K线（JSON）
+    values = Column(Text, nullable=False)  # 以指标描述为键的指标值（JSON）
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+def save_indicator_snapshots(db_session, snapshots):
+    """
+    写入（覆盖）多只股票的指标快照并提交
+
+    参数:
+    snapshots: 以股票代码为键、(K线周期, K线开始时间, K线JSON, 指标值JSON) 为值的字典
+    """
+    for stock_code, (interval, bar_start, bar, values) in snapshots.items():
+        snapshot = db_session.get(IndicatorSnapshot, stock_code)
+        if snapshot is None:
+            db_session.add(IndicatorSnapshot(stock_code=stock_code, interval=interval, bar_start=bar_start,
+                                             bar=bar, values=values))
+        else:
+            snapshot.interval = interval
+            snapshot.bar_start = bar_start
+            snapshot.bar = bar
+            snapshot.values = values
+    db_session.commit()
+
+def get_indicator_snapshot(db_session, stock_code):
+    return db_session.get(IndicatorSnapshot, stock_code)
+
+# 定义股票行情数据模型
+class StockQuote(Base):
+    __tablename__ = 'stock_quotes'
+
+    id = Column(Integer, primary_key=True)
+    stock_code = Column(String(10), index=True)
+    stock_name = Column(String(50))
+    market = Column(String(10))
+    current_price = Column(Float)
+    change_price = Column(Float)
+    change_percent = Column(Float)
+    open_price = Column(Float)
+    pre_close = Column(Float)
+    high_price = Column(Float)
+    low_price = Column(Float)
+    volume = Column(String(20))
+    amount = Column(String(20))
+    buy1_price = Column(Float)
+    buy1_amount = Column(Integer)
+    buy2_price = Column(Float)
+    buy2_amount = Column(Integer)
+    buy3_price = Column(Float)
+    buy3_amount = Column(Integer)
+    buy4_price = Column(Float)
+    buy4_amount = Column(Integer)
+    buy5_price = Column(Float)
+    buy5_amount = Column(Integer)
+    sell1_price = Column(Float)
+    sell1_amount = Column(Integer)
+    sell2_price = Column(Float)
+    sell2_amount = Column(Integer)
+    sell3_price = Column(Float)
+    sell3_amount = Column(Integer)
+    sell4_price = Column(Float)
+    sell4_amount = Column(Integer)
+    sell5_price = Column(Float)
+    sell5_amount = Column(Integer)
+    date = Column(String(10), index=True)
+    time = Column(String(8))
+    created_at = Column(DateTime, default=datetime.now)
+
+# 按股票取最新行情、按时间取走势的复合索引；已有数据库在 init_db 中补建
+QUOTE_CODE_TIME_INDEX = Index('ix_stock_quotes_code_created', StockQuote.stock_code, StockQuote.created_at)
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+def init_db(db_engine=None):
+    """
+    创建数据表（已存在的表不受影响）；同一引擎在进程内只执行一次
+    """
+    db_engine = db_engine or engine
+    with _init_lock:
+        if id(db_engine) in _initialized:
+            return
+        Base.metadata.create_all(db_engine)
+        QUOTE_CODE_TIME_INDEX.create(db_engine, checkfirst=True)
+        # 预先写入版本号行，之后的递增只需 UPDATE
+        with db_engine.begin() as connection:
+            if connection.execute(select(WatchlistVersion.id)).first() is None:
+                connection.execute(WatchlistVersion.__table__.insert().values(id=1, version=0))
+        _initialized.add(id(db_engine))
+
+# 将股票信息字典转换为 stock_quotes 表的一行数据
+def build_quote_record(stock_info):
+    return dict(
+        stock_code=stock_info['股票代码'],
+        stock_name=stock_info['股票名称'],
+        market=stock_info['市场'],
+        current_price=stock_info['当前价格'],
+        change_price=stock_info['涨跌额'],
+        change_percent=float(stock_info['涨跌幅'].replace('%', '')),
+        open_price=stock_info['今日开盘价'],
+        pre_close=stock_info['昨日收盘价'],
+        high_price=stock_info['今日最高价'],
+        low_price=stock_info['今日最低价'],
+        volume=stock_info['成交量'],
+        amount=stock_info['成交额'],
+        buy1_price=stock_info['买一报价'],
+        buy1_amount=stock_info['买一申报'],
+        buy2_price=stock_info['买二报价'],
+        buy2_amount=stock_info['买二申报'],
+        buy3_price=stock_info['买三报价'],
+        buy3_amount=stock_info['买三申报'],
+        buy4_price=stock_info['买四报价'],
+        buy4_amount=stock_info['买四申报'],
+        buy5_price=stock_info['买五报价'],
+        buy5_amount=stock_info['买五申报'],
+        sell1_price=stock_info['卖一报价'],
+        sell1_amount=stock_info['卖一申报'],
+        sell2_price=stock_info['卖二报价'],
+        sell2_amount=stock_info['卖二申报'],
+        sell3_price=stock_info['卖三报价'],
+        sell3_amount=stock_info['卖三申报'],
+        sell4_price=stock_info['卖四报价'],
+        sell4_amount=stock_info['卖四申报'],
+        sell5_price=stock_info['卖五报价'],
+        sell5_amount=stock_info['卖五申报'],
+        date=stock_info['日期'],
+        time=stock_info['时间']
+    )
+
+# 保存一条行情数据到数据库
+def save_stock_quote(db_session, stock_info, mode="single"):
+    with DB_WRITE_LATENCY.time(mode=mode):
+        stock_quote = StockQuote(**build_quote_record(stock_info))
+        db_session.add(stock_quote)
+        db_session.commit()
+    QUOTES_STORED.inc(mode=mode)
+
+# 批量保存行情数据到数据库，一次提交
+# recorded_at: 与 stock_infos 一一对应的记录时间，默认为当前时间
+# checkpoint: (日志名称, 段号, 记录数)，采集日志的写入进度与行情在同一事务中提交
+def save_stock_quotes_bulk(db_session, stock_infos, mode="bulk", recorded_at=None, checkpoint=None):
+    now = datetime.now()
+    records = []
+    for index, stock_info in enumerate(stock_infos):
+        record = build_quote_record(stock_info)
+        # 批量插入不经过ORM对象构造，需要显式填写默认值字段
+        record['created_at'] = recorded_at[index] if recorded_at else now
+        records.append(record)
+    if records or checkpoint:
+        with DB_WRITE_LATENCY.time(mode=mode):
+            if records:
+                db_session.bulk_insert_mappings(StockQuote, records)
+            if checkpoint:
+                _set_ingest_checkpoint(db_session, *checkpoint)
+            db_session.commit()
+        QUOTES_STORED.inc(len(records), mode=mode)
+    return len(records)
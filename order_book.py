@@ -0,0 +1,367 @@
+import time
+import logging
+from collections import deque
+from datetime import datetime
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 默认滚动窗口（tick数）
+DEFAULT_WINDOW = 20
+
+# 盘口档位数
+LEVELS = 5
+
+# 买一到买五、卖一到卖五在行情字典中的名称
+LEVEL_NAMES = ('一', '二', '三', '四', '五')
+
+# 逐笔计算的特征
+FEATURES = ('spread', 'spread_bp', 'mid', 'microprice', 'imbalance', 'depth_imbalance', 'pressure')
+
+# 需要计算滚动均值的特征，输出键为 "<特征>_mean"
+ROLLING_FEATURES = ('spread', 'imbalance', 'depth_imbalance', 'pressure')
+
+class BookArrays:
+    """
+    一只股票一段时间内的五档盘口，按列存储
+
+    timestamps: (n,) Unix时间戳（秒）
+    price: (n,) 成交价
+    bid_px / bid_sz / ask_px / ask_sz: (n, 5) 买一到买五、卖一到卖五的报价和申报手数
+    """
+
+    __slots__ = ('timestamps', 'price', 'bid_px', 'bid_sz', 'ask_px', 'ask_sz')
+
+    def __init__(self, timestamps, price, bid_px, bid_sz, ask_px, ask_sz):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.bid_px = np.asarray(bid_px, dtype=np.float64).reshape(-1, LEVELS)
+        self.bid_sz = np.asarray(bid_sz, dtype=np.float64).reshape(-1, LEVELS)
+        self.ask_px = np.asarray(ask_px, dtype=np.float64).reshape(-1, LEVELS)
+        self.ask_sz = np.asarray(ask_sz, dtype=np.float64).reshape(-1, LEVELS)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """
+        由 (n, 22) 矩阵构造：时间戳、成交价、买一到买五报价、买一到买五申报、卖一到卖五报价、卖一到卖五申报
+        """
+        matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, 2 + 4 * LEVELS)
+        return cls(matrix[:, 0], matrix[:, 1], matrix[:, 2:7], matrix[:, 7:12], matrix[:, 12:17], matrix[:, 17:22])
+
+    @classmethod
+    def from_stock_infos(cls, stock_infos, timestamps=None):
+        """
+        由行情字典列表构造；未提供时间戳时使用行情中的日期和时间
+        """
+        rows = [stock_info_row(stock_info) for stock_info in stock_infos]
+        matrix = np.array(rows, dtype=np.float64).reshape(-1, 2 + 4 * LEVELS)
+        if timestamps is not None:
+            matrix[:, 0] = timestamps
+        return cls.from_matrix(matrix)
+
+def _quote_timestamp(stock_info):
+    try:
+        return datetime.strptime(f"{stock_info['日期']} {stock_info['时间']}", '%Y-%m-%d %H:%M:%S').timestamp()
+    except (KeyError, ValueError):
+        return time.time()
+
+def stock_info_row(stock_info):
+    """行情字典转换为 BookArrays.from_matrix 使用的一行"""
+    row = [_quote_timestamp(stock_info), stock_info['当前价格']]
+    row += [stock_info[f'买{name}报价'] or 0.0 for name in LEVEL_NAMES]
+    row += [stock_info[f'买{name}申报'] or 0 for name in LEVEL_NAMES]
+    row += [stock_info[f'卖{name}报价'] or 0.0 for name in LEVEL_NAMES]
+    row += [stock_info[f'卖{name}申报'] or 0 for name in LEVEL_NAMES]
+    return row
+
+def compute_features(book):
+    """
+    向量化计算每个tick的盘口特征
+
+    - spread: 卖一价 - 买一价；spread_bp: 相对中间价的基点数
+    - mid: (买一价 + 卖一价) / 2
+    - microprice: 按对手方一档申报量加权的价格，(卖一价 * 买一量 + 买一价 * 卖一量) / (买一量 + 卖一量)
+    - imbalance: 一档申报量失衡，(买一量 - 卖一量) / (买一量 + 卖一量)，范围 [-1, 1]
+    - depth_imbalance: 五档合计申报量失衡
+    - pressure: 按档位与中间价距离加权的五档申报量失衡，越靠近中间价权重越大（权重 1 / (1 + 距离基点数)）
+
+    涨跌停等一侧盘口为空时，依赖双边报价的特征为 NaN
+
+    返回:
+    以特征名为键、(n,) 数组为值的字典
+    """
+    bid1 = book.bid_px[:, 0]
+    ask1 = book.ask_px[:, 0]
+    bid1_sz = book.bid_sz[:, 0]
+    ask1_sz = book.ask_sz[:, 0]
+    two_sided = (bid1 > 0) & (ask1 > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = np.where(two_sided, ask1 - bid1, np.nan)
+        mid = np.where(two_sided, (ask1 + bid1) / 2, np.nan)
+        spread_bp = spread / mid * 1e4
+
+        top_depth = bid1_sz + ask1_sz
+        microprice = np.where(two_sided & (top_depth > 0), (ask1 * bid1_sz + bid1 * ask1_sz) / top_depth, mid)
+        imbalance = np.where(top_depth > 0, (bid1_sz - ask1_sz) / top_depth, np.nan)
+
+        bid_depth = book.bid_sz.sum(axis=1)
+        ask_depth = book.ask_sz.sum(axis=1)
+        total_depth = bid_depth + ask_depth
+        depth_imbalance = np.where(total_depth > 0, (bid_depth - ask_depth) / total_depth, np.nan)
+
+        # 距离中间价的基点数；没有报价的档位权重为 0
+        mid_column = mid[:, None]
+        bid_weight = np.where(book.bid_px > 0, 1.0 / (1.0 + (mid_column - book.bid_px) / mid_column * 1e4), 0.0)
+        ask_weight = np.where(book.ask_px > 0, 1.0 / (1.0 + (book.ask_px - mid_column) / mid_column * 1e4), 0.0)
+        weighted_bid = np.nansum(bid_weight * book.bid_sz, axis=1)
+        weighted_ask = np.nansum(ask_weight * book.ask_sz, axis=1)
+        weighted_total = weighted_bid + weighted_ask
+        pressure = np.where(two_sided & (weighted_total > 0), (weighted_bid - weighted_ask) / weighted_total, np.nan)
+
+    return {
+        'spread': spread,
+        'spread_bp': spread_bp,
+        'mid': mid,
+        'microprice': microprice,
+        'imbalance': imbalance,
+        'depth_imbalance': depth_imbalance,
+        'pressure': pressure,
+    }
+
+def rolling_mean(values, window):
+    """
+    忽略 NaN 的滚动均值（窗口内没有有效值时为 NaN），基于累加和，O(n)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(0, end - window)
+    window_counts = counts[end] - counts[start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(window_counts > 0, (sums[end] - sums[start]) / window_counts, np.nan)
+
+def analyze(book, window=DEFAULT_WINDOW):
+    """
+    计算逐笔特征和滚动均值
+
+    返回:
+    以特征名为键的数组字典，另含 timestamps、price
+    """
+    features = compute_features(book)
+    for name in ROLLING_FEATURES:
+        features[f'{name}_mean'] = rolling_mean(features[name], window)
+    features['timestamps'] = book.timestamps
+    features['price'] = book.price
+    return features
+
+class OrderBookStream:
+    """
+    单只股票的增量盘口分析：每个新tick只计算该tick的特征，滚动均值用队列和累加和维护，
+    结果与对同一序列调用 analyze() 一致
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.last_tick = None
+        self.latest = None
+        self._windows = {name: deque() for name in ROLLING_FEATURES}
+        self._sums = dict.fromkeys(ROLLING_FEATURES, 0.0)
+        self._counts = dict.fromkeys(ROLLING_FEATURES, 0)
+
+    def _push(self, name, value):
+        values = self._windows[name]
+        values.append(value)
+        if not np.isnan(value):
+            self._sums[name] += value
+            self._counts[name] += 1
+        if len(values) > self.window:
+            expired = values.popleft()
+            if not np.isnan(expired):
+                self._sums[name] -= expired
+                self._counts[name] -= 1
+        # 窗口内没有有效值时清零，避免浮点累积误差
+        if self._counts[name] == 0:
+            self._sums[name] = 0.0
+            return float('nan')
+        return self._sums[name] / self._counts[name]
+
+    def update(self, stock_info):
+        """
+        加入一个tick；与上一个tick的日期和时间相同时视为重复数据，直接返回上次的结果
+
+        返回:
+        以特征名为键的浮点数字典
+        """
+        tick = (stock_info.get('日期'), stock_info.get('时间'))
+        if tick == self.last_tick and self.latest is not None:
+            return self.latest
+        self.last_tick = tick
+
+        row = compute_features(BookArrays.from_matrix(stock_info_row(stock_info)))
+        latest = {name: float(row[name][0]) for name in FEATURES}
+        for name in ROLLING_FEATURES:
+            latest[f'{name}_mean'] = self._push(name, latest[name])
+        latest['timestamp'] = _quote_timestamp(stock_info)
+        latest['price'] = stock_info['当前价格']
+        self.latest = latest
+        return latest
+
+class OrderBookTracker:
+    """多只股票的增量盘口分析，按股票代码维护各自的 OrderBookStream"""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.streams = {}
+
+    def update(self, stock_info):
+        code = stock_info['股票代码']
+        stream = self.streams.get(code)
+        if stream is None:
+            stream = self.streams[code] = OrderBookStream(self.window)
+        return stream.update(stock_info)
+
+    def latest(self, stock_code):
+        stream = self.streams.get(stock_code)
+        return stream.latest if stream else None
+
+# 数据库中与 BookArrays.from_matrix 列顺序对应的字段
+def _book_columns(StockQuote):
+    return ([StockQuote.current_price]
+            + [getattr(StockQuote, f'buy{i}_price') for i in range(1, LEVELS + 1)]
+            + [getattr(StockQuote, f'buy{i}_amount') for i in range(1, LEVELS + 1)]
+            + [getattr(StockQuote, f'sell{i}_price') for i in range(1, LEVELS + 1)]
+            + [getattr(StockQuote, f'sell{i}_amount') for i in range(1, LEVELS + 1)])
+
+def _timestamps(values):
+    """
+    将本地时间（"YYYY-MM-DD HH:MM:SS" 字符串或 datetime）转换为Unix时间戳数组
+    """
+    if values and isinstance(values[0], str):
+        parsed = np.array(values, dtype='datetime64[us]')
+        # numpy 按UTC解析，按第一条记录换算为本地时区（交易日内时区偏移不变）
+        first = datetime.fromisoformat(values[0])
+        offset = first.timestamp() - parsed[0].astype(np.int64) / 1e6
+        return parsed.astype(np.int64) / 1e6 + offset
+    return np.array([value.timestamp() for value in values], dtype=np.float64)
+
+def load_book_arrays(db_session, stock_codes, trade_date=None):
+    """
+    用一次查询加载多只股票的盘口数据
+
+    参数:
+    db_session: 数据库会话
+    stock_codes: 股票代码列表
+    trade_date: 只加载指定日期（"YYYY-MM-DD"），默认全部
+
+    返回:
+    以股票代码为键、BookArrays 为值的字典（没有数据的股票不在结果中）
+    """
+    from sqlalchemy import select
+    from models import StockQuote
+
+    # 时间戳取行情自身的日期和时间（与 OrderBookStream 增量计算使用的时钟一致），而不是写入数据库的时间；
+    # 不经过ORM对象，按字符串取出后由 numpy 统一解析，减少逐行的Python对象开销
+    quote_time = StockQuote.date.concat(' ').concat(StockQuote.time)
+    query = select(StockQuote.stock_code, quote_time, *_book_columns(StockQuote))\
+        .where(StockQuote.stock_code.in_(list(stock_codes)))
+    if trade_date:
+        query = query.where(StockQuote.date == trade_date)
+    # 通过连接执行 Core 查询，跳过 ORM 结果处理
+    rows = db_session.connection().execute(query.order_by(StockQuote.stock_code, StockQuote.created_at)).all()
+    if not rows:
+        return {}
+
+    codes = [row[0] for row in rows]
+    matrix = np.empty((len(rows), 2 + 4 * LEVELS), dtype=np.float64)
+    matrix[:, 0] = _timestamps([row[1] for row in rows])
+    matrix[:, 1:] = np.array([row[2:] for row in rows], dtype=np.float64)
+    np.nan_to_num(matrix, copy=False)
+
+    # 按股票代码切分（结果已按代码排序）
+    books = {}
+    start = 0
+    for end in range(1, len(codes) + 1):
+        if end == len(codes) or codes[end] != codes[start]:
+            books[codes[start]] = BookArrays.from_matrix(matrix[start:end])
+            start = end
+    return books
+
+def load_book_arrays_from_files(patterns):
+    """
+    从 record_data_to_file 生成的 stock_data_<代码>_<日期>.txt 文件加载盘口数据，供回测使用
+
+    返回:
+    以股票代码为键、BookArrays 为值的字典
+    """
+    from quote_sources import load_ticks_from_files
+
+    books = {}
+    for code, ticks in load_ticks_from_files(patterns).items():
+        rows = []
+        for recorded_at, fields in ticks:
+            # 新浪接口字段：3 当前价，10-19 买一到买五（申报股数, 报价），20-29 卖一到卖五
+            levels = [float(value) for value in fields[10:30]]
+            rows.append([recorded_at, float(fields[3])]
+                        + levels[1:10:2] + [size / 100 for size in levels[0:10:2]]
+                        + levels[11:20:2] + [size / 100 for size in levels[10:20:2]])
+        books[code] = BookArrays.from_matrix(rows)
+    return books
+
+def backtest_inputs(books, window=DEFAULT_WINDOW):
+    """
+    为回测准备输入：每只股票的时间戳、成交价与全部盘口特征（numpy 数组，长度一致）
+
+    参数:
+    books: load_book_arrays 或 load_book_arrays_from_files 的返回值
+
+    返回:
+    以股票代码为键、特征数组字典为值的字典
+    """
+    return {code: analyze(book, window) for code, book in books.items()}
+
+def to_json_list(values, decimals=6):
+    """数组转换为JSON列表，NaN 输出为 null"""
+    rounded = np.round(np.asarray(values, dtype=np.float64), decimals).astype(object)
+    rounded[np.isnan(np.asarray(values, dtype=np.float64))] = None
+    return rounded.tolist()
+
+if __name__ == '__main__':
+    import argparse
+    from metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description='五档盘口分析（向量化计算，输出耗时）')
+    parser.add_argument('--files', nargs='+', help='stock_data_*.txt 文件（支持通配符），默认读取数据库')
+    parser.add_argument('--date', default=datetime.now().strftime('%Y-%m-%d'), help='数据库中的交易日期')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW)
+    args = parser.parse_args()
+    configure_logging()
+
+    start = time.perf_counter()
+    if args.files:
+        books = load_book_arrays_from_files(args.files)
+    else:
+        from models import Session, init_db
+        import watchlist_cache
+        init_db()
+        db_session = Session()
+        try:
+            books = load_book_arrays(db_session, watchlist_cache.get_snapshot().codes, args.date)
+        finally:
+            db_session.close()
+    loaded = time.perf_counter()
+    results = backtest_inputs(books, args.window)
+    computed = time.perf_counter()
+
+    ticks = sum(len(book) for book in books.values())
+    logger.info("股票数: %d，tick数: %d，加载 %.3f 秒，计算 %.3f 秒",
+                len(books), ticks, loaded - start, computed - loaded)
+    for code, features in results.items():
+        logger.info("%s 最新: 价差 %.4f，微价格 %.4f，一档失衡 %.3f，五档失衡 %.3f，压力 %.3f",
+                    code, features['spread'][-1], features['microprice'][-1], features['imbalance'][-1],
+                    features['depth_imbalance'][-1], features['pressure'][-1])
@@ -0,0 +1,313 @@
+import time
+import random
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import get_stock_quote
+from metrics import UPSTREAM_RETRIES, UPSTREAM_HEDGES, CIRCUIT_REJECTIONS, QUOTE_CACHE
+
+logger = logging.getLogger(__name__)
+
+# 熔断参数：连续失败达到阈值后熔断，经过冷却时间后放行一次试探请求
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30  # 秒
+
+# 重试参数：带随机抖动的指数退避
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.2  # 秒
+BACKOFF_CAP = 2.0  # 秒
+
+# 对冲请求：首个请求超过该时间仍未返回时，并行发出第二个相同请求，取先返回的结果
+HEDGE_DELAY = 0.5  # 秒
+
+# 单次获取行情的总时限（包含重试和退避），保证调用方的延迟有上限
+FETCH_DEADLINE = 3.0  # 秒
+
+# 缓存参数：新鲜期内直接返回缓存；过期后仍保留最长 STALE_TTL 秒，上游失败时作为过期数据返回
+FRESH_TTL = 2.0  # 秒
+STALE_TTL = 24 * 3600  # 秒
+
+# lookup_quotes 的返回值：quotes 为以股票代码为键的行情字典，fetched 为其中本次从上游新获取的代码集合
+QuoteLookup = namedtuple('QuoteLookup', ['quotes', 'fetched'])
+
+class QuoteUnavailableError(Exception):
+    """上游行情接口不可用（请求失败、超时或已熔断）"""
+
+class CircuitOpenError(QuoteUnavailableError):
+    """熔断器处于打开状态，请求未发出"""
+
+class CircuitBreaker:
+    """
+    单个上游接口的熔断器
+
+    closed: 正常放行；连续失败达到阈值后进入 open
+    open: 拒绝全部请求；冷却时间过后进入 half_open
+    half_open: 只放行一个试探请求，成功则恢复 closed，失败则重新 open
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    计算第 attempt 次重试前的等待时间（指数退避 + 全抖动）
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class ResilientQuoteClient:
+    """
+    带熔断、退避重试、对冲请求和过期数据回退（stale-while-revalidate）的行情客户端
+
+    get_quote/get_quotes 返回的股票信息字典带有 "数据过期" 字段：
+    为 True 时表示上游不可用，返回的是最近一次成功获取的数据，"数据缓存秒数" 为其距今时长。
+    """
+
+    def __init__(self, fetch_batch=None, endpoint=None, max_retries=MAX_RETRIES, hedge_delay=HEDGE_DELAY,
+                 deadline=FETCH_DEADLINE, fresh_ttl=FRESH_TTL, stale_ttl=STALE_TTL, max_workers=16):
+        self.fetch_batch = fetch_batch or get_stock_quote.fetch_stock_quotes
+        self._endpoint = endpoint
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._breakers = {}
+        self._cache = {}
+        self._revalidating = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quote-client")
+        # 后台刷新在独立线程池中执行：刷新任务会等待 _executor 中的请求，共用线程池时可能占满全部线程导致请求无法调度
+        self._revalidate_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="quote-revalidate")
+
+    @property
+    def endpoint(self):
+        """当前上游接口标识，未指定时跟随 get_stock_quote 当前使用的数据源"""
+        return self._endpoint or get_stock_quote.get_quote_source().endpoint
+
+    def breaker(self, endpoint=None):
+        """获取指定上游接口的熔断器"""
+        endpoint = endpoint or self.endpoint
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker()
+            return self._breakers[endpoint]
+
+    def _hedged_fetch(self, codes, timeout):
+        """
+        发出一次请求；若 hedge_delay 内未返回，再并行发出一次相同请求，返回先成功的结果
+        """
+        first = self._executor.submit(self.fetch_batch, codes, timeout)
+        if not self.hedge_delay or self.hedge_delay >= timeout:
+            return first.result(timeout=timeout)
+
+        done, _ = wait([first], timeout=self.hedge_delay)
+        if done:
+            return first.result()
+
+        UPSTREAM_HEDGES.inc(endpoint=self.endpoint)
+        futures = [first, self._executor.submit(self.fetch_batch, codes, timeout - self.hedge_delay)]
+        end = time.monotonic() + timeout - self.hedge_delay
+        error = None
+        while futures:
+            done, pending = wait(futures, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+            futures = list(pending)
+        raise error or TimeoutError("请求超时")
+
+    def fetch(self, codes):
+        """
+        经过熔断、退避重试和对冲请求获取一批股票的实时行情（不使用缓存）
+
+        返回:
+        以股票代码为键的行情字典
+
+        异常:
+        ValueError: 股票代码格式无效（不计入熔断失败次数）
+        QuoteUnavailableError: 上游不可用或在总时限内未能成功
+        """
+        codes = list(codes)
+        for code in codes:
+            get_stock_quote.get_full_code(code)
+        breaker = self.breaker()
+        end = time.monotonic() + self.deadline
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            if not breaker.allow_request():
+                CIRCUIT_REJECTIONS.inc(endpoint=self.endpoint)
+                raise CircuitOpenError(f"行情接口 {self.endpoint} 已熔断")
+
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                quotes = self._hedged_fetch(codes, remaining)
+            except Exception as e:
+                breaker.record_failure()
+                last_error = e
+            else:
+                breaker.record_success()
+                self._store(quotes)
+                return quotes
+
+            # 退避等待不超过剩余时限
+            delay = backoff_delay(attempt)
+            if attempt >= self.max_retries or time.monotonic() + delay >= end:
+                break
+            UPSTREAM_RETRIES.inc(endpoint=self.endpoint)
+            time.sleep(delay)
+
+        raise QuoteUnavailableError(f"获取行情失败: {last_error or '超过总时限'}")
+
+    def _store(self, quotes):
+        now = time.monotonic()
+        with self._lock:
+            for code, stock_info in quotes.items():
+                self._cache[code] = (stock_info, now)
+
+    def _cached(self, code, max_age):
+        with self._lock:
+            entry = self._cache.get(code)
+        if entry is None:
+            return None
+        stock_info, fetched_at = entry
+        age = time.monotonic() - fetched_at
+        if age > max_age:
+            return None
+        return stock_info, age
+
+    def _revalidate(self, codes):
+        """在后台刷新过期数据，同一代码同时只有一个刷新任务"""
+        with self._lock:
+            codes = [code for code in codes if code not in self._revalidating]
+            self._revalidating.update(codes)
+        if not codes:
+            return
+
+        def task():
+            try:
+                self.fetch(codes)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.difference_update(codes)
+
+        self._revalidate_executor.submit(task)
+
+    def lookup_quotes(self, codes, allow_stale=True):
+        """
+        获取一批股票的行情：新鲜缓存直接返回，其余合并为一次上游请求；
+        上游不可用时返回过期缓存（标记 "数据过期"），并在后台重新验证
+
+        参数:
+        codes: 股票代码列表
+        allow_stale: 上游不可用时是否返回过期数据
+
+        返回:
+        QuoteLookup(quotes, fetched)：上游和缓存中都没有的代码不会出现在 quotes 中；
+        fetched 为本次从上游新获取的代码，调用方只应持久化这部分数据（缓存命中和过期数据已经写入过）
+        """
+        result = {}
+        missing = []
+        for code in codes:
+            cached = self._cached(code, self.fresh_ttl)
+            if cached:
+                result[code] = {**cached[0], '数据过期': False, '数据缓存秒数': round(cached[1], 3)}
+            else:
+                missing.append(code)
+        QUOTE_CACHE.inc(len(result), result="fresh")
+        QUOTE_CACHE.inc(len(missing), result="miss")
+        if not missing:
+            return QuoteLookup(result, set())
+
+        try:
+            fetched = self.fetch(missing)
+        except QuoteUnavailableError as e:
+            if not allow_stale:
+                raise
+            logger.warning("%s，尝试返回过期数据", e)
+            stale_codes = []
+            for code in missing:
+                cached = self._cached(code, self.stale_ttl)
+                if cached:
+                    result[code] = {**cached[0], '数据过期': True, '数据缓存秒数': round(cached[1], 3)}
+                    stale_codes.append(code)
+            if stale_codes:
+                QUOTE_CACHE.inc(len(stale_codes), result="stale")
+                self._revalidate(stale_codes)
+            return QuoteLookup(result, set())
+
+        for code, stock_info in fetched.items():
+            result[code] = {**stock_info, '数据过期': False, '数据缓存秒数': 0}
+        return QuoteLookup(result, set(fetched))
+
+    def get_quotes(self, codes, allow_stale=True):
+        """
+        获取一批股票的行情，语义同 lookup_quotes，只返回行情字典
+        """
+        return self.lookup_quotes(codes, allow_stale).quotes
+
+    def get_quote(self, stock_code, allow_stale=True):
+        """
+        获取单只股票的行情，语义同 get_quotes；代码格式无效、获取失败且没有过期数据时返回 None
+        """
+        try:
+            return self.get_quotes([stock_code], allow_stale).get(stock_code)
+        except ValueError as e:
+            logger.warning("股票代码无效: %s", e)
+            return None
+        except QuoteUnavailableError as e:
+            logger.warning("获取股票数据失败: %s", e)
+            return None
+
+# 进程内共享的默认客户端
+default_client = ResilientQuoteClient()
+
+def get_quote(stock_code, allow_stale=True):
+    return default_client.get_quote(stock_code, allow_stale)
+
+def get_quotes(stock_codes, allow_stale=True):
+    return default_client.get_quotes(stock_codes, allow_stale)
+
+def lookup_quotes(stock_codes, allow_stale=True):
+    return default_client.lookup_quotes(stock_codes, allow_stale)
@@ -0,0 +1,231 @@
+import os
+import glob
+import time
+import zlib
+import bisect
+import logging
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+import requests
+
+logger = logging.getLogger(__name__)
+
+class QuoteSource:
+    """
+    行情数据源接口
+
+    数据源负责按完整代码（如 "sh601919"）返回新浪接口格式的原始文本，每只股票一行：
+    var hq_str_sh601919="名称,开盘价,昨收价,...";
+    解析统一由 get_stock_quote.parse_stock_data 完成，因此所有数据源的输出格式必须与新浪接口一致。
+    """
+
+    # 数据源标识，用于熔断器等按上游区分的场景
+    endpoint = "unknown"
+
+    def fetch_raw(self, full_codes, timeout=None):
+        """
+        获取一批股票的原始行情文本
+
+        参数:
+        full_codes: 带市场前缀的完整代码列表
+        timeout: 超时时间（秒）
+
+        返回:
+        新浪接口格式的原始文本
+        """
+        raise NotImplementedError
+
+class SinaQuoteSource(QuoteSource):
+    """
+    新浪财经HTTP数据源；修改 url_template 即可指向 replay_server.py 启动的本地替身服务
+    """
+
+    def __init__(self, url_template, headers=None, timeout=10):
+        self.url_template = url_template
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.endpoint = urlparse(url_template).netloc
+        # 每个线程使用独立的HTTP会话，复用连接
+        self._thread_local = threading.local()
+
+    def _http_session(self):
+        http_session = getattr(self._thread_local, "http_session", None)
+        if http_session is None:
+            http_session = requests.Session()
+            http_session.headers.update(self.headers)
+            self._thread_local.http_session = http_session
+        return http_session
+
+    def fetch_raw(self, full_codes, timeout=None):
+        url = self.url_template % (int(time.time()), ",".join(full_codes))
+        response = self._http_session().get(url, timeout=timeout or self.timeout)
+        response.encoding = "gb18030"  # 新浪财经使用GB18030编码
+
+        if response.status_code != 200:
+            raise Exception(f"请求失败，状态码: {response.status_code}")
+        return response.text
+
+def format_sina_line(full_code, fields):
+    """
+    按新浪接口格式生成一行行情文本
+    """
+    return f'var hq_str_{full_code}="{",".join(fields)}";'
+
+def _strip_unit(value, unit):
+    return value[:-len(unit)] if value.endswith(unit) else value
+
+def _record_to_fields(name, open_price, pre_close, current_price, high, low, bid, ask,
+                      volume, amount, levels, date_str, time_str):
+    """
+    将一条已记录的行情还原为新浪接口的字段列表
+
+    volume/amount 为记录中带单位的字符串（"123手"、"45万元"），还原为股和元；
+    levels 为买一到买五、卖一到卖五的 (申报手数, 报价) 列表，申报量还原为股
+    """
+    fields = [name, str(open_price), str(pre_close), str(current_price), str(high), str(low),
+              str(bid), str(ask),
+              str(int(_strip_unit(str(volume), "手")) * 100),
+              str(int(_strip_unit(str(amount), "万元")) * 10000)]
+    for lots, price in levels:
+        fields.append(str(int(lots) * 100))
+        fields.append(str(price))
+    fields += [date_str, time_str, "00"]
+    return fields
+
+def load_ticks_from_files(patterns):
+    """
+    从 record_data_to_file 生成的 stock_data_<代码>_<日期>.txt 文件中加载行情记录
+
+    参数:
+    patterns: 文件路径或通配符列表
+
+    返回:
+    以股票代码为键、[(时间戳, 字段列表), ...] 为值的字典
+    """
+    series = {}
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split(",")
+                # 跳过表头和不完整的行
+                if len(parts) < 35 or parts[0] == "时间戳":
+                    continue
+                try:
+                    recorded_at = datetime.strptime(parts[0], "%Y-%m-%d %H:%M:%S")
+                    levels = [(parts[12 + i * 2], parts[13 + i * 2]) for i in range(10)]
+                    fields = _record_to_fields(parts[2], parts[3], parts[4], parts[5], parts[6], parts[7],
+                                               parts[8], parts[9], parts[10], parts[11], levels,
+                                               recorded_at.strftime("%Y-%m-%d"), recorded_at.strftime("%H:%M:%S"))
+                except ValueError:
+                    continue
+                series.setdefault(parts[1], []).append((recorded_at.timestamp(), fields))
+    return series
+
+def load_ticks_from_db(db_session, stock_codes=None, trade_date=None):
+    """
+    从 stock_quotes 表加载行情记录
+
+    参数:
+    db_session: 数据库会话
+    stock_codes: 只加载指定股票，默认全部
+    trade_date: 只加载指定日期（"YYYY-MM-DD"），默认全部
+
+    返回:
+    以股票代码为键、[(时间戳, 字段列表), ...] 为值的字典
+    """
+    from models import StockQuote
+
+    query = db_session.query(StockQuote)
+    if stock_codes:
+        query = query.filter(StockQuote.stock_code.in_(stock_codes))
+    if trade_date:
+        query = query.filter(StockQuote.date == trade_date)
+
+    series = {}
+    for quote in query.order_by(StockQuote.created_at.asc()).yield_per(1000):
+        levels = [(getattr(quote, f"{side}{i}_amount"), getattr(quote, f"{side}{i}_price"))
+                  for side in ("buy", "sell") for i in range(1, 6)]
+        try:
+            fields = _record_to_fields(quote.stock_name, quote.open_price, quote.pre_close, quote.current_price,
+                                       quote.high_price, quote.low_price, quote.buy1_price, quote.sell1_price,
+                                       quote.volume, quote.amount, levels, quote.date, quote.time)
+        except (TypeError, ValueError):
+            continue
+        series.setdefault(quote.stock_code, []).append((quote.created_at.timestamp(), fields))
+    return series
+
+class ReplayQuoteSource(QuoteSource):
+    """
+    回放数据源：按录制时间轴回放已记录的行情，输出新浪接口格式
+
+    speed: 回放速度倍数，例如 10 表示录制中的10秒在1秒内回放完毕，到达末尾后从头循环
+    symbol_count: 对外提供的股票数量；超过录制股票数时，用录制的行情序列映射出合成代码
+                 （沪市 600000 起连续编号），用于模拟大规模关注列表或全市场
+    """
+
+    endpoint = "replay"
+
+    def __init__(self, series, speed=1.0, symbol_count=None):
+        if not series:
+            raise ValueError("没有可回放的行情记录")
+        self.speed = speed
+        self.started_at = time.monotonic()
+        self._series = []
+        for code in sorted(series):
+            ticks = sorted(series[code], key=lambda tick: tick[0])
+            start = ticks[0][0]
+            offsets = [tick[0] - start for tick in ticks]
+            self._series.append((offsets, [tick[1] for tick in ticks], max(offsets[-1], 1.0)))
+
+        # 录制的代码保持不变，其余按需生成合成代码
+        self._codes = {}
+        recorded = sorted(series)
+        for index, code in enumerate(recorded):
+            self._codes[code] = index
+        number = 600000
+        while symbol_count and len(self._codes) < symbol_count:
+            code = f"{number:06d}"
+            if code not in self._codes:
+                self._codes[code] = zlib.crc32(code.encode("utf-8")) % len(self._series)
+            number += 1
+
+    def codes(self):
+        """回放数据源对外提供的全部股票代码"""
+        return list(self._codes)
+
+    def _current_fields(self, series_index):
+        offsets, ticks, duration = self._series[series_index]
+        position = ((time.monotonic() - self.started_at) * self.speed) % duration
+        return ticks[max(0, bisect.bisect_right(offsets, position) - 1)]
+
+    def fetch_raw(self, full_codes, timeout=None):
+        lines = []
+        for full_code in full_codes:
+            series_index = self._codes.get(full_code[2:])
+            if series_index is None:
+                # 与新浪接口一致：不存在的代码返回空数据
+                lines.append(f'var hq_str_{full_code}="";')
+            else:
+                lines.append(format_sina_line(full_code, self._current_fields(series_index)))
+        return "\n".join(lines) + "\n"
+
+def replay_source_from_args(files=None, db_url=None, speed=1.0, symbol_count=None, trade_date=None):
+    """
+    根据文件通配符或数据库地址创建回放数据源，供命令行工具使用
+    """
+    if files:
+        series = load_ticks_from_files(files)
+    else:
+        from sqlalchemy.orm import sessionmaker
+        from models import make_engine
+        engine = make_engine(db_url or "sqlite:///stock_data.db")
+        db_session = sessionmaker(bind=engine)()
+        try:
+            series = load_ticks_from_db(db_session, trade_date=trade_date)
+        finally:
+            db_session.close()
+            engine.dispose()
+    logger.info("已加载 %d 只股票、%d 条行情记录", len(series), sum(len(ticks) for ticks in series.values()))
+    return ReplayQuoteSource(series, speed=speed, symbol_count=symbol_count)
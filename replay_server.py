@@ -0,0 +1,91 @@
+import time
+import logging
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+from quote_sources import replay_source_from_args
+from metrics import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# 默认监听端口
+DEFAULT_PORT = 8765
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    """
+    模拟新浪行情接口：GET /rn=<时间戳>&list=sh600000,sz000001 返回GB18030编码的行情文本
+    """
+
+    # 由 run_server 设置
+    source = None
+    latency = 0.0
+
+    def do_GET(self):
+        params = {}
+        for part in unquote(self.path.lstrip("/?")).split("&"):
+            key, _, value = part.partition("=")
+            params[key] = value
+
+        full_codes = [code for code in params.get("list", "").split(",") if code]
+        if not full_codes:
+            self.send_error(400, "missing list parameter")
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = self.source.fetch_raw(full_codes).encode("gb18030")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/javascript; charset=GB18030")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 压测时每个请求都打印日志会成为瓶颈，默认不输出访问日志
+        pass
+
+def make_server(source, host="127.0.0.1", port=DEFAULT_PORT, latency=0.0):
+    """
+    创建回放HTTP服务（不启动），port 为 0 时自动分配端口
+
+    返回:
+    ThreadingHTTPServer 实例，实际端口见 server.server_address[1]
+    """
+    handler = type("BoundReplayRequestHandler", (ReplayRequestHandler,),
+                   {"source": source, "latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def url_template_for(server):
+    """
+    返回指向回放服务的行情URL模板，可直接设置为 STOCK_QUOTE_URL
+    """
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/rn=%d&list=%s"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地行情回放服务（新浪接口格式）')
+    parser.add_argument('--files', nargs='+', help='回放的 stock_data_*.txt 文件（支持通配符）')
+    parser.add_argument('--db', default='sqlite:///stock_data.db', help='未指定 --files 时从该数据库回放')
+    parser.add_argument('--date', help='只回放数据库中指定日期（YYYY-MM-DD）的数据')
+    parser.add_argument('--speed', type=float, default=1.0, help='回放速度倍数')
+    parser.add_argument('--symbols', type=int, help='对外提供的股票数量（不足时生成合成代码）')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求附加的模拟延迟（秒）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    configure_logging()
+    source = replay_source_from_args(args.files, args.db, args.speed, args.symbols, args.date)
+    server = make_server(source, args.host, args.port, args.latency)
+    logger.info("行情回放服务已启动: %s，回放股票数: %d，速度: %sx",
+                url_template_for(server), len(source.codes()), args.speed)
+    logger.info("设置环境变量 STOCK_QUOTE_URL=%s 后启动其他组件即可使用", url_template_for(server))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("行情回放服务已停止")
+    finally:
+        server.server_close()
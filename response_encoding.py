@@ -0,0 +1,154 @@
+import gzip
+from flask.json.provider import DefaultJSONProvider
+
+# orjson / brotli 为可选依赖，未安装时分别回退到标准库 json 和 gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩收益抵不过CPU开销和压缩头）
+COMPRESS_MIN_SIZE = 512
+
+# 压缩级别：动态响应以速度优先
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+# 需要压缩的响应类型
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'text/')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON 序列化：安装了 orjson 时使用 orjson，否则使用标准库 json；
+    两者都直接输出UTF-8中文（不转义为 \\uXXXX），不排序键、不缩进
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def negotiate_encoding(accept_encoding):
+    """
+    根据 Accept-Encoding 选择压缩方式，brotli 可用时优先 br，其次 gzip
+
+    返回:
+    'br'、'gzip' 或 None
+    """
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress_response(response, accept_encoding):
+    """
+    按客户端支持的编码压缩响应体（用于 after_request）
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or not (response.mimetype or '').startswith(COMPRESSIBLE_MIMETYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def _strip_number(value, unit):
+    """将 "123手"、"45万元"、"1.23%" 这类带单位的字符串转换为数值"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = value[:-len(unit)] if value.endswith(unit) else value
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() and unit != '%' else number
+
+_LEVEL_NAMES = ('一', '二', '三', '四', '五')
+
+def compact_quote(stock_info):
+    """
+    将行情字典转换为紧凑格式：短英文键、数值字段不带单位、五档盘口为 [报价, 申报手数] 数组
+
+    键: c 代码, n 名称, m 市场, p 当前价, o 开盘价, pc 昨收价, h 最高价, l 最低价,
+       ch 涨跌额, pct 涨跌幅(%), v 成交量(手), amt 成交额(万元), b 买盘, a 卖盘,
+       d 日期, t 时间, dp 价格小数位数；来自行情缓存的数据另有 stale 是否过期、age 缓存秒数
+    """
+    quote = {
+        'c': stock_info['股票代码'],
+        'n': stock_info['股票名称'],
+        'm': stock_info['市场'],
+        'p': stock_info['当前价格'],
+        'o': stock_info['今日开盘价'],
+        'pc': stock_info['昨日收盘价'],
+        'h': stock_info['今日最高价'],
+        'l': stock_info['今日最低价'],
+        'ch': stock_info['涨跌额'],
+        'pct': _strip_number(stock_info['涨跌幅'], '%'),
+        'v': _strip_number(stock_info['成交量'], '手'),
+        'amt': _strip_number(stock_info['成交额'], '万元'),
+        'b': [[stock_info[f'买{name}报价'], stock_info[f'买{name}申报']] for name in _LEVEL_NAMES],
+        'a': [[stock_info[f'卖{name}报价'], stock_info[f'卖{name}申报']] for name in _LEVEL_NAMES],
+        'd': stock_info['日期'],
+        't': stock_info['时间'],
+        'dp': stock_info.get('价格小数位数', 2),
+    }
+    if '数据过期' in stock_info:
+        quote['stale'] = stock_info['数据过期']
+        quote['age'] = stock_info['数据缓存秒数']
+    return quote
+
+def columnar(rows, columns):
+    """
+    将行列表转换为按列存储的字典，避免每个数据点重复键名
+
+    参数:
+    rows: 元组或列表组成的行
+    columns: 各列在输出中的键名
+
+    返回:
+    {键名: [该列的值, ...], ...}
+    """
+    result = {name: [] for name in columns}
+    appends = [result[name].append for name in columns]
+    for row in rows:
+        for append, value in zip(appends, row):
+            append(value)
+    return result
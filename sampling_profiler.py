@@ -0,0 +1,231 @@
+import math
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 默认采样间隔（秒），100Hz 的采样对生产进程的开销通常在1%左右
+DEFAULT_INTERVAL = 0.01
+
+# 采样间隔的取值范围（秒）：过小会使采样线程空转，过大则采样线程长时间休眠，无法按时停止
+MIN_INTERVAL = 0.001
+MAX_INTERVAL = 1.0
+
+# 单次采样的最长时长（秒），防止忘记关闭
+MAX_DURATION = 600
+
+# 采样结果输出目录
+PROFILE_DIR = os.environ.get('STOCK_PROFILE_DIR', 'profiles')
+
+# 单个调用栈的最大深度，避免深递归拖慢采样
+MAX_STACK_DEPTH = 128
+
+def clamp_interval(interval):
+    """将采样间隔限制在 [MIN_INTERVAL, MAX_INTERVAL] 范围内，非有限值使用默认间隔"""
+    interval = float(interval)
+    if not math.isfinite(interval):
+        return DEFAULT_INTERVAL
+    return max(MIN_INTERVAL, min(interval, MAX_INTERVAL))
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """
+    低开销的采样分析器：后台线程按固定间隔读取所有线程的当前调用栈（sys._current_frames），
+    不注入追踪钩子，因此被分析的代码路径几乎不受影响。
+
+    输出：
+    - 火焰图工具（flamegraph.pl、speedscope 等）可直接读取的折叠调用栈（collapsed stacks）
+    - 按函数汇总的自身采样数（self）和包含子调用的采样数（total）
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, label='process', on_finish=None):
+        self.interval = clamp_interval(interval)
+        self.label = label
+        self.on_finish = on_finish
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._code_labels = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _label(self, code):
+        # 同一代码对象的标签只格式化一次
+        label = self._code_labels.get(code)
+        if label is None:
+            label = self._code_labels[code] = _frame_label(code)
+        return label
+
+    def _sample(self, own_ident, thread_names):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(thread_names.get(ident, f"thread-{ident}"))
+            stack.reverse()
+            with self._lock:
+                self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def _run(self, duration):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + duration
+        thread_names = {}
+        next_refresh = 0.0
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            now = time.monotonic()
+            if now >= next_refresh:
+                # 线程名称变化不频繁，每秒刷新一次
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                next_refresh = now + 1.0
+            self._sample(own_ident, thread_names)
+            self._stop_event.wait(self.interval)
+        self.stopped_at = datetime.now()
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def start(self, duration):
+        """开始采样，duration 秒后自动停止（不超过 MAX_DURATION）"""
+        if self.running:
+            raise RuntimeError("采样分析器已在运行")
+        duration = max(0.1, min(float(duration), MAX_DURATION))
+        self.started_at = datetime.now()
+        self.stopped_at = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name='sampling-profiler', daemon=True)
+        self._thread.start()
+        logger.info("采样分析已开始: %s，时长 %.1f 秒，间隔 %.3f 秒", self.label, duration, self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def collapsed(self):
+        """折叠调用栈文本：每行 "线程;外层函数;...;内层函数 采样数" """
+        with self._lock:
+            stacks = self.stacks.most_common()
+        lines = [f"{';'.join(stack)} {count}" for stack, count in stacks]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=50):
+        """按函数汇总采样结果，按 total 降序"""
+        self_counts = Counter()
+        total_counts = Counter()
+        with self._lock:
+            stacks = list(self.stacks.items())
+        stack_samples = sum(count for _, count in stacks)
+        for stack, count in stacks:
+            frames = stack[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            # 递归调用在同一个栈中只计一次
+            for frame in set(frames):
+                total_counts[frame] += count
+
+        functions = []
+        for name, total in total_counts.most_common(limit):
+            functions.append({
+                'function': name,
+                'self': self_counts.get(name, 0),
+                'total': total,
+                'self_pct': round(self_counts.get(name, 0) * 100.0 / stack_samples, 2) if stack_samples else 0.0,
+                'total_pct': round(total * 100.0 / stack_samples, 2) if stack_samples else 0.0,
+            })
+        return {
+            'label': self.label,
+            'running': self.running,
+            'pid': os.getpid(),
+            'started_at': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+            'stopped_at': self.stopped_at.isoformat(timespec='seconds') if self.stopped_at else None,
+            'interval': self.interval,
+            'samples': self.samples,
+            'stack_samples': stack_samples,
+            'functions': functions,
+        }
+
+    def write(self, output_dir=PROFILE_DIR):
+        """
+        将结果写入 output_dir，返回 (折叠调用栈文件路径, 汇总文件路径)
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        stamp = (self.started_at or datetime.now()).strftime('%Y%m%d_%H%M%S')
+        base = os.path.join(output_dir, f"profile_{self.label}_{os.getpid()}_{stamp}")
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+        with open(base + '_summary.json', 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        logger.info("采样分析结果已写入 %s.collapsed 和 %s_summary.json", base, base)
+        return base + '.collapsed', base + '_summary.json'
+
+# 当前进程中正在运行或最近一次完成的采样分析
+_current = None
+_current_lock = threading.Lock()
+
+def start_profiling(duration, interval=DEFAULT_INTERVAL, label='process', output_dir=PROFILE_DIR):
+    """
+    在后台开始一次采样分析，结束后自动写入结果文件；同一进程同时只能有一次采样
+
+    返回:
+    SamplingProfiler 实例
+    """
+    global _current
+    with _current_lock:
+        if _current is not None and _current.running:
+            raise RuntimeError("采样分析器已在运行")
+        profiler = SamplingProfiler(interval=interval, label=label, on_finish=_writer(output_dir))
+        profiler.start(duration)
+        _current = profiler
+    return profiler
+
+def _writer(output_dir):
+    # 在采样线程结束时写入结果，不额外启动线程，避免写入线程出现在采样结果中
+    def write(profiler):
+        try:
+            profiler.write(output_dir)
+        except OSError as e:
+            logger.error("写入采样分析结果失败: %s", e)
+    return write
+
+def current_profiler():
+    return _current
+
+def start_from_env(label):
+    """
+    环境变量 STOCK_PROFILE_SECONDS 大于0时，在进程启动时开始一次采样分析；
+    STOCK_PROFILE_INTERVAL 可调整采样间隔
+    """
+    seconds = os.environ.get('STOCK_PROFILE_SECONDS')
+    if not seconds:
+        return None
+    try:
+        duration = float(seconds)
+        interval = float(os.environ.get('STOCK_PROFILE_INTERVAL', DEFAULT_INTERVAL))
+    except ValueError:
+        logger.warning("STOCK_PROFILE_SECONDS/STOCK_PROFILE_INTERVAL 格式无效，跳过采样分析")
+        return None
+    if duration <= 0:
+        return None
+    return start_profiling(duration, interval, label)
@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import shutil
+import tempfile
+import threading
+import subprocess
+import metrics
+from metrics import configure_logging
+import sampling_profiler
+
+logger = logging.getLogger(__name__)
+
+# 默认每个Web进程的处理线程数
+DEFAULT_THREADS = 8
+
+# 采集进程异常退出后的重启等待时间（秒），连续失败时逐次翻倍，不超过上限
+COLLECTOR_RESTART_DELAY = 5
+COLLECTOR_RESTART_MAX_DELAY = 300
+
+# 采集进程正常运行超过该时长（秒）后，重启等待时间恢复为初始值
+COLLECTOR_STABLE_AFTER = 60
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class CollectorProcess:
+    """
+    以独立子进程运行 background_service.py，并在其意外退出时自动重启
+
+    采集服务不再被导入到Web进程中：两者各自占用独立的解释器，
+    采集的网络请求和数据库写入不会与浏览器请求争用同一个GIL。
+    """
+
+    def __init__(self, workers=1, metrics_port=None):
+        self.workers = workers
+        self.metrics_port = metrics_port
+        self.process = None
+        self.owner_pid = os.getpid()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def command(self):
+        command = [sys.executable, os.path.join(BASE_DIR, 'background_service.py'), '--workers', str(self.workers)]
+        if self.metrics_port:
+            command += ['--metrics-port', str(self.metrics_port)]
+        return command
+
+    def _launch(self):
+        self.process = subprocess.Popen(self.command(), cwd=BASE_DIR)
+        logger.info("采集进程已启动，PID: %d，工作进程数: %d", self.process.pid, self.workers)
+
+    def _watch(self):
+        delay = COLLECTOR_RESTART_DELAY
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            self._launch()
+            returncode = self.process.wait()
+            if self._stopping.is_set():
+                break
+            if time.monotonic() - started >= COLLECTOR_STABLE_AFTER:
+                delay = COLLECTOR_RESTART_DELAY
+            logger.warning("采集进程已退出，返回码: %s，%d 秒后重启", returncode, delay)
+            if self._stopping.wait(delay):
+                break
+            delay = min(delay * 2, COLLECTOR_RESTART_MAX_DELAY)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, name='collector-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=15):
+        # gunicorn 的工作进程由主进程 fork 而来，只有创建者才能停止采集进程
+        if os.getpid() != self.owner_pid:
+            return
+        self._stopping.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            logger.info("正在停止采集进程 %d", process.pid)
+            process.terminate()
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+def available_server():
+    """
+    按优先级选择可用的WSGI服务器：
+    POSIX 上优先 gunicorn（多进程+多线程），其次 waitress（多线程，支持Windows），
+    都未安装时使用 werkzeug 的多线程服务器（关闭调试器和自动重载）
+    """
+    if os.name == 'posix':
+        try:
+            import gunicorn  # noqa: F401
+            return 'gunicorn'
+        except ImportError:
+            pass
+    try:
+        import waitress  # noqa: F401
+        return 'waitress'
+    except ImportError:
+        return 'werkzeug'
+
+def prepare_metrics_dir(workers):
+    """
+    多个工作进程时准备汇总指标用的共享目录（未设置 STOCK_METRICS_DIR 时使用临时目录），
+    并清除上次运行留下的文件
+
+    返回:
+    本次新建、退出时需要删除的目录；不需要汇总或目录由用户指定时返回 None
+    """
+    if workers <= 1:
+        return None
+    directory = os.environ.get(metrics.MULTIPROCESS_DIR_ENV)
+    created = None
+    if not directory:
+        directory = created = tempfile.mkdtemp(prefix='stock-metrics-')
+        os.environ[metrics.MULTIPROCESS_DIR_ENV] = directory
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, filename))
+    logger.info("各Web进程的指标汇总目录: %s", directory)
+    return created
+
+def serve_gunicorn(app, host, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+    from models import engine
+
+    metrics_dir = os.environ.get(metrics.MULTIPROCESS_DIR_ENV) if workers > 1 else None
+
+    def post_fork(server, worker):
+        # 主进程建表时打开的数据库连接不能在多个进程间共用，丢弃继承的连接池
+        engine.dispose(close=False)
+        # 采样分析器和指标写入的后台线程不会被 fork 继承，需要在每个工作进程中单独启动
+        sampling_profiler.start_from_env(f'web-{worker.pid}')
+        if metrics_dir:
+            metrics.start_multiprocess_dump(metrics_dir)
+
+    def worker_exit(server, worker):
+        # 工作进程退出前写入最终的指标，汇总结果不会丢失其最后几秒的数据
+        if metrics_dir:
+            try:
+                metrics.dump_to_dir(metrics_dir)
+            except OSError as e:
+                logger.warning("写入多进程指标文件失败: %s", e)
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('post_fork', post_fork)
+            self.cfg.set('worker_exit', worker_exit)
+
+        def load(self):
+            return app
+
+    StandaloneApplication().run()
+
+def serve_waitress(app, host, port, threads):
+    from waitress import serve
+
+    sampling_profiler.start_from_env('web')
+    serve(app, host=host, port=port, threads=threads)
+
+def serve_werkzeug(app, host, port, threads):
+    from werkzeug.serving import make_server
+
+    sampling_profiler.start_from_env('web')
+    # werkzeug 的多线程模式为每个请求创建线程，threads 参数不起作用
+    server = make_server(host, port, app, threaded=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def serve(host='0.0.0.0', port=5000, server=None, workers=1, threads=DEFAULT_THREADS,
+          collector=True, collector_workers=1, collector_metrics_port=None):
+    """
+    生产模式启动Web应用，并以子进程方式管理后台采集服务
+
+    参数:
+    server: 'gunicorn'、'waitress' 或 'werkzeug'，默认自动选择
+    workers: Web进程数（仅 gunicorn 支持多进程）
+    threads: 每个Web进程的处理线程数
+    collector: 是否同时启动后台采集服务
+    collector_workers: 采集分片工作进程数，传给 background_service.py --workers
+    """
+    server = server or available_server()
+    if server != 'gunicorn' and workers > 1:
+        logger.warning("%s 不支持多进程，Web进程数按 1 处理", server)
+
+    owner_pid = os.getpid()
+    metrics_dir = prepare_metrics_dir(workers) if server == 'gunicorn' else None
+
+    collector_process = None
+    if collector:
+        collector_process = CollectorProcess(collector_workers, collector_metrics_port)
+        collector_process.start()
+
+    # SIGTERM 按正常退出处理，确保采集进程随之停止
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    from app import app
+    logger.info("Web服务已启动: http://%s:%d/，服务器: %s，进程数: %d，每进程线程数: %d",
+                host, port, server, workers if server == 'gunicorn' else 1, threads)
+    try:
+        if server == 'gunicorn':
+            serve_gunicorn(app, host, port, workers, threads)
+        elif server == 'waitress':
+            serve_waitress(app, host, port, threads)
+        else:
+            serve_werkzeug(app, host, port, threads)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if collector_process is not None:
+            collector_process.stop()
+        # gunicorn 工作进程退出时也会经过这里，只有主进程删除汇总目录
+        if metrics_dir and os.getpid() == owner_pid:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        logger.info("Web服务已停止")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='股票行情监控系统（生产模式）')
+    parser.add_argument('--host', default=os.environ.get('STOCK_WEB_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('STOCK_WEB_PORT', 5000)))
+    parser.add_argument('--server', choices=['gunicorn', 'waitress', 'werkzeug'],
+                        help='WSGI服务器，默认按 gunicorn、waitress、werkzeug 的顺序自动选择')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('STOCK_WEB_WORKERS', 1)),
+                        help='Web进程数（仅 gunicorn）')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('STOCK_WEB_THREADS', DEFAULT_THREADS)),
+                        help='每个Web进程的处理线程数')
+    parser.add_argument('--no-collector', action='store_true', help='不启动后台采集服务')
+    parser.add_argument('--collector-workers', type=int, default=1, help='采集分片工作进程数')
+    parser.add_argument('--collector-metrics-port', type=int, help='采集服务的 /metrics 端口')
+    args = parser.parse_args()
+
+    configure_logging()
+    serve(args.host, args.port, args.server, max(1, args.workers), max(1, args.threads),
+          not args.no_collector, args.collector_workers, args.collector_metrics_port)
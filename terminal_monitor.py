@@ -0,0 +1,327 @@
+import sys
+import time
+import shutil
+import signal
+import logging
+import argparse
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import get_stock_quote
+import quote_client
+from text_chart import sparkline
+
+logger = logging.getLogger(__name__)
+
+# 默认刷新间隔（秒）
+REFRESH_INTERVAL = 1.0
+
+# 每只股票保留的价格点数（走势图按终端宽度从中抽样）
+HISTORY_POINTS = 2000
+
+# 并发请求线程数（每个线程负责一批 BATCH_SIZE 只股票）
+FETCH_THREADS = 8
+
+# 走势图最小宽度
+MIN_SPARK_WIDTH = 10
+
+# ANSI 控制序列
+CSI = '\x1b['
+RESET = CSI + '0m'
+RED = CSI + '31m'    # 上涨
+GREEN = CSI + '32m'  # 下跌
+DIM = CSI + '2m'
+BOLD = CSI + '1m'
+
+# 表格列：(标题, 显示宽度, 对齐方式)；最后的走势图列占用剩余宽度
+COLUMNS = (
+    ('代码', 6, '<'),
+    ('名称', 10, '<'),
+    ('现价', 9, '>'),
+    ('涨跌幅', 8, '>'),
+    ('涨跌额', 8, '>'),
+    ('成交量(手)', 11, '>'),
+    ('时间', 9, '<'),
+)
+
+# 表头和状态栏占用的行数
+HEADER_ROWS = 2
+FOOTER_ROWS = 1
+
+def display_width(text):
+    """终端显示宽度：中文等全角字符占两列"""
+    return sum(2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1 for char in text)
+
+def fit(text, width, align='<'):
+    """按显示宽度截断并补齐空格"""
+    if display_width(text) > width:
+        result = ''
+        for char in text:
+            if display_width(result + char) > width:
+                break
+            result += char
+        text = result
+    padding = ' ' * (width - display_width(text))
+    return padding + text if align == '>' else text + padding
+
+class SymbolState:
+    """一只股票的最新行情、价格历史和已格式化的单元格"""
+
+    __slots__ = ('code', 'prices', 'last_tick', 'quote', 'cells', 'spark', 'spark_width', 'dirty')
+
+    def __init__(self, code):
+        self.code = code
+        self.prices = deque(maxlen=HISTORY_POINTS)
+        self.last_tick = None
+        self.quote = None
+        self.cells = None
+        self.spark = ''
+        self.spark_width = 0
+        self.dirty = True
+
+    def update(self, stock_info):
+        """加入一次行情；行情时间未变化（没有新成交）时不记录价格点"""
+        tick = (stock_info['日期'], stock_info['时间'])
+        stale = stock_info.get('数据过期', False)
+        if tick == self.last_tick and self.quote is not None and self.quote.get('数据过期', False) == stale:
+            return
+        if tick != self.last_tick and stock_info['当前价格'] > 0:
+            self.prices.append(stock_info['当前价格'])
+        self.last_tick = tick
+        self.quote = stock_info
+        self.dirty = True
+
+    def render(self, spark_width):
+        """返回该行各单元格（含颜色）的列表，只在行情或宽度变化时重新格式化"""
+        if not self.dirty and spark_width == self.spark_width and self.cells is not None:
+            return self.cells
+        quote = self.quote
+        if quote is None:
+            self.cells = [fit(self.code, COLUMNS[0][1])] + [DIM + fit('--', width, align) + RESET
+                                                            for _, width, align in COLUMNS[1:]] + ['']
+        else:
+            decimals = quote.get('价格小数位数', 2)
+            change = quote['涨跌额']
+            color = RED if change > 0 else GREEN if change < 0 else ''
+            end = RESET if color else ''
+            values = (
+                quote['股票代码'],
+                quote['股票名称'],
+                f"{quote['当前价格']:.{decimals}f}",
+                quote['涨跌幅'],
+                f"{change:+.{decimals}f}",
+                quote['成交量'].rstrip('手'),
+                quote['时间'] + ('*' if quote.get('数据过期') else ''),
+            )
+            self.cells = [fit(value, width, align) for value, (_, width, align) in zip(values, COLUMNS)]
+            for index in (2, 3, 4):
+                self.cells[index] = color + self.cells[index] + end
+            self.spark = sparkline(self.prices, spark_width)
+            self.cells.append(color + fit(self.spark, spark_width) + end)
+        self.spark_width = spark_width
+        self.dirty = False
+        return self.cells
+
+class ScreenRenderer:
+    """
+    增量刷新终端：记住上一帧每个单元格的内容，只输出发生变化的单元格（光标定位 + 新内容），
+    每帧合并为一次写入；终端尺寸变化时整屏重绘
+    """
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self.size = None
+        self.previous = {}
+        self.bytes_written = 0
+
+    def start(self):
+        # 切换到备用屏幕并隐藏光标，退出时恢复
+        self._write(CSI + '?1049h' + CSI + '?25l')
+
+    def stop(self):
+        self._write(RESET + CSI + '?25h' + CSI + '?1049l')
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+        self.bytes_written = len(data.encode('utf-8'))
+
+    def draw(self, rows, size):
+        """
+        参数:
+        rows: 每行为 [(起始列, 单元格文本, 单元格宽度), ...]
+        size: 终端尺寸 (列数, 行数)
+        """
+        output = []
+        if size != self.size:
+            self.size = size
+            self.previous = {}
+            output.append(CSI + '2J')
+
+        current = {}
+        for row_index, cells in enumerate(rows):
+            for column, text, width in cells:
+                key = (row_index, column)
+                current[key] = (text, width)
+                if self.previous.get(key) != (text, width):
+                    output.append(f"{CSI}{row_index + 1};{column + 1}H{text}")
+        # 上一帧有、这一帧没有的单元格（例如股票数减少）用空格覆盖
+        for key, (_, width) in self.previous.items():
+            if key not in current:
+                output.append(f"{CSI}{key[0] + 1};{key[1] + 1}H{' ' * width}")
+        self.previous = current
+        if output:
+            self._write(''.join(output))
+        else:
+            self.bytes_written = 0
+
+def _batches(codes, batch_size):
+    for i in range(0, len(codes), batch_size):
+        yield codes[i:i + batch_size]
+
+class TerminalMonitor:
+    """
+    多股票终端监控：批量获取行情，以表格和走势图显示，只刷新变化的单元格
+    """
+
+    def __init__(self, codes, interval=REFRESH_INTERVAL, renderer=None, client=None):
+        self.codes = list(dict.fromkeys(codes))
+        self.interval = interval
+        self.renderer = renderer or ScreenRenderer()
+        self.client = client or quote_client.default_client
+        self.states = {code: SymbolState(code) for code in self.codes}
+        self.executor = ThreadPoolExecutor(max_workers=FETCH_THREADS, thread_name_prefix="monitor-fetch")
+        self.fetch_seconds = 0.0
+        self.render_seconds = 0.0
+        self.errors = 0
+
+    def fetch(self):
+        """每批 BATCH_SIZE 只股票一次请求，多批并发；上游不可用时使用过期缓存"""
+        start = time.perf_counter()
+        futures = [self.executor.submit(self.client.get_quotes, batch, True)
+                   for batch in _batches(self.codes, get_stock_quote.BATCH_SIZE)]
+        self.errors = 0
+        for future in futures:
+            try:
+                for code, stock_info in future.result().items():
+                    state = self.states.get(code)
+                    if state is not None:
+                        state.update(stock_info)
+            except Exception as e:
+                self.errors += 1
+                logger.debug("批量获取股票数据失败: %s", e)
+        self.fetch_seconds = time.perf_counter() - start
+
+    def build_rows(self, size):
+        """按终端尺寸生成各行的单元格"""
+        columns, lines = size
+        fixed_width = sum(width + 1 for _, width, _ in COLUMNS)
+        spark_width = max(MIN_SPARK_WIDTH, columns - fixed_width - 1)
+        visible = max(0, lines - HEADER_ROWS - FOOTER_ROWS)
+
+        offsets = []
+        position = 0
+        for _, width, _ in COLUMNS:
+            offsets.append((position, width))
+            position += width + 1
+        offsets.append((position, spark_width))
+
+        titles = [fit(title, width, align) for title, width, align in COLUMNS] + [fit('走势', spark_width)]
+        rows = [[(offset, BOLD + title + RESET, width) for (offset, width), title in zip(offsets, titles)],
+                [(0, DIM + '-' * min(columns, position + spark_width) + RESET, min(columns, position + spark_width))]]
+        for code in self.codes[:visible]:
+            cells = self.states[code].render(spark_width)
+            rows.append([(offset, text, width) for (offset, width), text in zip(offsets, cells)])
+
+        hidden = len(self.codes) - visible
+        status = (f"{time.strftime('%H:%M:%S')}  股票 {len(self.codes)} 只"
+                  + (f"（另有 {hidden} 只未显示）" if hidden > 0 else "")
+                  + f"  获取 {self.fetch_seconds * 1000:.0f}ms  绘制 {self.render_seconds * 1000:.1f}ms"
+                  + f"  输出 {self.renderer.bytes_written}B"
+                  + (f"  失败批次 {self.errors}" if self.errors else "")
+                  + "  * 为过期数据  Ctrl+C 退出")
+        rows.append([(0, DIM + fit(status, columns - 1) + RESET, columns - 1)])
+        return rows
+
+    def render(self):
+        start = time.perf_counter()
+        size = tuple(shutil.get_terminal_size())
+        self.renderer.draw(self.build_rows(size), size)
+        self.render_seconds = time.perf_counter() - start
+
+    def run(self):
+        self.renderer.start()
+        try:
+            while True:
+                started = time.monotonic()
+                self.fetch()
+                self.render()
+                time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.renderer.stop()
+            self.executor.shutdown(wait=False)
+
+    def print_table(self, stream=sys.stdout):
+        """输出一次纯文本表格（不使用光标控制，适合重定向到文件或管道）"""
+        spark_width = max(MIN_SPARK_WIDTH, shutil.get_terminal_size().columns
+                          - sum(width + 1 for _, width, _ in COLUMNS) - 1)
+        lines = [' '.join([fit(title, width, align) for title, width, align in COLUMNS] + ['走势'])]
+        for code in self.codes:
+            cells = self.states[code].render(spark_width)
+            lines.append(' '.join(cells))
+        if not stream.isatty():
+            lines = [_strip_ansi(line) for line in lines]
+        stream.write('\n'.join(lines) + '\n')
+
+def _strip_ansi(text):
+    for code in (RESET, RED, GREEN, DIM, BOLD):
+        text = text.replace(code, '')
+    return text
+
+def load_codes(args):
+    """按命令行参数汇总要监控的股票代码"""
+    codes = list(args.codes)
+    if args.file:
+        with open(args.file, encoding='utf-8') as f:
+            codes += [line.strip() for line in f if line.strip()]
+    if args.watchlist:
+        import watchlist_cache
+        codes += watchlist_cache.get_snapshot().codes
+    valid = []
+    for code in codes:
+        try:
+            get_stock_quote.get_full_code(code)
+            valid.append(code)
+        except ValueError:
+            logger.warning("忽略无效的股票代码: %s", code)
+    return valid
+
+if __name__ == '__main__':
+    from metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description='多股票终端监控（表格 + 走势图，增量刷新）')
+    parser.add_argument('codes', nargs='*', help='股票代码，例如 600000 000001')
+    parser.add_argument('--file', help='股票代码文件，每行一个（例如 universe_codes.txt）')
+    parser.add_argument('--watchlist', action='store_true', help='监控数据库中的关注列表')
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL, help='刷新间隔（秒）')
+    parser.add_argument('--once', action='store_true', help='获取一次并输出纯文本表格后退出')
+    args = parser.parse_args()
+    interactive = not args.once and sys.stdout.isatty()
+    # 日志与表格输出到同一终端，全屏监控时只输出错误，获取失败的批次数显示在状态栏
+    configure_logging(level=logging.ERROR if interactive else None)
+
+    codes = load_codes(args)
+    if not codes:
+        parser.error('请指定股票代码、--file 或 --watchlist')
+
+    monitor = TerminalMonitor(codes, args.interval)
+    if interactive:
+        # SIGTERM 按正常退出处理，恢复终端状态
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        monitor.run()
+    else:
+        monitor.fetch()
+        monitor.print_table()
+        monitor.executor.shutdown(wait=False)
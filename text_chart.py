@@ -0,0 +1,32 @@
+# 文本走势图工具：序列抽样和方块字符走势图，供命令行监控（get_stock_quote、terminal_monitor）共用
+
+# 走势图字符，从低到高
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+def downsample(values, width):
+    """
+    将序列抽样为不超过 width 个点：按时间均分为 width 段，每段取最后一个值（即该段结束时的价格）
+
+    参数:
+    values: 支持索引的序列
+    width: 输出点数上限
+
+    返回:
+    列表
+    """
+    count = len(values)
+    if count <= width:
+        return list(values)
+    return [values[(i + 1) * count // width - 1] for i in range(width)]
+
+def sparkline(values, width):
+    """用方块字符绘制走势图，输入先抽样到 width 个点"""
+    points = downsample(values, width)
+    if not points:
+        return ''
+    low = min(points)
+    span = max(points) - low
+    if span <= 0:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(points)
+    top = len(SPARK_CHARS) - 1
+    return ''.join(SPARK_CHARS[int((value - low) / span * top + 0.5)] for value in points)
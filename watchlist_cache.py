@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from models import Session, Watchlist, get_watchlist_version
+
+logger = logging.getLogger(__name__)
+
+# 检查其他进程是否修改了关注列表的间隔（秒）；本进程内的修改通过 notify() 立即生效
+VERSION_POLL_INTERVAL = 5.0
+
+# 关注列表中的一项（只读，可在线程间共享）
+WatchlistEntry = namedtuple('WatchlistEntry', ['id', 'stock_code', 'stock_name', 'market', 'added_at'])
+
+class WatchlistSnapshot(namedtuple('WatchlistSnapshot', ['version', 'items'])):
+    """某一版本的关注列表快照，items 按添加顺序排列"""
+
+    __slots__ = ()
+
+    @property
+    def codes(self):
+        return [item.stock_code for item in self.items]
+
+    def find(self, stock_code):
+        for item in self.items:
+            if item.stock_code == stock_code:
+                return item
+        return None
+
+class WatchlistCache:
+    """
+    进程内共享的关注列表快照
+
+    关注列表只在增删时变化，而采集服务每轮、Web接口每次请求都要读取它。
+    缓存持有一份不可变的快照，读取时不访问数据库；只在以下情况重新加载：
+    - 本进程内修改后调用了 notify()
+    - 距上次检查超过 poll_interval 秒，且数据库中的版本号（watchlist_version 表）已变化
+    版本号检查是单行查询，与关注列表的规模无关。
+    """
+
+    def __init__(self, session_factory=Session, poll_interval=VERSION_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """本进程修改了关注列表，下次读取时重新加载"""
+        self._dirty = True
+
+    def _load(self, db_session, version):
+        items = tuple(
+            WatchlistEntry(item.id, item.stock_code, item.stock_name, item.market, item.added_at)
+            for item in db_session.query(Watchlist).order_by(Watchlist.id).all()
+        )
+        logger.debug("关注列表已加载，版本: %d，股票数: %d", version, len(items))
+        return WatchlistSnapshot(version, items)
+
+    def get(self):
+        """
+        返回当前的关注列表快照
+
+        返回:
+        WatchlistSnapshot 实例
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and not self._dirty and now - self._checked_at < self.poll_interval:
+            return snapshot
+
+        with self._lock:
+            # 等待锁期间其他线程可能已经刷新
+            snapshot = self._snapshot
+            if snapshot is not None and not self._dirty and time.monotonic() - self._checked_at < self.poll_interval:
+                return snapshot
+            # 在读取数据库之前清除标记，加载期间再次调用 notify() 时标记保留到下次读取；
+            # 加载失败时恢复标记，下次读取重试，而不是继续返回旧快照直到版本号再次变化
+            self._dirty = False
+            db_session = self.session_factory()
+            try:
+                # 修改关注列表时版本号在同一事务中递增，版本号不变说明快照仍然有效
+                version = get_watchlist_version(db_session)
+                if snapshot is None or version != snapshot.version:
+                    snapshot = self._load(db_session, version)
+            except Exception:
+                self._dirty = True
+                raise
+            finally:
+                db_session.close()
+            self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+            return snapshot
+
+# 进程内共享的默认缓存
+default_cache = WatchlistCache()
+
+def get_snapshot():
+    return default_cache.get()
+
+def notify_changed():
+    default_cache.notify()